@@ -0,0 +1,166 @@
+import asyncio
+import concurrent.futures
+import logging
+import sys
+import time
+from collections import deque
+
+logger = logging.getLogger('telegram')
+
+# Command classes, in the order they are scheduled
+INTERACTIVE = 'interactive'  # The user is waiting: sending, opening a chat, previews
+BACKGROUND = 'background'  # Prefetch, enrichment, read receipts, catch-up
+TRANSFER = 'transfer'  # File uploads, which can run for minutes
+
+# Commands of a class running at once on one account. Each class has its own
+# slots, so background work can never hold up interactive commands, and a
+# long transfer holds up neither.
+CLASS_LIMITS = {INTERACTIVE: 4, BACKGROUND: 2, TRANSFER: 1}
+# Default deadlines in seconds, counted from submission; 0 means none
+DEFAULT_TIMEOUTS = {INTERACTIVE: 30, BACKGROUND: 300, TRANSFER: 0}
+
+# Frame of each running CommandScheduler._run -> its handle. The profiler's
+# thread looks commands up here instead of reading locals of a running frame.
+running_commands = {}
+
+class CommandHandle:
+    """A scheduled command; usable from any thread"""
+    def __init__(self, name, kind, deadline, scheduler):
+        self.name = name
+        self.kind = kind
+        self.deadline = deadline  # time.monotonic() value, or None
+        self.future = concurrent.futures.Future()
+        self._scheduler = scheduler
+
+    def cancel(self):
+        """Drop the command if it is queued, or cancel it if it is running"""
+        if self.future.done():
+            return False
+        if not self.future.cancel() and self._scheduler is not None:
+            # Forwarded handles have no scheduler; theirs just lost the race to finish
+            self._scheduler.cancel_running(self)
+        return True
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        """Wait for the result, by default no longer than the command's deadline"""
+        if timeout is None and self.deadline is not None:
+            timeout = max(0, self.deadline - time.monotonic())
+        return self.future.result(timeout)
+
+    def add_done_callback(self, fn):
+        """Call fn with the underlying concurrent.futures.Future once done"""
+        self.future.add_done_callback(fn)
+
+def completed_handle(name, kind=INTERACTIVE, result=None):
+    """A handle for fire-and-forget work that is not scheduled here, e.g. sent to the daemon"""
+    handle = CommandHandle(name, kind, None, None)
+    handle.future.set_result(result)
+    return handle
+
+def forwarded_handle(name, kind, future, timeout=None):
+    """A handle over a concurrent.futures.Future from run_coroutine_threadsafe"""
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUTS[kind]
+    handle = CommandHandle(name, kind, time.monotonic() + timeout if timeout else None, None)
+    handle.future = future  # Cancelling it cancels the coroutine
+    return handle
+
+class CommandScheduler:
+    """Runs an account's commands on the worker loop by class
+
+    Queued commands start in class order: interactive, then background, then
+    transfers, and each class runs at most its CLASS_LIMITS share at once. A
+    command still queued at its deadline fails with TimeoutError without
+    running; a running one is cancelled when its deadline passes.
+    """
+    def __init__(self, loop, track=None, limits=CLASS_LIMITS):
+        self.loop = loop
+        self.track = track  # Wraps each command, e.g. to cancel it on shutdown
+        self.limits = dict(limits)
+        self._queues = {kind: deque() for kind in self.limits}
+        self._running = {kind: 0 for kind in self.limits}
+        self._tasks = {}  # handle -> task
+
+    def submit(self, name, coro_fn, *args, kind=INTERACTIVE, timeout=None, **kwargs):
+        """Queue coro_fn(*args, **kwargs) from any thread and return its handle"""
+        if timeout is None:
+            timeout = DEFAULT_TIMEOUTS[kind]
+        deadline = time.monotonic() + timeout if timeout else None
+        handle = CommandHandle(name, kind, deadline, self)
+        self.loop.call_soon_threadsafe(self._enqueue, handle, coro_fn, args, kwargs)
+        return handle
+
+    def queued(self, kind):
+        return len(self._queues[kind])
+
+    def _enqueue(self, handle, coro_fn, args, kwargs):
+        self._queues[handle.kind].append((handle, coro_fn, args, kwargs))
+        self._pump()
+
+    def _pump(self):
+        for kind in self._queues:
+            queue = self._queues[kind]
+            while queue and self._running[kind] < self.limits[kind]:
+                handle, coro_fn, args, kwargs = queue.popleft()
+                if not handle.future.set_running_or_notify_cancel():
+                    continue  # Cancelled while queued
+                timeout = None
+                if handle.deadline is not None:
+                    timeout = handle.deadline - time.monotonic()
+                    if timeout <= 0:
+                        handle.future.set_exception(TimeoutError(f"{handle.name} expired in the queue"))
+                        continue
+                self._running[kind] += 1
+                coro = self._run(handle, coro_fn(*args, **kwargs), timeout)
+                self._tasks[handle] = asyncio.ensure_future(self.track(coro) if self.track else coro)
+
+    async def _run(self, handle, coro, timeout):
+        # The deadline cancels this task itself rather than wrapping the command
+        # in another task as wait_for does, so the command runs under this
+        # frame, where the profiler finds its name
+        expired = False
+        task = asyncio.current_task()
+        frame = sys._getframe()
+        running_commands[frame] = handle
+
+        def expire():
+            nonlocal expired
+            expired = True
+            task.cancel()
+
+        timer = self.loop.call_later(timeout, expire) if timeout is not None else None
+        try:
+            result = await coro
+            handle.future.set_result(result)
+        except asyncio.CancelledError:
+            if not expired:
+                handle.future.set_exception(concurrent.futures.CancelledError())
+                raise
+            logger.warning(f"Command {handle.name} missed its deadline")
+            handle.future.set_exception(TimeoutError(f"{handle.name} missed its deadline"))
+        except Exception as e:
+            handle.future.set_exception(e)
+        finally:
+            running_commands.pop(frame, None)
+            if timer:
+                timer.cancel()
+            self._running[handle.kind] -= 1
+            self._tasks.pop(handle, None)
+            self._pump()
+
+    def cancel_running(self, handle):
+        def cancel():
+            task = self._tasks.get(handle)
+            if task:
+                task.cancel()
+        self.loop.call_soon_threadsafe(cancel)
+
+    def close(self):
+        """Cancel every queued command (on the loop); running ones are cancelled by the owner"""
+        for queue in self._queues.values():
+            while queue:
+                handle = queue.popleft()[0]
+                handle.future.cancel()
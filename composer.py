@@ -0,0 +1,150 @@
+class GapBuffer:
+    """Text buffer with a movable gap at the cursor
+
+    Inserting or deleting at the cursor is O(1) amortized. Moving the cursor
+    costs O(distance), which for typing and short cursor moves is tiny.
+    """
+    def __init__(self, text="", capacity=64):
+        capacity = max(capacity, len(text) * 2)
+        self._buf = list(text) + [''] * (capacity - len(text))
+        self._gap_start = len(text)
+        self._gap_end = capacity
+
+    def __len__(self):
+        return len(self._buf) - (self._gap_end - self._gap_start)
+
+    @property
+    def cursor(self):
+        return self._gap_start
+
+    def _grow(self, needed):
+        gap = self._gap_end - self._gap_start
+        if gap >= needed:
+            return
+        extra = max(needed - gap, len(self._buf))
+        self._buf[self._gap_end:self._gap_end] = [''] * extra
+        self._gap_end += extra
+
+    def move_to(self, position):
+        """Move the gap (and cursor) to position"""
+        position = max(0, min(position, len(self)))
+        if position < self._gap_start:
+            count = self._gap_start - position
+            self._buf[self._gap_end - count:self._gap_end] = self._buf[position:self._gap_start]
+            self._gap_start -= count
+            self._gap_end -= count
+        elif position > self._gap_start:
+            count = position - self._gap_start
+            self._buf[self._gap_start:self._gap_start + count] = self._buf[self._gap_end:self._gap_end + count]
+            self._gap_start += count
+            self._gap_end += count
+
+    def insert(self, text):
+        """Insert text at the cursor in one step, however long it is"""
+        self._grow(len(text))
+        self._buf[self._gap_start:self._gap_start + len(text)] = text
+        self._gap_start += len(text)
+
+    def delete_before(self, count=1):
+        self._gap_start = max(0, self._gap_start - count)
+
+    def delete_after(self, count=1):
+        self._gap_end = min(len(self._buf), self._gap_end + count)
+
+    def text(self):
+        return ''.join(self._buf[:self._gap_start]) + ''.join(self._buf[self._gap_end:])
+
+class Composer:
+    """Multi-line message editor built on a gap buffer
+
+    The joined text and its line split are cached between edits, so redrawing
+    an unchanged composer costs nothing.
+    """
+    def __init__(self, text=""):
+        self._buffer = GapBuffer(text)
+        self._text = None
+        self._lines = None
+
+    def _changed(self):
+        self._text = None
+        self._lines = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self._buffer.text()
+        return self._text
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            self._lines = self.text.split('\n')
+        return self._lines
+
+    @property
+    def cursor(self):
+        return self._buffer.cursor
+
+    def is_blank(self):
+        return not self.text.strip()
+
+    def set_text(self, text):
+        self._buffer = GapBuffer(text)
+        self._changed()
+
+    def clear(self):
+        self.set_text("")
+
+    def insert(self, text):
+        if text:
+            self._buffer.insert(text)
+            self._changed()
+
+    def backspace(self):
+        if self.cursor > 0:
+            self._buffer.delete_before()
+            self._changed()
+
+    def delete(self):
+        if self.cursor < len(self._buffer):
+            self._buffer.delete_after()
+            self._changed()
+
+    def cursor_row_col(self):
+        """Line number and column of the cursor"""
+        before = self.text[:self.cursor]
+        row = before.count('\n')
+        return row, self.cursor - (before.rfind('\n') + 1)
+
+    def _line_start(self, row):
+        return sum(len(line) + 1 for line in self.lines[:row])
+
+    def left(self):
+        self._buffer.move_to(self.cursor - 1)
+
+    def right(self):
+        self._buffer.move_to(self.cursor + 1)
+
+    def home(self):
+        row, _ = self.cursor_row_col()
+        self._buffer.move_to(self._line_start(row))
+
+    def end(self):
+        row, _ = self.cursor_row_col()
+        self._buffer.move_to(self._line_start(row) + len(self.lines[row]))
+
+    def up(self):
+        """Move to the previous line; returns False on the first line"""
+        row, col = self.cursor_row_col()
+        if row == 0:
+            return False
+        self._buffer.move_to(self._line_start(row - 1) + min(col, len(self.lines[row - 1])))
+        return True
+
+    def down(self):
+        """Move to the next line; returns False on the last line"""
+        row, col = self.cursor_row_col()
+        if row >= len(self.lines) - 1:
+            return False
+        self._buffer.move_to(self._line_start(row + 1) + min(col, len(self.lines[row + 1])))
+        return True
@@ -1,3 +1,11 @@
 PHONE = "PHONE WITHOUT + BUT WITH COUNTRY CODE"
 API_ID="API ID"
-API_HASH="API HASH"
\ No newline at end of file
+API_HASH="API HASH"
+# Optional: watch several accounts from one UI (log in to each with login.py)
+# ACCOUNTS = ["FIRST PHONE", "SECOND PHONE"]
+# Optional: extra chat folders, switched with Shift+[ and Shift+] (see folders.py).
+# Folders set up in Telegram itself are added automatically.
+# FOLDERS = [
+#     {'name': 'Work', 'include': [-1001234567890, 123456789]},
+#     {'name': 'Quiet groups', 'types': ['group', 'supergroup'], 'muted': True},
+# ]
@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import os
+import queue
+import signal
+import sys
+import threading
+
+from telegram_worker import logger, ui_queue, run_telegram_workers
+from ipc import PROTOCOL_VERSION, SOCKET_PATH, encode_frame, read_frame
+from downloads import PRIORITY_PREVIEW
+
+# A client whose unsent output grows past this is too slow to keep up and is
+# disconnected rather than buffering without bound in the daemon
+MAX_CLIENT_BACKLOG = 16 * 1024 * 1024
+# Events about one chat's history, sent only to the UIs that have it open
+CHAT_EVENTS = ("chat_history_loaded", "older_history_dropped", "anchor_dropped")
+
+class DaemonServer:
+    """Serves the workers' events and commands to attached UIs over a Unix socket"""
+    def __init__(self, workers, path=SOCKET_PATH):
+        self.workers = workers
+        self.path = path
+        self.server = None
+        self.clients = set()
+        # Latest dialog list and folders per account, replayed to UIs as they attach
+        self.chats_by_account = {}
+        self.dialogs = {}  # (account, chat_id) -> the dialog in chats_by_account
+        self.folders_by_account = {}
+        self.users = {}  # Sender id -> latest profile from any account
+        # Photo renders in progress, per UI by the request id its reply answers
+        self.renders = {}  # writer -> {request_id: task}
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        # Created owner-only, so no other user can connect before it is secured
+        umask = os.umask(0o177)
+        try:
+            self.server = await asyncio.start_unix_server(self._handle_client, path=self.path)
+        finally:
+            os.umask(umask)
+        logger.info(f"Daemon listening on {self.path}")
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+        for writer in list(self.clients):
+            writer.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def broadcast(self, event):
+        """Forward a worker event to the attached UIs it concerns (runs on the worker loop)
+
+        Answers to one UI's command go to that UI, history of a chat to the
+        UIs that have it open, everything else to every UI.
+        """
+        client = event.pop("client", None)
+        if event.get("type") == "chats_loaded" and "account" in event:
+            self.chats_by_account[event["account"]] = event["chats"]
+            self.dialogs = {key: chat for key, chat in self.dialogs.items() if key[0] != event["account"]}
+            self.dialogs.update(((event["account"], chat['id']), chat) for chat in event["chats"])
+        elif event.get("type") == "dialogs_changed" and event.get("account") in self.chats_by_account:
+            changed = {chat['id']: chat for chat in event["chats"]}
+            self.dialogs.update(((event["account"], chat['id']), chat) for chat in event["chats"])
+            chats = self.chats_by_account[event["account"]]
+            # UIs order the list themselves, so changed dialogs only need replacing
+            self.chats_by_account[event["account"]] = (
+                [changed.pop(chat['id'], chat) for chat in chats] + list(changed.values()))
+        elif event.get("type") == "new_message":
+            self._note_new_message(event)
+        elif event.get("type") == "users":
+            self.users.update((user["id"], user) for user in event["users"])
+        elif event.get("type") == "chat_folders" and "account" in event:
+            self.folders_by_account[event["account"]] = event["folders"]
+
+        if not self.clients:
+            return
+        if client is not None:
+            recipients = [client] if client in self.clients else []
+        elif event.get("type") in CHAT_EVENTS:
+            worker = self.workers.get(event.get("account"))
+            recipients = [writer for writer, chat_id in worker.open_chats.items()
+                          if chat_id == event["chat_id"] and writer in self.clients]
+        else:
+            recipients = list(self.clients)
+        if not recipients:
+            return
+        frame = encode_frame(event)
+        for writer in recipients:
+            if writer.transport.get_write_buffer_size() > MAX_CLIENT_BACKLOG:
+                logger.warning("Dropping UI that stopped reading events")
+                self.clients.discard(writer)
+                writer.close()
+                continue
+            writer.write(frame)
+
+    def _note_new_message(self, event):
+        """Keep the replayed dialog current: its position, and unread count if no UI shows it"""
+        chat = self.dialogs.get((event.get("account"), event["chat_id"]))
+        if chat is None:
+            return  # A new dialog; the next dialog sync adds it
+        message = event["message"]
+        chat['last_message_date'] = message['timestamp']
+        worker = self.workers.get(event["account"])
+        if not message.get('is_outgoing') and not worker.is_open(event["chat_id"]):
+            chat['unread_messages_count'] = chat.get('unread_messages_count', 0) + 1
+
+    def _note_read(self, worker, chat_id, max_id):
+        """Lower a replayed dialog's unread count to what is left after a read acknowledgement"""
+        chat = self.dialogs.get((worker.account, chat_id))
+        if chat is None or chat_id in worker.detached_chats:
+            return
+        remaining = sum(1 for m in worker.messages_per_chat.get(chat_id, [])
+                        if not m.get('is_outgoing') and m.get('id', 0) > max_id)
+        chat['unread_messages_count'] = min(chat.get('unread_messages_count', 0), remaining)
+        if not remaining:
+            chat['unread_mentions_count'] = 0
+            chat['unread_mark'] = False
+
+    async def _handle_client(self, reader, writer):
+        try:
+            hello = await read_frame(reader)
+            if not hello or hello.get("cmd") != "hello" or hello.get("version") != PROTOCOL_VERSION:
+                writer.write(encode_frame({
+                    "type": "error",
+                    "message": f"Unsupported protocol version, daemon speaks {PROTOCOL_VERSION}"
+                }))
+                await writer.drain()
+                return
+
+            writer.write(encode_frame({
+                "type": "hello",
+                "version": PROTOCOL_VERSION,
+                "accounts": [{"account": w.account, "label": w.account_label} for w in self.workers]
+            }))
+            # Replay warm state so the UI is current without touching Telegram
+            if self.users:
+                writer.write(encode_frame({"type": "users", "users": list(self.users.values())}))
+            for account, chats in self.chats_by_account.items():
+                writer.write(encode_frame({
+                    "type": "chats_loaded",
+                    "account": account,
+                    "chats": chats,
+                    "is_initial": True
+                }))
+            for account, folders in self.folders_by_account.items():
+                writer.write(encode_frame({"type": "chat_folders", "account": account, "folders": folders}))
+            self.clients.add(writer)
+            self.renders[writer] = {}
+            logger.info(f"UI attached ({len(self.clients)} attached)")
+
+            while True:
+                command = await read_frame(reader)
+                if command is None:
+                    break
+                try:
+                    self._dispatch(command, writer)
+                except Exception as e:
+                    logger.error(f"Error handling command {command.get('cmd')}: {e}", exc_info=True)
+        except Exception as e:
+            logger.error(f"Error serving UI: {e}", exc_info=True)
+        finally:
+            self.clients.discard(writer)
+            for task in self.renders.pop(writer, {}).values():
+                task.cancel()
+            for worker in self.workers:
+                worker.close_client(writer)
+            writer.close()
+            logger.info(f"UI detached ({len(self.clients)} attached)")
+
+    def _dispatch(self, command, writer):
+        worker = self.workers.get(command.get("account"))
+        if worker is None:
+            return
+        cmd = command.get("cmd")
+        if cmd == "set_current_chat":
+            worker.set_current_chat(command["chat_id"], command.get("unread_count", 0), client=writer)
+        elif cmd == "send_message":
+            worker.send_message(command["text"], command["chat_id"], client=writer)
+        elif cmd == "send_file":
+            worker.send_file(command["path"], command["chat_id"], command.get("caption", ""), client=writer)
+        elif cmd == "cancel_upload":
+            worker.cancel_upload(command["upload_id"])
+        elif cmd == "load_chat_history":
+            worker.request_history(
+                command["chat_id"],
+                limit=command.get("limit", 200),
+                before_message_id=command.get("before_message_id"),
+                after_message_id=command.get("after_message_id"),
+                client=writer
+            )
+        elif cmd == "load_history_at_date":
+            worker.request_history_at(command["chat_id"], command["when"], client=writer)
+        elif cmd == "mark_read":
+            worker.mark_read(command["chat_id"], command["max_id"])
+            self._note_read(worker, command["chat_id"], command["max_id"])
+        elif cmd == "request_users":
+            worker.request_users(command["user_ids"])
+        elif cmd == "request_dialog_metadata":
+            worker.request_dialog_metadata(command["chat_ids"])
+        elif cmd == "render_photo":
+            # Rendering can take a while; keep reading this UI's commands meanwhile
+            renders = self.renders[writer]
+            request_id = command.get("request_id")
+            renders[request_id] = asyncio.ensure_future(self._reply_render_photo(worker, command, writer))
+            renders[request_id].add_done_callback(lambda _: renders.pop(request_id, None))
+        else:
+            logger.warning(f"Unknown daemon command: {cmd}")
+
+    async def _reply_render_photo(self, worker, command, writer):
+        result = None
+        chat_id = command["chat_id"]
+        message = worker.message_index.lookup(
+            chat_id, worker.messages_per_chat.get(chat_id, [])).get(command["message_id"])
+        if message:
+            handle = worker.request_photo(message, command["max_width"], command.get("max_height"),
+                                          command.get("priority", PRIORITY_PREVIEW))
+            try:
+                result = await asyncio.wrap_future(handle.future)
+            except Exception as e:
+                logger.error(f"Failed to render photo for a UI: {e}")
+        if not writer.is_closing():
+            writer.write(encode_frame({
+                "type": "reply",
+                "request_id": command.get("request_id"),
+                "result": result
+            }))
+
+def detach():
+    """Move the process into the background, detached from the terminal"""
+    if os.fork() > 0:
+        os._exit(0)
+    os.setsid()
+    if os.fork() > 0:
+        os._exit(0)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+
+def run_daemon(path=SOCKET_PATH):
+    workers = run_telegram_workers()
+    server = DaemonServer(workers, path)
+    asyncio.run_coroutine_threadsafe(server.start(), workers.loop).result()
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+    # Workers publish to ui_queue from the loop thread; fan events out on the loop
+    while not stopping.is_set():
+        try:
+            event = ui_queue.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        workers.loop.call_soon_threadsafe(server.broadcast, event)
+
+    logger.info("Stopping daemon...")
+    try:
+        asyncio.run_coroutine_threadsafe(server.close(), workers.loop).result(timeout=1)
+    except Exception as e:
+        logger.error(f"Error closing daemon socket: {e}")
+    workers.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep Telegram connected in the background for main.py to attach to")
+    parser.add_argument('--detach', action='store_true', help="run in the background")
+    parser.add_argument('--socket', default=SOCKET_PATH, help="Unix socket path")
+    args = parser.parse_args()
+    if args.detach:
+        detach()
+    try:
+        run_daemon(args.socket)
+    except Exception as e:
+        logger.error(f"Daemon failed: {e}", exc_info=True)
+        sys.exit(1)
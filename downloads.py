@@ -0,0 +1,224 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger('telegram')
+
+# Download priorities, most urgent first
+PRIORITY_PREVIEW = 0   # The user is waiting on an open preview
+PRIORITY_VISIBLE = 1   # Shown in the message pane
+PRIORITY_PREFETCH = 2  # Likely to be needed soon
+
+MAX_PARALLEL_DOWNLOADS = 3
+MEDIA_CACHE_DIR = 'media_cache'
+MEDIA_CACHE_BYTES = 512 * 1024 * 1024  # Least recently used files are deleted past this
+CHUNK_SIZE = 1024 * 1024  # Pyrogram's stream_media yields 1 MiB chunks
+THROUGHPUT_WINDOW = 5.0  # Seconds averaged for the reported throughput
+STATS_INTERVAL = 0.5  # Minimum seconds between progress reports
+
+class DownloadJob:
+    def __init__(self, unique_id, priority):
+        self.unique_id = unique_id
+        self.priority = priority
+        # Client -> its file_id, for every account waiting on the file; file
+        # ids only work with the account that saw them
+        self.requesters = {}
+        self.client = None  # The requester streaming it, once started
+        self.task = None
+        self.started = False
+        self.handover = False  # Cancelled to restart with another requester
+        self.future = asyncio.get_running_loop().create_future()
+
+class DownloadManager:
+    """Media downloads for every account, run on the worker loop
+
+    Requests for the same file share one download. At most max_parallel
+    downloads run at once, one of them only for previews; the rest wait in priority order, and a queued job
+    asked for again with a higher priority moves up. Files are streamed to
+    disk chunk by chunk under cache_dir, keyed by file_unique_id, so an
+    interrupted download resumes and a finished one is never fetched twice.
+    The cache is kept under max_bytes by deleting the least recently used
+    files.
+
+    Jobs belong to the manager rather than to the account that asked first:
+    when an account goes away, its downloads continue over another account
+    waiting on the same file, and stop only when nobody is left.
+    """
+    def __init__(self, cache_dir=MEDIA_CACHE_DIR, max_parallel=MAX_PARALLEL_DOWNLOADS, on_stats=None,
+                 max_bytes=MEDIA_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_parallel = max_parallel
+        self.on_stats = on_stats
+        self.max_bytes = max_bytes
+        self._files = None  # unique_id -> size of cached files, least recently used first
+        self._cached_bytes = 0
+        self._jobs = {}  # unique_id -> queued or running job
+        self._queue = []  # Heap of (priority, sequence, job)
+        self._sequence = itertools.count()
+        self._active = 0
+        self._samples = deque()  # (time, bytes) received within the window
+        self._last_report = 0
+        self._last_counts = None
+
+    def path_for(self, unique_id):
+        return os.path.join(self.cache_dir, unique_id)
+
+    def _index(self):
+        """The cached files, read from disk on first use and ordered by last use"""
+        if self._files is None:
+            entries = []
+            if os.path.isdir(self.cache_dir):
+                for entry in os.scandir(self.cache_dir):
+                    if entry.is_file() and not entry.name.endswith('.part'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, entry.name, stat.st_size))
+            self._files = OrderedDict((name, size) for _, name, size in sorted(entries))
+            self._cached_bytes = sum(self._files.values())
+        return self._files
+
+    def _touch(self, unique_id):
+        """Mark a cached file as just used; its mtime keeps the order across restarts"""
+        self._files.move_to_end(unique_id)
+        try:
+            os.utime(self.path_for(unique_id))
+        except OSError:
+            pass
+
+    def _add_to_cache(self, unique_id, size):
+        # Replaces the entry of a file deleted behind the cache's back
+        self._cached_bytes += size - self._files.pop(unique_id, 0)
+        self._files[unique_id] = size
+        while self._cached_bytes > self.max_bytes and len(self._files) > 1:
+            evicted, evicted_size = self._files.popitem(last=False)
+            self._cached_bytes -= evicted_size
+            try:
+                os.remove(self.path_for(evicted))
+            except OSError as e:
+                logger.warning(f"Could not evict {evicted} from the media cache: {e}")
+
+    async def fetch(self, client, file_id, unique_id, priority=PRIORITY_PREFETCH):
+        """Download a file (once) and return its path in the media cache"""
+        path = self.path_for(unique_id)
+        if unique_id in self._index() and os.path.exists(path):
+            self._touch(unique_id)
+            return path
+
+        job = self._jobs.get(unique_id)
+        if job is None:
+            job = DownloadJob(unique_id, priority)
+            self._jobs[unique_id] = job
+            self._push(job)
+        job.requesters.setdefault(client, file_id)
+        if priority < job.priority and not job.started:
+            # The old heap entry goes stale and is skipped when popped
+            job.priority = priority
+            self._push(job)
+        self._pump()
+        # One waiter giving up must not cancel the download for the others
+        return await asyncio.shield(job.future)
+
+    def _push(self, job):
+        heapq.heappush(self._queue, (job.priority, next(self._sequence), job))
+
+    def _pump(self):
+        while self._queue:
+            priority, _, job = self._queue[0]
+            if job.started or priority != job.priority or self._jobs.get(job.unique_id) is not job:
+                heapq.heappop(self._queue)
+                continue
+            # One slot is kept free for a preview the user is waiting on; the
+            # heap top is the most urgent job, so nothing behind it could use it
+            limit = self.max_parallel if priority == PRIORITY_PREVIEW else max(1, self.max_parallel - 1)
+            if self._active >= limit:
+                break
+            heapq.heappop(self._queue)
+            job.started = True
+            job.client = next(iter(job.requesters))
+            self._active += 1
+            job.task = asyncio.create_task(self._run(job))
+        self._report()
+
+    def release(self, client):
+        """Withdraw a client that is shutting down from every download it asked for
+
+        A download it was streaming restarts, from its last whole chunk,
+        over another requester; one nobody else waits on is cancelled.
+        """
+        for job in list(self._jobs.values()):
+            if client not in job.requesters:
+                continue
+            del job.requesters[client]
+            if not job.started:
+                if not job.requesters:
+                    # Its heap entry is skipped once the job is no longer listed
+                    del self._jobs[job.unique_id]
+                    job.future.cancel()
+            elif job.client is client:
+                job.handover = bool(job.requesters)
+                job.task.cancel()
+        self._pump()
+
+    async def _run(self, job):
+        path = self.path_for(job.unique_id)
+        part_path = path + '.part'
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Resume an interrupted download from its last whole chunk
+            done_chunks = os.path.getsize(part_path) // CHUNK_SIZE if os.path.exists(part_path) else 0
+            mode = 'r+b' if done_chunks else 'wb'
+            with open(part_path, mode) as f:
+                f.truncate(done_chunks * CHUNK_SIZE)
+                f.seek(done_chunks * CHUNK_SIZE)
+                file_id = job.requesters[job.client]
+                async for chunk in job.client.stream_media(file_id, offset=done_chunks):
+                    f.write(chunk)
+                    self._samples.append((time.monotonic(), len(chunk)))
+                    self._report()
+            os.replace(part_path, path)
+            self._add_to_cache(job.unique_id, os.path.getsize(path))
+            job.future.set_result(path)
+        except asyncio.CancelledError:
+            if job.handover:
+                # Its client went away; queue it again for one that is left
+                job.handover = job.started = False
+                job.client = job.task = None
+                self._push(job)
+            else:
+                job.future.cancel()
+                raise
+        except Exception as e:
+            logger.error(f"Failed to download {job.unique_id}: {e}", exc_info=True)
+            job.future.set_exception(e)
+        finally:
+            # A job handed over is still pending, and stays listed
+            if job.future.done() and self._jobs.get(job.unique_id) is job:
+                del self._jobs[job.unique_id]
+            self._active -= 1
+            self._pump()
+
+    def stats(self):
+        """Transfers running and waiting, and bytes per second over the window"""
+        now = time.monotonic()
+        while self._samples and now - self._samples[0][0] > THROUGHPUT_WINDOW:
+            self._samples.popleft()
+        return {
+            'active': self._active,
+            'queued': len(self._jobs) - self._active,
+            'bytes_per_second': sum(size for _, size in self._samples) / THROUGHPUT_WINDOW
+        }
+
+    def _report(self):
+        """Pass stats to on_stats when the queue changes, or periodically while busy"""
+        if self.on_stats is None:
+            return
+        now = time.monotonic()
+        counts = (self._active, len(self._jobs))
+        if counts == self._last_counts and now - self._last_report < STATS_INTERVAL:
+            return
+        self._last_report = now
+        self._last_counts = counts
+        self.on_stats(self.stats())
@@ -0,0 +1,228 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from telegram_worker import logger, PHONE
+from config import API_ID, API_HASH
+
+# Messages written between checkpoints. A checkpoint records the file size and
+# the oldest exported id, so an interrupted run truncates any unrecorded tail
+# and resumes from there.
+CHECKPOINT_EVERY = 500
+# Let Pyrogram sleep through flood waits shorter than this instead of raising
+FLOOD_SLEEP_THRESHOLD = 120
+MEDIA_QUEUE_SIZE = 64
+MEDIA_REFETCH_BATCH = 200  # Message ids per request when re-queueing media on resume
+
+def export_record(message, media_file=None):
+    """Flatten a message into the JSON object written to the export"""
+    return {
+        'id': message.id,
+        'date': message.date.isoformat() if message.date else None,
+        'from_user_id': message.from_user.id if message.from_user else None,
+        'from_user': message.from_user.first_name if message.from_user else None,
+        'text': message.text,
+        'caption': message.caption,
+        'media': message.media.value if message.media else None,
+        'media_file': media_file,
+        'reply_to_message_id': message.reply_to_message_id,
+        'edit_date': message.edit_date.isoformat() if message.edit_date else None
+    }
+
+def parse_chat(value):
+    """Chats may be given as numeric ids or usernames"""
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+class ChatExporter:
+    """Streams the full history of one chat to <chat>.jsonl with checkpoints"""
+    def __init__(self, app, chat, out_dir, media_queue=None):
+        self.app = app
+        self.chat = chat
+        self.media_queue = media_queue
+        name = str(chat).lstrip('@')
+        self.path = os.path.join(out_dir, f"{name}.jsonl")
+        self.checkpoint_path = os.path.join(out_dir, f"{name}.checkpoint.json")
+        self.media_dir = os.path.join(out_dir, f"{name}_media")
+        self.state = {'offset_id': 0, 'bytes': 0, 'count': 0, 'done': False}
+        # Ids of messages whose media is queued or downloading; checkpointed
+        # so a resumed run queues them again
+        self.pending_media = set()
+
+    def _load_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                self.state = json.load(f)
+        self.pending_media = set(self.state.pop('pending_media', []))
+
+    def _save_checkpoint(self, out):
+        out.flush()
+        os.fsync(out.fileno())
+        self.state['bytes'] = out.tell()
+        self.save_state()
+
+    def save_state(self):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(self.state, pending_media=sorted(self.pending_media)), f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def media_path(self, message_id):
+        return os.path.join(self.media_dir, str(message_id))
+
+    async def _queue_media(self, message):
+        self.pending_media.add(message.id)
+        await self.media_queue.put((message, self.media_path(message.id), self))
+
+    def media_done(self, message_id):
+        self.pending_media.discard(message_id)
+
+    async def _requeue_media(self):
+        """Queue again the media that was still pending when the last run stopped"""
+        message_ids = sorted(message_id for message_id in self.pending_media
+                             if not os.path.exists(self.media_path(message_id)))
+        self.pending_media.clear()
+        if message_ids:
+            print(f"{self.chat}: re-queueing {len(message_ids)} media downloads")
+        for start in range(0, len(message_ids), MEDIA_REFETCH_BATCH):
+            messages = await self.app.get_messages(self.chat, message_ids[start:start + MEDIA_REFETCH_BATCH])
+            for message in messages:
+                if message and not message.empty and message.media:
+                    await self._queue_media(message)
+
+    async def run(self):
+        from pyrogram.errors import FloodWait
+
+        self._load_checkpoint()
+        if self.media_queue is not None:
+            await self._requeue_media()
+        if self.state['done']:
+            print(f"{self.chat}: already exported ({self.state['count']} messages)")
+            return
+
+        mode = 'r+b' if os.path.exists(self.path) else 'wb'
+        with open(self.path, mode) as out:
+            # Drop lines written after the last checkpoint
+            out.truncate(self.state['bytes'])
+            out.seek(self.state['bytes'])
+            if self.state['offset_id']:
+                print(f"{self.chat}: resuming after {self.state['count']} messages")
+
+            started = time.perf_counter()
+            resumed_count = self.state['count']
+            while True:
+                try:
+                    # Newest first, continuing below the oldest id exported so far;
+                    # Pyrogram pages through the history 100 messages per request
+                    async for message in self.app.get_chat_history(self.chat, offset_id=self.state['offset_id']):
+                        media_file = None
+                        if self.media_queue is not None and message.media:
+                            media_file = self.media_path(message.id)
+                            await self._queue_media(message)
+                        record = export_record(message, media_file)
+                        out.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+                        self.state['offset_id'] = message.id
+                        self.state['count'] += 1
+                        if self.state['count'] % CHECKPOINT_EVERY == 0:
+                            self._save_checkpoint(out)
+                            rate = (self.state['count'] - resumed_count) / max(time.perf_counter() - started, 1e-6)
+                            print(f"{self.chat}: {self.state['count']} messages ({rate:.0f}/s)")
+                    break
+                except FloodWait as e:
+                    # Longer than the client's own threshold; wait and resume
+                    self._save_checkpoint(out)
+                    logger.warning(f"Export of {self.chat} rate limited for {e.value} s")
+                    await asyncio.sleep(e.value)
+
+            self.state['done'] = True
+            self._save_checkpoint(out)
+        print(f"{self.chat}: done, {self.state['count']} messages")
+
+async def download_media_worker(app, media_queue):
+    """Download queued media straight to disk; Pyrogram streams it in chunks"""
+    while True:
+        message, file_name, exporter = await media_queue.get()
+        try:
+            if not os.path.exists(file_name):
+                os.makedirs(os.path.dirname(file_name), exist_ok=True)
+                # Pyrogram writes into a temp file and renames it when complete
+                await app.download_media(message, file_name=file_name)
+            exporter.media_done(message.id)
+        except Exception as e:
+            # Stays pending, so the next run tries again
+            logger.error(f"Failed to download media of message {message.id}: {e}")
+        finally:
+            media_queue.task_done()
+
+async def export_chats(chats, out_dir, account=PHONE, concurrency=4, media=False, media_concurrency=4):
+    from pyrogram import Client
+
+    # Pyrogram resolves relative download paths against the script's
+    # directory, not the working directory the existence checks use
+    out_dir = os.path.abspath(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    app = Client(
+        name=account,
+        phone_number=account,
+        api_id=API_ID,
+        api_hash=API_HASH,
+        no_updates=True,
+        sleep_threshold=FLOOD_SLEEP_THRESHOLD,
+        max_concurrent_transmissions=media_concurrency
+    )
+    async with app:
+        # The bounded queue applies back-pressure so memory stays flat
+        # even when media downloads fall behind the history stream
+        media_queue = asyncio.Queue(MEDIA_QUEUE_SIZE) if media else None
+        downloaders = [asyncio.create_task(download_media_worker(app, media_queue))
+                       for _ in range(media_concurrency)] if media else []
+
+        limit = asyncio.Semaphore(concurrency)
+        exporters = []
+
+        async def export_one(chat):
+            async with limit:
+                try:
+                    exporter = ChatExporter(app, chat, out_dir, media_queue)
+                    exporters.append(exporter)
+                    await exporter.run()
+                except Exception as e:
+                    logger.error(f"Export of {chat} failed: {e}", exc_info=True)
+                    print(f"{chat}: failed ({e}), rerun to resume", file=sys.stderr)
+
+        await asyncio.gather(*(export_one(chat) for chat in chats))
+
+        if media_queue is not None:
+            await media_queue.join()
+            # Record what was downloaded since the final checkpoints
+            for exporter in exporters:
+                if exporter.state['done']:
+                    exporter.save_state()
+        for task in downloaders:
+            task.cancel()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export full chat histories to JSONL, resuming interrupted runs")
+    parser.add_argument('chats', nargs='+', help="chat ids or usernames")
+    parser.add_argument('--out', default='export', help="output directory")
+    parser.add_argument('--account', default=PHONE, help="account session to export from")
+    parser.add_argument('--concurrency', type=int, default=4, help="chats exported at once")
+    parser.add_argument('--media', action='store_true', help="also download media files")
+    parser.add_argument('--media-concurrency', type=int, default=4, help="parallel media downloads")
+    args = parser.parse_args()
+    try:
+        asyncio.run(export_chats(
+            [parse_chat(chat) for chat in args.chats],
+            args.out,
+            account=args.account,
+            concurrency=args.concurrency,
+            media=args.media,
+            media_concurrency=args.media_concurrency
+        ))
+    except KeyboardInterrupt:
+        print("Interrupted; rerun the same command to resume", file=sys.stderr)
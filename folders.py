@@ -0,0 +1,205 @@
+import bisect
+
+import config
+
+# Folders every user gets. Folder specs, also used for FOLDERS in config.py
+# and for folders synced from the server, are dicts with a 'name' and any of:
+#   types     chat types to show: private, bot, group, supergroup, channel
+#   unread    True: only chats with unread messages
+#   muted     True: only muted chats, False: only unmuted ones
+#   favorites True: only favorites
+#   include   chat ids always shown; a spec with nothing else shows only these
+#   exclude   chat ids never shown
+#   account   limit the folder to one account's chats
+BUILTIN_FOLDERS = [
+    {'name': 'All'},
+    {'name': 'Favorites', 'favorites': True},
+    {'name': 'Unread', 'unread': True},
+    {'name': 'Private', 'types': ['private', 'bot']},
+    {'name': 'Groups', 'types': ['group', 'supergroup']},
+    {'name': 'Channels', 'types': ['channel']},
+]
+
+CONFIG_FOLDERS = getattr(config, 'FOLDERS', None) or []
+
+RULES = ('types', 'unread', 'muted', 'favorites')
+
+def chat_key(chat):
+    return (chat['account'], chat['id'])
+
+def order_key(chat):
+    """Position in the merged dialog list: pinned first, then most recent activity across accounts"""
+    last_date = chat.get('last_message_date')
+    return (not chat['is_pinned'], -(last_date.timestamp() if last_date else 0)) + chat_key(chat)
+
+def has_unread(chat):
+    return bool(chat.get('unread_messages_count') or chat.get('unread_mentions_count') or chat.get('unread_mark'))
+
+class Folder:
+    def __init__(self, spec, favorites):
+        self.name = spec['name']
+        self.account = spec.get('account')
+        self.types = set(spec['types']) if spec.get('types') else None
+        self.unread = spec.get('unread')
+        self.muted = spec.get('muted')
+        self.favorites_only = spec.get('favorites')
+        self.include = set(spec.get('include', ()))
+        self.exclude = set(spec.get('exclude', ()))
+        self.has_rules = any(spec.get(rule) is not None for rule in RULES)
+        self.favorites = favorites  # Shared with the session, so always current
+
+    def matches(self, chat):
+        if self.account is not None and chat['account'] != self.account:
+            return False
+        chat_id = chat['id']
+        if chat_id in self.exclude:
+            return False
+        if chat_id in self.include:
+            return True
+        if not self.has_rules:
+            # Either "All", or a folder made only of an include list
+            return not self.include
+        if self.types is not None and chat.get('type') not in self.types:
+            return False
+        if self.unread and not has_unread(chat):
+            return False
+        if self.muted is not None and bool(chat.get('is_muted')) != self.muted:
+            return False
+        if self.favorites_only and chat_key(chat) not in self.favorites:
+            return False
+        return True
+
+class FolderViews:
+    """Every folder's chats as ordered lists, kept up to date incrementally
+
+    Each view is a subsequence of the merged dialog list, ordered by
+    order_key. A new dialog list rebuilds the views; after that a changed
+    chat is only re-checked against each folder's rules and inserted into or
+    removed from the views whose membership changed, and a chat whose order
+    changed is moved, each in O(log n) plus the list shift, so reading a view
+    for a frame costs nothing. The open chat is never removed from under
+    the user: it leaves a view only once another chat is opened.
+    """
+    def __init__(self, favorites, specs=None):
+        self.favorites = favorites
+        self.specs = list(specs if specs is not None else BUILTIN_FOLDERS + CONFIG_FOLDERS)
+        self.server_specs = {}  # account -> specs of that account's server folders
+        self.folders = [Folder(spec, favorites) for spec in self.specs]
+        self.chats = []
+        self._ranks = {}  # chat key -> order_key of the chat where it is listed
+        self._chats = {}  # chat key -> chat
+        self._views = [[] for _ in self.folders]
+        self._members = [set() for _ in self.folders]
+        self.current_key = None
+        self._held = set()  # (folder index, key) kept only because the chat is open
+
+    def __len__(self):
+        return len(self.folders)
+
+    def name(self, folder_idx):
+        return self.folders[folder_idx].name
+
+    def view(self, folder_idx):
+        return self._views[folder_idx]
+
+    def index_of(self, folder_idx, key):
+        """Position of a chat in a view, or None"""
+        if key not in self._members[folder_idx] or key not in self._ranks:
+            return None
+        view = self._views[folder_idx]
+        idx = bisect.bisect_left(view, self._ranks[key], key=self._rank)
+        return idx if idx < len(view) and chat_key(view[idx]) == key else None
+
+    def _rank(self, chat):
+        return self._ranks[chat_key(chat)]
+
+    def set_server_folders(self, account, specs):
+        """Replace an account's folders synced from the server"""
+        holding = self._folders_holding_current()
+        self.server_specs[account] = [dict(spec, account=account) for spec in specs]
+        local = self.specs[:len(BUILTIN_FOLDERS) + len(CONFIG_FOLDERS)]
+        self.specs = local + [spec for specs in self.server_specs.values() for spec in specs]
+        self.folders = [Folder(spec, self.favorites) for spec in self.specs]
+        self._rebuild(self.chats, holding)
+
+    def set_chats(self, chats):
+        """Rebuild every view for a new dialog list"""
+        self._rebuild(chats, self._folders_holding_current())
+
+    def _folders_holding_current(self):
+        return {self.folders[idx].name for idx, members in enumerate(self._members)
+                if self.current_key in members}
+
+    def update_chats(self, chats):
+        """Apply dialogs that changed, updated in place or new, without a rebuild"""
+        for chat in chats:
+            key = chat_key(chat)
+            rank = order_key(chat)
+            if key not in self._ranks:
+                self._ranks[key] = rank
+                self._chats[key] = chat
+                self.chats.insert(bisect.bisect_left(self.chats, rank, key=self._rank), chat)
+            elif rank != self._ranks[key]:
+                # Take it out where it was listed, then put it back where it now belongs
+                views = [idx for idx, members in enumerate(self._members) if key in members]
+                for idx in views:
+                    self._remove(idx, key)
+                del self.chats[bisect.bisect_left(self.chats, self._ranks[key], key=self._rank)]
+                self._ranks[key] = rank
+                self.chats.insert(bisect.bisect_left(self.chats, rank, key=self._rank), chat)
+                for idx in views:
+                    self._insert(idx, chat)
+            self.chat_changed(key)
+
+    def _rebuild(self, chats, holding):
+        self.chats = chats
+        self._ranks = {chat_key(chat): order_key(chat) for chat in chats}
+        self._chats = {chat_key(chat): chat for chat in chats}
+        self._views = [[chat for chat in chats if folder.matches(chat)] for folder in self.folders]
+        self._members = [{chat_key(chat) for chat in view} for view in self._views]
+        self._held = set()
+        if self.current_key in self._ranks:
+            # The open chat stays where it was shown, even if it no longer matches
+            current = self._chats[self.current_key]
+            for idx, folder in enumerate(self.folders):
+                if folder.name in holding and self.current_key not in self._members[idx]:
+                    self._insert(idx, current)
+                    self._held.add((idx, self.current_key))
+
+    def chat_changed(self, key):
+        """Re-check one chat after its unread, mute or favorite state changed"""
+        chat = self._chats.get(key)
+        if chat is None:
+            return
+        for idx, folder in enumerate(self.folders):
+            wanted = folder.matches(chat)
+            member = key in self._members[idx]
+            if wanted and not member:
+                self._insert(idx, chat)
+            elif wanted:
+                self._held.discard((idx, key))
+            elif member and key == self.current_key:
+                self._held.add((idx, key))
+            elif member:
+                self._remove(idx, key)
+
+    def set_current(self, key):
+        """Note the open chat; views it no longer matches drop it now"""
+        previous, self.current_key = self.current_key, key
+        if previous == key:
+            return
+        for idx, held_key in list(self._held):
+            if held_key == previous:
+                self._held.discard((idx, held_key))
+                self._remove(idx, held_key)
+
+    def _insert(self, idx, chat):
+        view = self._views[idx]
+        view.insert(bisect.bisect_left(view, self._rank(chat), key=self._rank), chat)
+        self._members[idx].add(chat_key(chat))
+
+    def _remove(self, idx, key):
+        position = self.index_of(idx, key)
+        if position is not None:
+            del self._views[idx][position]
+        self._members[idx].discard(key)
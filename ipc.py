@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+import threading
+from datetime import datetime
+
+from telegram_worker import ui_queue, SHUTDOWN_JOIN_TIMEOUT
+from downloads import PRIORITY_PREVIEW
+from commands import INTERACTIVE, BACKGROUND, TRANSFER, completed_handle, forwarded_handle
+
+logger = logging.getLogger('telegram')
+
+# Local protocol between the daemon and attached UIs. Every frame is a 4-byte
+# big-endian length followed by compact JSON. UI -> daemon frames carry a "cmd",
+# daemon -> UI frames are the same events the workers put on ui_queue, plus a
+# "reply" type answering commands that return a value.
+PROTOCOL_VERSION = 1
+SOCKET_PATH = 'telegram_tui.sock'
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+ATTACH_TIMEOUT = 1.0  # Seconds to wait for the daemon's hello
+
+_header = struct.Struct('>I')
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'$dt': value.timestamp()}
+    # Client-side objects such as Pyrogram photos stay in the daemon
+    return None
+
+def _decode_object(obj):
+    if len(obj) == 1 and '$dt' in obj:
+        return datetime.fromtimestamp(obj['$dt'])
+    return obj
+
+def encode_frame(payload):
+    """Serialize one protocol frame"""
+    data = json.dumps(payload, separators=(',', ':'), ensure_ascii=False,
+                      default=_encode_value).encode('utf-8')
+    return _header.pack(len(data)) + data
+
+async def read_frame(reader):
+    """Read one protocol frame, or return None at end of stream"""
+    try:
+        header = await reader.readexactly(_header.size)
+        (length,) = _header.unpack(header)
+        if length > MAX_FRAME_SIZE:
+            raise ValueError(f"Frame of {length} bytes exceeds limit")
+        data = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+    return json.loads(data.decode('utf-8'), object_hook=_decode_object)
+
+class RemoteWorker:
+    """Stand-in for a TelegramWorker that lives in the daemon"""
+    def __init__(self, pool, account, account_label):
+        self.pool = pool
+        self.account = account
+        self.account_label = account_label
+        self.loop = pool.loop
+
+    def submit(self, coro):
+        """Schedule a coroutine on the connection loop from any thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def _command(self, cmd, **args):
+        self.pool.send({"cmd": cmd, "account": self.account, **args})
+
+    def mark_read(self, chat_id, max_id):
+        self._command("mark_read", chat_id=chat_id, max_id=max_id)
+
+    def request_users(self, user_ids):
+        self._command("request_users", user_ids=list(user_ids))
+
+    def request_dialog_metadata(self, chat_ids):
+        self._command("request_dialog_metadata", chat_ids=list(chat_ids))
+
+    # The daemon schedules these on its own worker; handles for fire-and-forget
+    # commands are complete once the command is sent
+
+    def set_current_chat(self, chat_id, unread_count=0):
+        self._command("set_current_chat", chat_id=chat_id, unread_count=unread_count)
+        return completed_handle("load history")
+
+    def send_message(self, text, chat_id=None):
+        self._command("send_message", chat_id=chat_id, text=text)
+        return completed_handle("send message")
+
+    def send_file(self, path, chat_id=None, caption=""):
+        # The daemon reads the file, so the path must not depend on this UI's directory
+        self._command("send_file", path=os.path.abspath(path), chat_id=chat_id, caption=caption)
+        return completed_handle("upload file", TRANSFER)
+
+    def cancel_upload(self, upload_id):
+        self._command("cancel_upload", upload_id=upload_id)
+
+    def request_history(self, chat_id, limit=200, before_message_id=None, after_message_id=None):
+        self._command("load_chat_history", chat_id=chat_id, limit=limit,
+                      before_message_id=before_message_id, after_message_id=after_message_id)
+        return completed_handle("load history")
+
+    def request_history_at(self, chat_id, when):
+        self._command("load_history_at_date", chat_id=chat_id, when=when)
+        return completed_handle("jump to date")
+
+    def request_photo(self, message_data, max_width, max_height=None, priority=PRIORITY_PREVIEW):
+        kind = INTERACTIVE if priority == PRIORITY_PREVIEW else BACKGROUND
+        future = self.submit(self.pool.request({
+            "cmd": "render_photo",
+            "account": self.account,
+            "chat_id": message_data.get('chat_id'),
+            "message_id": message_data.get('id'),
+            "max_width": max_width,
+            "max_height": max_height,
+            "priority": priority
+        }))
+        return forwarded_handle("render photo", kind, future)
+
+class RemoteWorkerPool:
+    """Connection to a running daemon, shaped like a WorkerPool"""
+    def __init__(self, path=SOCKET_PATH):
+        self.path = path
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+        self.workers = {}
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}
+        self._next_request = 0
+        self._closing = False
+
+    def get(self, account):
+        return self.workers.get(account)
+
+    def __iter__(self):
+        return iter(self.workers.values())
+
+    @property
+    def is_multi_account(self):
+        return len(self.workers) > 1
+
+    def send(self, payload):
+        """Send a frame from any thread"""
+        self.loop.call_soon_threadsafe(self._write, payload)
+
+    def _write(self, payload):
+        if self._writer and not self._writer.is_closing():
+            self._writer.write(encode_frame(payload))
+
+    async def request(self, payload):
+        """Send a command and wait for the daemon's reply"""
+        self._next_request += 1
+        request_id = self._next_request
+        future = self.loop.create_future()
+        self._pending[request_id] = future
+        self._write({**payload, "request_id": request_id})
+        try:
+            return await future
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _connect(self):
+        reader, self._writer = await asyncio.open_unix_connection(self.path)
+        self._write({"cmd": "hello", "version": PROTOCOL_VERSION})
+        hello = await asyncio.wait_for(read_frame(reader), ATTACH_TIMEOUT)
+        if not hello or hello.get("type") != "hello":
+            raise ConnectionError(hello.get("message") if hello else "Daemon closed the connection")
+        for account in hello["accounts"]:
+            self.workers[account["account"]] = RemoteWorker(self, account["account"], account["label"])
+        self._reader_task = asyncio.create_task(self._read_events(reader))
+
+    async def _read_events(self, reader):
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                if frame.get("type") == "reply":
+                    future = self._pending.get(frame.get("request_id"))
+                    if future and not future.done():
+                        future.set_result(frame.get("result"))
+                else:
+                    ui_queue.put(frame)
+        except Exception as e:
+            logger.error(f"Error reading from daemon: {e}", exc_info=True)
+        if not self._closing:
+            ui_queue.put({
+                "type": "error",
+                "message": "Lost connection to the daemon"
+            })
+
+    def start(self):
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._connect(), self.loop).result(ATTACH_TIMEOUT)
+
+    def stop(self):
+        """Detach from the daemon; it keeps running with its caches warm"""
+        self._closing = True
+
+        async def close():
+            if self._writer:
+                self._writer.close()
+            if self._reader_task:
+                self._reader_task.cancel()
+            self.loop.stop()
+
+        try:
+            asyncio.run_coroutine_threadsafe(close(), self.loop)
+        except RuntimeError:
+            pass
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=SHUTDOWN_JOIN_TIMEOUT)
+        logger.info("Detached from daemon")
+
+def attach_to_daemon(path=SOCKET_PATH):
+    """Attach to a running daemon, or return None if there is none"""
+    if not os.path.exists(path):
+        return None
+    pool = RemoteWorkerPool(path)
+    try:
+        pool.start()
+    except Exception as e:
+        logger.info(f"No daemon listening on {path}: {e}")
+        pool.stop()
+        return None
+    logger.info(f"Attached to daemon on {path}")
+    return pool
@@ -1,9 +1,14 @@
+import sys
+
 from pyrogram import Client
 
 from config import PHONE, API_ID, API_HASH
+
+# Pass a phone number to log in to another account from ACCOUNTS
+phone = sys.argv[1] if len(sys.argv) > 1 else PHONE
 app = Client(
-    name=PHONE,
-    phone_number=PHONE,
+    name=phone,
+    phone_number=phone,
     api_id=API_ID,
     api_hash=API_HASH
 )
@@ -1,10 +1,15 @@
+import time
+# Taken before anything else is imported so the startup breakdown covers imports
+PROCESS_START = time.perf_counter()
+
 import locale
 import os
-import json
 import os.path
 import logging
 from logging.handlers import RotatingFileHandler
-import asyncio
+import bisect
+import concurrent.futures
+import itertools
 from datetime import datetime, timedelta
 import re
 
@@ -12,12 +17,28 @@ import re
 os.environ['LANG'] = 'en_US.UTF-8'
 os.environ['LC_ALL'] = 'en_US.UTF-8'
 locale.setlocale(locale.LC_ALL, '')
+# Deliver a lone ESC quickly instead of waiting a second for a key sequence
+os.environ.setdefault('ESCDELAY', '25')
 
+import argparse
 import curses
-import time
-from telegram_worker import ui_queue, run_telegram_worker
+import sys
+from composer import Composer
+from session_state import SessionState
+from folders import FolderViews, order_key
+from paging import HistoryPaging
+from telegram_worker import (ui_queue, run_telegram_workers, LRUCache, MessageIndex,
+                             DIALOG_META_TTL, BACKGROUND_CHAT_MESSAGES)
+from downloads import PRIORITY_VISIBLE, PRIORITY_PREFETCH
+from ipc import attach_to_daemon
+from profiler import SamplingProfiler, PROFILE_PATH
 import queue
 
+IMPORTS_DONE = time.perf_counter()
+
+# Target for process start to first painted frame
+STARTUP_BUDGET_MS = 200
+
 # Set up rotating log files (keeps last 5 files, 1MB each)
 def setup_logging():
     log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -47,24 +68,75 @@ def setup_logging():
 
 logger = setup_logging()
 
-def draw_sidebar(win, chats, current_idx, ui_state, worker):
+class StartupReport:
+    """Collects the import-time and time-to-first-frame breakdown"""
+    def __init__(self):
+        self.phases = [("imports", (IMPORTS_DONE - PROCESS_START) * 1000)]
+        self.first_frame_ms = None
+        self.reported = False
+
+    def mark(self, phase, since):
+        """Record a UI phase measured from the given perf_counter value"""
+        self.phases.append((phase, (time.perf_counter() - since) * 1000))
+
+    def first_frame(self):
+        """Record the moment the first complete frame was painted"""
+        if self.first_frame_ms is None:
+            self.first_frame_ms = (time.perf_counter() - PROCESS_START) * 1000
+            breakdown = ", ".join(f"{name} {ms:.1f} ms" for name, ms in self.phases)
+            message = (f"Startup: first frame after {self.first_frame_ms:.1f} ms "
+                       f"({breakdown}; budget {STARTUP_BUDGET_MS} ms)")
+            if self.first_frame_ms > STARTUP_BUDGET_MS:
+                logger.warning(message)
+            else:
+                logger.info(message)
+
+    def add_worker_phase(self, phase, ms):
+        """Record a phase reported by the worker thread"""
+        self.phases.append((f"worker {phase}", ms))
+
+    def report(self):
+        """Log the full breakdown once the chat list is on screen"""
+        if self.reported:
+            return
+        self.reported = True
+        total_ms = (time.perf_counter() - PROCESS_START) * 1000
+        breakdown = ", ".join(f"{name} {ms:.1f} ms" for name, ms in self.phases)
+        logger.info(f"Startup: chats ready after {total_ms:.1f} ms "
+                    f"(first frame {self.first_frame_ms or 0:.1f} ms; {breakdown})")
+
+def chat_key(chat):
+    """Key for per-chat UI state; chat ids are only unique within one account"""
+    return (chat['account'], chat['id'])
+
+def merge_account_chats(chats, account, account_chats):
+    """Replace one account's dialogs in the merged list, keeping it ordered"""
+    merged = [c for c in chats if c['account'] != account] + account_chats
+    merged.sort(key=order_key)
+    return merged
+
+def draw_sidebar(win, chats, current_idx, ui_state, workers):
     win.erase()
     win.box()
     win.addstr(0, 2, " Chats ")
     max_y, max_x = win.getmaxyx()
     
-    # Simplified mode indicator
-    mode_str = " Mode: " + ("Favorites" if ui_state.display_mode == 2 else "All")
+    # Folder indicator
+    mode_str = f" {ui_state.folder_name} ({len(chats)}) "
     win.addstr(0, max_x - len(mode_str) - 1, mode_str)
     
-    for idx, chat in enumerate(chats):  # chats is already filtered, so we use it directly
+    # Scroll the list so the selected chat stays visible
+    rows = max_y - 2
+    first_idx = max(0, current_idx - rows + 1)
+    visible_chats = chats[first_idx:first_idx + rows]
+    for idx, chat in enumerate(visible_chats, first_idx):  # chats is already filtered, so we use it directly
         try:
-            y_pos = idx + 1
+            y_pos = idx - first_idx + 1
             is_selected = idx == current_idx
             
             # Determine chat color and indicators
             prefix = ""
-            if chat['id'] in ui_state.favorites:
+            if chat_key(chat) in ui_state.favorites:
                 prefix = "★ "
             elif chat['is_pinned']:
                 prefix = "📌 "
@@ -89,6 +161,8 @@ def draw_sidebar(win, chats, current_idx, ui_state, worker):
             
             # Add unread counter and member count to title
             title = f"{prefix}{chat['title']}"
+            if workers.is_multi_account:
+                title = f"[{chat['account_label']}] {title}"
             if chat.get('member_count'):
                 title = f"{title} ({chat['member_count']})"
             
@@ -108,6 +182,12 @@ def draw_sidebar(win, chats, current_idx, ui_state, worker):
             win.attron(color)
             win.addstr(y_pos, 1, f" {title} ".ljust(max_x - 2).encode('utf-8'))
             win.attroff(color)
+            # Last message in the remaining space, once the enricher has it
+            preview = chat.get('last_message_preview')
+            room = max_x - 2 - len(title) - 4
+            if preview and room > 5:
+                win.addstr(y_pos, len(title) + 4, preview[:room].encode('utf-8'),
+                           curses.A_DIM | (curses.A_REVERSE if is_selected else 0))
             if is_selected:
                 win.attroff(curses.A_REVERSE)
                 
@@ -115,6 +195,7 @@ def draw_sidebar(win, chats, current_idx, ui_state, worker):
             pass
 
     win.refresh()
+    return first_idx, first_idx + len(visible_chats) - 1
 
 def draw_chat_header(win, chat_name):
     win.erase()
@@ -123,88 +204,296 @@ def draw_chat_header(win, chat_name):
     win.addstr(0, 2, f" {chat_name} ")
     win.refresh()
 
-def format_message(msg):
-    """Format a message with timestamp and sender"""
+def day_label(day, today=None):
+    """Label for a day separator: Today, Yesterday or the date"""
+    today = today or datetime.now().date()
+    if day == today:
+        return "Today"
+    elif day == today - timedelta(days=1):
+        return "Yesterday"
+    return day.strftime('%d.%m.%Y')
+
+# Sender id -> display name, from the workers' users events. Messages keep
+# only the id, so a rename shows everywhere once this entry changes.
+sender_names = {}
+
+def sender_name(msg):
+    """Display name of a message's sender; System messages carry their own"""
+    name = sender_names.get(msg.get('sender_id'))
+    return name or msg.get('from_user') or 'Unknown'
+
+def format_message(msg, header_only=False):
+    """Format a message with time and sender; the date is shown by day separators"""
     timestamp = msg['timestamp']
-    sender = msg['from_user']
-    text = msg['text']
-    
-    # Get current date
-    today = datetime.now().date()
-    msg_date = timestamp.date()
-    
-    # Format time
-    time_str = timestamp.strftime('%H:%M')
-    
-    # Format date
-    if msg_date == today:
-        date_str = "Today"
-    elif msg_date == today - timedelta(days=1):
-        date_str = "Yesterday"
-    else:
-        date_str = timestamp.strftime('%d.%m.%Y')
+    sender = sender_name(msg)
     
-    # Format: [HH:MM date_str]
-    timestamp_str = f"[{time_str} {date_str}]"
+    # Format: [HH:MM]
+    timestamp_str = f"[{timestamp.strftime('%H:%M')}]"
     
     # Handle different message types
     if msg.get('is_outgoing'):
-        return f"{timestamp_str} → {text}"
+        header = f"{timestamp_str} →"
+    else:
+        header = f"{timestamp_str} {sender}:"
+    return header if header_only else f"{header} {msg['text']}"
+
+# Wrapped message lines, shared by every chat and account. Entries keep a
+# reference to the message so the id() key cannot be reused while cached.
+layout_cache = LRUCache(5000)
+
+def message_lines(msg, width):
+    """Return the formatted message wrapped to the given width, cached"""
+    key = (id(msg), width)
+    cached = layout_cache.get(key)
+    reply_to = msg.get('reply_to')
+    # Everything the rows depend on; a changed name or reply re-wraps just this message
+    inputs = (msg['text'], sender_name(msg), reply_to and sender_name(reply_to), reply_to)
+    if cached and cached[0] is msg and cached[1] == inputs:
+        return cached[2]
+
+    lines = []
+    if reply_to:
+        # One line of the message being answered, above the reply
+        lines.append(f"  ↪ {sender_name(reply_to)}: {reply_to['text']}"[:width])
+    for line in format_message(msg).split('\n'):
+        if len(line) > width + 1:
+            lines.extend(line[i:i+width] for i in range(0, len(line), width))
+        else:
+            lines.append(line)
+    layout_cache.put(key, (msg, inputs, lines))
+    return lines
+
+# Indices at which a new day starts, per message list. Computed once for each
+# run of messages and extended incrementally as messages are appended.
+day_start_cache = LRUCache(64)
+
+def day_starts(messages):
+    """Return the set of indices of messages that begin a new day"""
+    key = id(messages)
+    cached = day_start_cache.get(key)
+    if cached and cached[0] is messages and cached[1] <= len(messages):
+        _, scanned, starts, last_day = cached
     else:
-        return f"{timestamp_str} {sender}: {text}"
+        scanned, starts, last_day = 0, set(), None
+
+    for idx in range(scanned, len(messages)):
+        day = messages[idx]['timestamp'].date()
+        if day != last_day:
+            starts.add(idx)
+            last_day = day
+    day_start_cache.put(key, (messages, len(messages), starts, last_day))
+    return starts
+
+# Inline photo thumbnails
+THUMBNAIL_WIDTH = 40
+THUMBNAIL_ROWS = 10
+THUMBNAIL_PREFETCH = 10  # Messages above and below the viewport to prefetch
+
+class ThumbnailLoader:
+    """Inline thumbnails, requested only for messages in or near the viewport
+
+    Renderings are cached per photo and width. Requests are answered on the
+    worker loop and arrive as thumbnail_loaded events, so the message pane
+    re-lays out on the next frame instead of waiting for a download.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.cache = LRUCache(256)  # (photo_id, width) -> lines, [] if unavailable
+        self.pending = {}  # key -> priority of the outstanding request
+        self.handles = {}  # key -> CommandHandle of the outstanding request
+
+    def width_for(self, pane_width):
+        return max(8, min(THUMBNAIL_WIDTH, pane_width - 4))
+
+    def lines(self, msg, width):
+        return self.cache.get((msg['photo_id'], width))
+
+    def request(self, worker, msg, width, priority):
+        key = (msg['photo_id'], width)
+        if self.pending.get(key, priority + 1) <= priority or self.cache.get(key) is not None:
+            return
+        # Asking again with a higher priority moves a queued download up
+        self.pending[key] = priority
+
+        def done(future):
+            # Dropped by cancel_pending, whether still queued (a cancelled
+            # future, also for a handle forwarded to the daemon) or running
+            # (a CancelledError); not a failure to remember
+            if future.cancelled() or isinstance(future.exception(), concurrent.futures.CancelledError):
+                ui_queue.put({"type": "thumbnail_loaded", "key": key, "cancelled": True})
+                return
+            art = future.result() if future.exception() is None else None
+            ui_queue.put({"type": "thumbnail_loaded", "key": key, "art": art})
+
+        handle = worker.request_photo(msg, width, THUMBNAIL_ROWS, priority)
+        handle.add_done_callback(done)
+        self.handles[key] = handle
+
+    def cancel_pending(self):
+        """Drop outstanding thumbnail requests, e.g. for a chat being left"""
+        for handle in self.handles.values():
+            handle.cancel()
+
+    def request_around(self, worker, messages, first_idx, last_idx, pane_width):
+        """Request thumbnails for the drawn messages, then for their neighbours"""
+        width = self.width_for(pane_width)
+        for idx in range(first_idx, last_idx + 1):
+            if messages[idx].get('photo_id'):
+                self.request(worker, messages[idx], width, PRIORITY_VISIBLE)
+        nearby = range(max(0, first_idx - THUMBNAIL_PREFETCH),
+                       min(len(messages), last_idx + 1 + THUMBNAIL_PREFETCH))
+        for idx in nearby:
+            if messages[idx].get('photo_id'):
+                self.request(worker, messages[idx], width, PRIORITY_PREFETCH)
+
+    def loaded(self, event):
+        key = tuple(event["key"])
+        self.pending.pop(key, None)
+        self.handles.pop(key, None)
+        if event.get("cancelled"):
+            return
+        art = event.get("art")
+        self.cache.put(key, art.split('\n') if art and art != "[image conversion failed]" else [])
 
-def draw_messages(win, messages, scroll_position=0):
-    """Draw messages with highlight for current scroll position"""
+def find_message_at(messages, when):
+    """Binary search time-ordered messages for the first one at or after when"""
+    lo, hi = 0, len(messages)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if messages[mid]['timestamp'] < when:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+def parse_jump_date(text, today=None):
+    """Parse a jump-to-date entry into a date, or None if it is not understood
+
+    Accepts DD.MM.YYYY, DD.MM (the most recent such day), YYYY-MM-DD, today,
+    yesterday, a weekday name (its most recent past occurrence) or -N days.
+    """
+    today = today or datetime.now().date()
+    text = text.strip().lower()
+    if text == 'today':
+        return today
+    if text == 'yesterday':
+        return today - timedelta(days=1)
+    if text.startswith('-') and text[1:].isdigit():
+        return today - timedelta(days=int(text[1:]))
+    for idx, name in enumerate(WEEKDAYS):
+        if len(text) >= 3 and name.startswith(text):
+            return today - timedelta(days=(today.weekday() - idx) % 7 or 7)
+    for fmt in ('%d.%m.%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    match = re.fullmatch(r'(\d{1,2})\.(\d{1,2})', text)
+    if match:
+        day, month = int(match.group(1)), int(match.group(2))
+        # The day and month are only checked against real years, so 29.02
+        # is accepted; eight years back always include a leap year
+        for year in range(today.year, today.year - 9, -1):
+            try:
+                date = datetime(year, month, day).date()
+            except ValueError:
+                continue
+            if date <= today:
+                return date
+    return None
+
+def message_block(msg, width, thumbnails=None):
+    """Rows of one message: its wrapped text, then its thumbnail if loaded"""
+    lines = message_lines(msg, width)
+    if thumbnails and thumbnails.enabled and msg.get('photo_id'):
+        art = thumbnails.lines(msg, thumbnails.width_for(width))
+        if art:
+            lines = lines + ['  ' + line for line in art]
+    return lines
+
+def draw_messages(win, messages, scroll_position=0, thumbnails=None):
+    """Draw messages with the highlighted one at the bottom of the pane
+
+    The pane is filled upwards from the highlighted message, so messages
+    that take several rows, such as those with thumbnails, never push it off
+    screen. Returns the range of message indices drawn.
+    """
     win.erase()
     win.box()
     max_y, max_x = win.getmaxyx()
     available_lines = max_y - 2  # Space between box borders
+    width = max_x - 3
     
-    # Calculate which messages to show
     total_messages = len(messages)
-    start_idx = max(0, total_messages - available_lines - scroll_position)
-    end_idx = min(total_messages, start_idx + available_lines)
-    visible_messages = messages[start_idx:end_idx]
-    
-    # Calculate highlighted message index (last visible message)
-    highlighted_idx = len(messages) - scroll_position - 1
+    highlighted_idx = total_messages - scroll_position - 1
+    starts = day_starts(messages)
+    today = datetime.now().date()
+
+    def block(idx):
+        msg = messages[idx]
+        lines = message_block(msg, width, thumbnails)
+        if idx in starts:
+            # Day separator above the first message of each day
+            label = f" {day_label(msg['timestamp'].date(), today)} "
+            return [(label.center(max_x - 2, '─'), curses.A_DIM)] + [(line, None) for line in lines]
+        return [(line, None) for line in lines]
+
+    # Collect messages upwards from the highlighted one until the pane is full
+    blocks = []
+    used = 0
+    idx = min(highlighted_idx, total_messages - 1)
+    while idx >= 0 and used < available_lines:
+        rows = block(idx)
+        blocks.insert(0, (idx, rows))
+        used += len(rows)
+        idx -= 1
+    if blocks and blocks[0][1][0][1] is not None:
+        # The date of the topmost message is on the border instead
+        blocks[0] = (blocks[0][0], blocks[0][1][1:])
+        used -= 1
+    # Top of the history: fill the rest of the pane with newer messages
+    skip = max(0, used - available_lines)
+    idx = highlighted_idx + 1
+    while used < available_lines and idx < total_messages:
+        rows = block(idx)
+        blocks.append((idx, rows))
+        used += len(rows)
+        idx += 1
+
+    if not blocks:
+        win.refresh()
+        return 0, 0
+
+    # Keep the date of the topmost visible message on the border
+    try:
+        win.addstr(0, 2, f" {day_label(messages[blocks[0][0]]['timestamp'].date(), today)} ")
+    except curses.error:
+        pass
     
-    # Draw messages from top to bottom (oldest to newest)
     current_line = 1  # Start at line 1 to account for top border
-    for idx, msg in enumerate(visible_messages):
-        try:
-            formatted_msg = format_message(msg)
-            
-            # Check if this is the highlighted message
-            is_highlighted = (start_idx + idx) == highlighted_idx
-            
-            if is_highlighted:
-                win.attron(curses.A_REVERSE)
-            
-            # Handle message wrapping
-            lines = formatted_msg.split('\n')
-            for line in lines:
-                if len(line) > max_x - 2:
-                    wrapped_lines = [line[i:i+max_x-3] 
-                                   for i in range(0, len(line), max_x-3)]
-                    for wrapped in wrapped_lines:
-                        if current_line < max_y - 1:
-                            win.addstr(current_line, 1, wrapped.encode('utf-8'))
-                            current_line += 1
-                else:
-                    if current_line < max_y - 1:
-                        win.addstr(current_line, 1, line.encode('utf-8'))
-                        current_line += 1
-            
-            if is_highlighted:
-                win.attroff(curses.A_REVERSE)
-                
-        except curses.error:
-            pass
+    for idx, rows in blocks:
+        # Check if this is the highlighted message
+        message_attr = curses.A_REVERSE if idx == highlighted_idx else curses.A_NORMAL
+        for line, attr in rows:
+            if skip:
+                # Rows of the topmost message that do not fit
+                skip -= 1
+                continue
+            if current_line >= max_y - 1:
+                break
+            try:
+                win.addstr(current_line, 1, line.encode('utf-8'), attr if attr is not None else message_attr)
+            except curses.error:
+                pass
+            current_line += 1
     
     win.refresh()
+    return blocks[0][0], blocks[-1][0]
 
-def draw_input_box(win, current_input):
+def draw_input_box(win, composer):
+    """Draw the composer; returns the screen position of its cursor"""
     win.erase()
     win.box()
     max_y, max_x = win.getmaxyx()
@@ -213,20 +502,113 @@ def draw_input_box(win, current_input):
     prompt = "Message: "
     win.addstr(1, 1, prompt)
     
-    # Handle long input with scrolling
+    # Scroll so the cursor line and column stay visible
     input_width = max_x - len(prompt) - 3
-    if len(current_input) > input_width:
-        visible_input = current_input[-input_width:]
-    else:
-        visible_input = current_input
-    
+    rows = max_y - 2
+    row, col = composer.cursor_row_col()
+    first_row = max(0, row - rows + 1)
+    for idx, line in enumerate(composer.lines[first_row:first_row + rows]):
+        offset = max(0, col - input_width + 1) if first_row + idx == row else 0
+        try:
+            win.addstr(1 + idx, len(prompt) + 1, line[offset:offset + input_width].encode('utf-8'))
+        except curses.error:
+            pass
+    win.refresh()
+
+    begin_y, begin_x = win.getbegyx()
+    return begin_y + 1 + row - first_row, begin_x + len(prompt) + 1 + min(col, input_width - 1)
+
+# Pseudo keys produced by read_escape
+PASTE = 'paste'
+ALT_ENTER = 'alt-enter'
+PASTE_START = '[200~'
+PASTE_END = '\x1b[201~'
+PASTE_IDLE_TIMEOUT = 0.5  # Give up on a paste whose end marker never arrives
+INPUT_POLL_MS = 100
+MAX_EVENTS_PER_FRAME = 200
+# Tallest the composer grows before it scrolls
+MAX_COMPOSER_ROWS = 6
+ERROR_SHOWN_SECONDS = 10  # How long an error stays in the status line
+
+def read_key(stdscr):
+    """Wait briefly for input: a str for characters, an int for special keys"""
     try:
-        # Ensure proper UTF-8 encoding for display
-        visible_input = visible_input.encode('utf-8').decode('utf-8')
-        win.addstr(1, len(prompt) + 1, visible_input.encode('utf-8'))
+        return stdscr.get_wch()
     except curses.error:
-        pass
-    win.refresh()
+        return None
+
+def unget_keys(keys):
+    for key in reversed(keys):
+        if isinstance(key, str):
+            curses.unget_wch(key)
+        else:
+            curses.ungetch(key)
+
+def read_pending(stdscr):
+    """Read input that has already arrived without waiting for more"""
+    stdscr.nodelay(True)
+    try:
+        return stdscr.get_wch()
+    except curses.error:
+        return None
+    finally:
+        stdscr.timeout(INPUT_POLL_MS)
+
+def read_escape(stdscr):
+    """Classify the input following an ESC that was just read"""
+    pending = []
+    while len(pending) < len(PASTE_START):
+        key = read_pending(stdscr)
+        if key is None:
+            break
+        pending.append(key)
+        if len(pending) == 1 and key in ('\n', '\r'):
+            return ALT_ENTER
+        if key != PASTE_START[len(pending) - 1]:
+            break
+    if len(pending) == len(PASTE_START) and ''.join(pending) == PASTE_START:
+        return PASTE
+    unget_keys(pending)
+    return '\x1b'
+
+def read_paste(stdscr):
+    """Collect a bracketed paste up to its end marker in one batch"""
+    chars = []
+    idle_since = None
+    stdscr.nodelay(True)
+    try:
+        while True:
+            try:
+                key = stdscr.get_wch()
+            except curses.error:
+                # The terminal may deliver a large paste in several chunks
+                idle_since = idle_since or time.monotonic()
+                if time.monotonic() - idle_since > PASTE_IDLE_TIMEOUT:
+                    break
+                time.sleep(0.005)
+                continue
+            idle_since = None
+            if isinstance(key, str):
+                chars.append(key)
+                if key == '~' and ''.join(chars[-len(PASTE_END):]) == PASTE_END:
+                    del chars[-len(PASTE_END):]
+                    break
+    finally:
+        stdscr.timeout(INPUT_POLL_MS)
+    return ''.join(chars).replace('\r\n', '\n').replace('\r', '\n')
+
+def drain_text(stdscr):
+    """Read printable characters that are already waiting, e.g. an unbracketed paste"""
+    chars = []
+    while True:
+        key = read_pending(stdscr)
+        if key is None:
+            break
+        if not (isinstance(key, str) and key.isprintable()):
+            unget_keys([key])
+            break
+        chars.append(key)
+    return ''.join(chars)
 
 def draw_loading_popup(stdscr, message):
     """Draw a centered popup with loading message"""
@@ -255,8 +637,26 @@ def draw_loading_popup(stdscr, message):
 def draw_status_line(win, ui_state):
     """Draw status line at the bottom of the window"""
     max_y, max_x = win.getmaxyx()
-    status = f" Mode: {'Favorites' if ui_state.display_mode == 2 else 'All'} | "
+    status = f" Folder: {ui_state.folder_name} | "
+    if ui_state.error and time.monotonic() - ui_state.error[1] < ERROR_SHOWN_SECONDS:
+        status = f" Error: {ui_state.error[0]} |" + status
     status += f"Focus: {'Messages' if ui_state.input_focused else 'Chats'} | "
+    downloads = ui_state.download_stats
+    if downloads and (downloads['active'] or downloads['queued']):
+        status += (f"Downloads: {downloads['active']} active, {downloads['queued']} queued, "
+                   f"{downloads['bytes_per_second'] / 1024:.0f} KB/s | ")
+    if ui_state.uploads:
+        upload = ui_state.shown_upload()
+        if upload['state'] == 'queued':
+            status += f"Upload queued: {upload['name']}"
+        elif upload['state'] == 'sending':
+            status += f"Sending {upload['name']}"
+        else:
+            status += (f"Uploading {upload['name']}: {upload['sent'] * 100 // upload['size']}%, "
+                       f"{upload['bytes_per_second'] / 1048576:.1f} MB/s")
+        if len(ui_state.uploads) > 1:
+            status += f" (+{len(ui_state.uploads) - 1} more)"
+        status += " | ^X cancel | "
     status += "? for help"
     
     try:
@@ -268,52 +668,52 @@ def draw_status_line(win, ui_state):
         pass
 
 class UIState:
-    def __init__(self):
-        self.display_mode = 1  # 1 for All, 2 for Favorites
-        self.favorites = set()
+    def __init__(self, session):
+        self.folder_idx = 0  # Index into self.folders, 0 is All
+        self.session = session
+        self.favorites = session.favorites
+        self.folders = FolderViews(self.favorites)
         self.filtered_chat_idx = 0
         self.input_focused = False  # Track input focus in UIState
-        self.load_favorites()
-    
-    def load_favorites(self):
-        try:
-            if os.path.exists('favorites.json'):
-                with open('favorites.json', 'r') as f:
-                    self.favorites = set(json.load(f))
-                logger.info(f"Loaded {len(self.favorites)} favorites")
-        except Exception as e:
-            logger.error(f"Failed to load favorites: {e}")
-            self.favorites = set()
-    
-    def save_favorites(self):
-        try:
-            with open('favorites.json', 'w') as f:
-                json.dump(list(self.favorites), f)
-            logger.info(f"Saved {len(self.favorites)} favorites")
-        except Exception as e:
-            logger.error(f"Failed to save favorites: {e}")
-    
-    def add_favorite(self, chat_id):
-        if chat_id not in self.favorites:
-            self.favorites.add(chat_id)
-            self.save_favorites()
-            return True
-        return False
-    
-    def remove_favorite(self, chat_id):
-        if chat_id in self.favorites:
-            self.favorites.discard(chat_id)
-            self.save_favorites()
-            return True
-        return False
-    
-    def filter_chats(self, chats):
-        filtered = []
-        if self.display_mode == 2:  # Favorites
-            filtered = [c for c in chats if c['id'] in self.favorites]
-        else:  # Mode 1: Show all
-            filtered = chats
-        
+        self.download_stats = None  # Latest download manager report
+        self.uploads = {}  # (account, upload id) -> latest progress of an unfinished upload
+        self.error = None  # (message, time) of the latest error, shown for a while
+
+    @property
+    def folder_name(self):
+        return self.folders.name(self.folder_idx)
+
+    def add_favorite(self, chat):
+        if not self.session.add_favorite(*chat_key(chat)):
+            return False
+        self.folders.chat_changed(chat_key(chat))
+        return True
+
+    def remove_favorite(self, chat):
+        if not self.session.remove_favorite(*chat_key(chat)):
+            return False
+        self.folders.chat_changed(chat_key(chat))
+        return True
+
+    def shown_upload(self):
+        """The upload in the status line, which Ctrl+X cancels: a running one, else the next queued"""
+        return min(self.uploads.values(), key=lambda upload: (upload['state'] == 'queued', upload['upload_id']))
+
+    def switch_folder(self, step):
+        self.folder_idx = (self.folder_idx + step) % len(self.folders)
+
+    def select(self, key):
+        """Move the selection to a chat if the current folder shows it"""
+        idx = self.folders.index_of(self.folder_idx, key)
+        if idx is not None:
+            self.filtered_chat_idx = idx
+        return idx is not None
+
+    def filter_chats(self):
+        """The current folder's chats; kept up to date by self.folders, so O(1)"""
+        self.folder_idx = min(self.folder_idx, len(self.folders) - 1)
+        filtered = self.folders.view(self.folder_idx)
+
         # Adjust current index if needed
         if filtered and self.filtered_chat_idx >= len(filtered):
             self.filtered_chat_idx = len(filtered) - 1
@@ -325,7 +725,7 @@ class UIState:
 def show_help_popup(stdscr):
     height, width = stdscr.getmaxyx()
     # Create a centered popup
-    popup_height = 12
+    popup_height = 18
     popup_width = 50
     popup_y = (height - popup_height) // 2
     popup_x = (width - popup_width) // 2
@@ -336,13 +736,18 @@ def show_help_popup(stdscr):
     
     shortcuts = [
         ("Shift + ↑/↓", "Navigate between chats"),
-        ("Shift + [/]", "Toggle All/Favorites mode"),
+        ("Shift + [/]", "Previous/next chat folder"),
         ("Shift + =", "Add to favorites"),
         ("Shift + -", "Remove from favorites"),
         ("↑/↓", "Scroll messages"),
+        ("g", "Jump to date"),
+        ("i", "Toggle inline photos"),
         ("Tab", "Toggle input focus"),
         ("Esc", "Clear input"),
         ("Enter", "Send message"),
+        ("Alt + Enter", "New line in message"),
+        ("Ctrl + F", "Send a file"),
+        ("Ctrl + X", "Cancel the shown upload"),
         ("Ctrl + C", "Exit application"),
         ("?", "Show this help"),
     ]
@@ -354,6 +759,39 @@ def show_help_popup(stdscr):
     popup.refresh()
     popup.getch()
 
+def prompt_popup(stdscr, title, hint="", max_length=None):
+    """Read a line of text in a centered popup; returns None on Esc
+
+    Text longer than the popup scrolls, showing its end.
+    """
+    height, width = stdscr.getmaxyx()
+    popup_width = min(width - 4, 50)
+    if max_length is None:
+        max_length = popup_width - 5
+    popup = curses.newwin(5, popup_width, (height - 5) // 2, (width - popup_width) // 2)
+    popup.keypad(True)
+    popup.box()
+    popup.addstr(0, 2, f" {title} ")
+    if hint:
+        popup.addstr(3, 2, hint[:popup_width - 4])
+    curses.curs_set(1)
+
+    text = ""
+    while True:
+        visible = text[-(popup_width - 5):]
+        popup.addstr(1, 2, visible.ljust(popup_width - 4))
+        popup.move(1, 2 + len(visible))
+        popup.refresh()
+        key = popup.getch()
+        if key == 27:  # ESC
+            return None
+        elif key in (10, 13):
+            return text
+        elif key in (curses.KEY_BACKSPACE, 127, 8):
+            text = text[:-1]
+        elif 32 <= key < 127 and len(text) < max_length:
+            text += chr(key)
+
 def parse_ansi(text):
     """Parse ANSI escape codes and return list of (color_code, segment) tuples"""
     ansi_escape = re.compile(r'\033\[(\d+(?:;\d+)*)m')
@@ -399,110 +837,191 @@ def display_ansi_text(window, text, color_map, y, x):
         except curses.error:
             pass  # Handle edge of window gracefully
 
+class PagedText:
+    """Source lines laid out as fixed-width rows, materialized a page at a time
+
+    Rows per source line follow from its length alone, so opening a long
+    text costs one pass of prefix sums; only the rows on screen are ever
+    sliced out. Search works on the source text and maps hits to rows.
+    """
+    def __init__(self, lines, width):
+        self.lines = lines
+        self.width = width
+        # Index of each source line's first row, plus the total at the end
+        self.row_starts = [0]
+        self.row_starts.extend(itertools.accumulate(max(1, -(-len(line) // width)) for line in lines))
+        # Character offset of each source line in the joined text
+        self.line_offsets = [0]
+        self.line_offsets.extend(itertools.accumulate(len(line) + 1 for line in lines))
+        self._folded = None
+
+    def __len__(self):
+        return self.row_starts[-1]
+
+    def rows(self, first, count):
+        """The rows first..first+count as (row, text) pairs"""
+        rows = []
+        line_idx = bisect.bisect_right(self.row_starts, first) - 1
+        row = first
+        while line_idx < len(self.lines) and row < first + count:
+            part = row - self.row_starts[line_idx]
+            rows.append((row, self.lines[line_idx][part * self.width:(part + 1) * self.width]))
+            row += 1
+            if row >= self.row_starts[line_idx + 1]:
+                line_idx += 1
+        return rows
+
+    def search(self, query):
+        """(row, column) of every case-insensitive match, in order"""
+        if self._folded is None:
+            self._folded = '\n'.join(self.lines).lower()
+        query = query.lower()
+        hits = []
+        offset = self._folded.find(query)
+        while offset != -1 and query:
+            line_idx = bisect.bisect_right(self.line_offsets, offset) - 1
+            column = offset - self.line_offsets[line_idx]
+            hits.append((self.row_starts[line_idx] + column // self.width, column % self.width))
+            offset = self._folded.find(query, offset + 1)
+        return hits
+
+    def spans(self, row, column, length):
+        """(row, column, length) of each row a match starting at (row, column) covers"""
+        spans = []
+        while length > 0:
+            part = min(length, self.width - column)
+            spans.append((row, column, part))
+            row, column, length = row + 1, 0, length - part
+        return spans
+
+# Preview layouts of recently opened messages; entries keep a reference to
+# the message so the id() key cannot be reused while cached
+preview_cache = LRUCache(16)
+
+def preview_text(message, width, art=None):
+    """Layout of a message's photo, caption and text for the preview, cached"""
+    key = (id(message), width, art is not None)
+    cached = preview_cache.get(key)
+    if cached and cached[0] is message and cached[1] == message['text']:
+        return cached[2]
+    lines = []
+    if art:
+        lines.extend(art.split('\n'))
+        if message.get('caption'):
+            lines.extend(["", f"Caption: {message['caption']}"])
+    text = message['text'] or '[empty message]'
+    if text != '📷 Photo':
+        if lines:
+            lines.append("")
+        lines.extend(text.split('\n'))
+    layout = PagedText(lines, width)
+    preview_cache.put(key, (message, message['text'], layout))
+    return layout
+
 def show_message_preview(stdscr, message, telegram_worker):
-    """Show popup with message content"""
+    """Show a message in a scrollable popup: arrows/PgUp/PgDn/Home/End, / to search, n/N for next/previous match"""
     logger.info("Opening message preview")
     height, width = stdscr.getmaxyx()
-    popup_height = min(height - 8, 30)
-    popup_width = min(width - 4, 80)
-    
-    logger.info(f"Popup dimensions: {popup_width}x{popup_height}")
-    
-    start_y = (height - popup_height) // 2
-    start_x = (width - popup_width) // 2
-    
-    popup = curses.newwin(popup_height, popup_width, start_y, start_x)
-    popup.box()
-    
-    try:
-        current_line = 1
-        # Draw header
-        timestamp = message['timestamp']
-        today = datetime.now().date()
-        msg_date = timestamp.date()
-        
-        time_str = timestamp.strftime('%H:%M')
-        if msg_date == today:
-            date_str = "Today"
-        elif msg_date == today - timedelta(days=1):
-            date_str = "Yesterday"
-        else:
-            date_str = timestamp.strftime('%d.%m.%Y')
-            
-        timestamp_str = f"[{time_str} {date_str}]"
-        header = f"{timestamp_str} {message['from_user']}:"
-        
-        popup.addstr(current_line, 2, header[:popup_width-4])
-        current_line += 1
-        
-        # Handle photo content
-        if message.get('has_photo'):
-            logger.info("Message has photo, fetching...")
-            photo_data = asyncio.run_coroutine_threadsafe(
-                telegram_worker.get_message_photo(message),
-                telegram_worker.loop
-            ).result()
-            
-            if photo_data:
-                logger.info("Got photo data, creating ASCII art")
-                image = photo_data['data']
-                # Calculate available space for the image
-                available_height = popup_height - current_line - 3  # Leave space for caption
-                ascii_art = telegram_worker._create_ascii_art(
-                    image, 
-                    popup_width-4,
-                    available_height
-                )
-                
-                # Draw ASCII art
-                art_lines = ascii_art.split('\n')
-                logger.info(f"ASCII art has {len(art_lines)} lines")
-                for line in art_lines:
-                    if current_line < popup_height - 1:
-                        popup.addstr(current_line, 2, line)
-                        current_line += 1
-                
-                # Draw caption if exists
-                if photo_data.get('caption'):
-                    current_line += 1
-                    popup.addstr(current_line, 2, f"Caption: {photo_data['caption']}")
-                    current_line += 1
-        
-        # Draw message text
-        text = message['text'] or '[empty message]'
-        if text and text != '📷 Photo':
-            current_line += 1
-            text_lines = text.split('\n')
-            logger.info(f"Message text has {len(text_lines)} lines")
-            for line in text_lines:
-                if len(line) > popup_width - 4:
-                    wrapped = [line[i:i+popup_width-4] 
-                             for i in range(0, len(line), popup_width-4)]
-                    for wrapped_line in wrapped:
-                        if current_line < popup_height - 1:
-                            popup.addstr(current_line, 2, wrapped_line)
-                            current_line += 1
-                else:
-                    if current_line < popup_height - 1:
-                        popup.addstr(current_line, 2, line)
-                        current_line += 1
-                        
-    except Exception as e:
-        logger.error(f"Error in message preview: {e}", exc_info=True)
-    
-    popup.refresh()
-    
-    # Wait for ESC key
+    popup_height = max(6, height - 4)
+    popup_width = min(width - 4, 100)
+    text_width = popup_width - 4
+    page_rows = popup_height - 4  # Border, header and footer
+
+    popup = curses.newwin(popup_height, popup_width, (height - popup_height) // 2, (width - popup_width) // 2)
+    popup.keypad(True)
+
+    # The header is format_message's prefix, with the day added
+    header = f"{format_message(message, header_only=True)} {day_label(message['timestamp'].date())}"
+
+    art = None
+    if message.get('has_photo'):
+        try:
+            art = telegram_worker.request_photo(message, text_width, page_rows).result()
+        except Exception as e:
+            logger.error(f"Could not render photo: {e}")
+            art = "[image unavailable]"
+    layout = preview_text(message, text_width, art)
+
+    top = 0
+    query = ""
+    hits = []
+    hit_idx = -1
     while True:
+        top = max(0, min(top, len(layout) - page_rows))
+        popup.erase()
+        popup.box()
         try:
-            key = stdscr.getch()
-            if key == 27:  # ESC
-                break
+            popup.addstr(1, 2, header[:text_width], curses.A_BOLD)
+            hit_rows = {}
+            for row, col in hits:
+                # A match wrapped onto the next row is highlighted on both
+                for span_row, span_col, length in layout.spans(row, col, len(query)):
+                    hit_rows.setdefault(span_row, []).append((span_col, length))
+            for y, (row, line) in enumerate(layout.rows(top, page_rows), 2):
+                popup.addstr(y, 2, line)
+                for col, length in hit_rows.get(row, ()):
+                    popup.addstr(y, 2 + col, line[col:col + length], curses.A_REVERSE)
+            position = f" {min(top + page_rows, len(layout))}/{len(layout)} "
+            if query:
+                position = f" /{query}: {hit_idx + 1}/{len(hits)} |{position}"
+            footer = " Esc close | / search | n/N next/prev "
+            popup.addstr(popup_height - 1, 2, footer[:max(0, text_width - len(position))])
+            popup.addstr(popup_height - 1, max(2, popup_width - 2 - len(position)), position[:text_width])
+        except curses.error:
+            pass
+        popup.refresh()
+
+        try:
+            key = popup.getch()
         except curses.error:
             continue
+        if key in (27, ord('q')):  # ESC
+            break
+        elif key in (curses.KEY_UP, ord('k')):
+            top -= 1
+        elif key in (curses.KEY_DOWN, ord('j')):
+            top += 1
+        elif key in (curses.KEY_PPAGE, ord('b')):
+            top -= page_rows
+        elif key in (curses.KEY_NPAGE, ord(' ')):
+            top += page_rows
+        elif key == curses.KEY_HOME:
+            top = 0
+        elif key == curses.KEY_END:
+            top = len(layout)
+        elif key == ord('/'):
+            entry = prompt_popup(stdscr, "Search in message")
+            popup.touchwin()
+            if entry:
+                query = entry
+                hits = layout.search(query)
+                # First match on or below the current page
+                hit_idx = next((i for i, (row, _) in enumerate(hits) if row >= top), 0) if hits else -1
+                if hits:
+                    top = hits[hit_idx][0] - page_rows // 2
+        elif key in (ord('n'), ord('N')) and hits:
+            hit_idx = (hit_idx + (1 if key == ord('n') else -1)) % len(hits)
+            top = hits[hit_idx][0] - page_rows // 2
 
-def main(stdscr):
+def main(stdscr, profiler=None):
     logger.info("Starting UI...")
+    startup = StartupReport()
+    # Tags the UI thread's profile samples with what it is doing
+    set_tag = profiler.set_tag if profiler else (lambda tag: None)
+
+    # Attach to a running daemon if there is one; it is already connected and
+    # replays its cached state. Otherwise start the Telegram workers first so
+    # that importing Pyrogram and connecting overlap with curses setup and the
+    # first paint. All accounts share one thread and event loop.
+    workers = attach_to_daemon() or run_telegram_workers()
+    if profiler:
+        profiler.register_thread("ui")
+        profiler.watch_loop(workers.loop)
+        profiler.start()
+    session = SessionState()
+    session.start()
+
+    curses_started = time.perf_counter()
     # Remove the locale setup here since we did it at the top
     # Enable proper Unicode support in curses
     curses.meta(1)  # Enable 8-bit input
@@ -522,7 +1041,12 @@ def main(stdscr):
         curses.init_pair(8, 8, -1)   # Gray for muted
 
     curses.curs_set(1)
-    stdscr.nodelay(True)  # make getch non-blocking
+    # Wait at most this long for input, but wake up as soon as a key arrives
+    stdscr.timeout(INPUT_POLL_MS)
+
+    # Bracketed paste mode: the terminal wraps pastes in ESC[200~ ... ESC[201~
+    sys.stdout.write('\x1b[?2004h')
+    sys.stdout.flush()
     
     # Enable mouse events
     curses.mousemask(curses.ALL_MOUSE_EVENTS | curses.REPORT_MOUSE_POSITION)
@@ -541,319 +1065,643 @@ def main(stdscr):
     # Initialize state
     chats = []
     messages_by_chat = {}
-    current_input = ""
+    composer = Composer()
+    composer_rows = 1
+    thumbnails = ThumbnailLoader()
+    users_requested = set()  # Sender ids already asked for
+    # Message id -> message for each list in messages_by_chat, for edits and deletes
+    message_index = MessageIndex()
+    # Chat dicts by key, for updates addressed to one chat
+    chat_index = {}
+    # Highest message id seen per chat, as last reported to the worker
+    read_up_to = {}
+    # Enriched sidebar metadata by chat key, re-applied when dialogs reload
+    dialog_meta = {}
+    meta_requested_keys = frozenset()
+    meta_requested_at = 0
     scroll_position = 0
-    ui_state = UIState()
-
-    # Start the Telegram worker thread
-    telegram_worker = run_telegram_worker()
-
-    # Add state for chat loading
-    is_loading_chats = False
+    ui_state = UIState(session)
+    startup.mark("curses init", curses_started)
 
     # Add state for message loading
-    SCROLL_THRESHOLD = 10  # Load more messages when this close to the top
+    SCROLL_THRESHOLD = 10  # Load newer messages of a detached window this close to the bottom
+    history_paging = HistoryPaging()  # When to load older messages, and how many
 
     # Add loading popup tracking
     loading_popup = None
 
+    # Chats whose cached history is a window that does not reach the newest
+    # message, e.g. after jumping to an old date
+    detached_chats = set()
+    # Chat waiting for an anchored page after a jump to an uncached date
+    pending_jump_key = None
+
+    def scroll_to_message(messages, idx):
+        """Scroll position that puts the message at idx under the cursor"""
+        return max(0, len(messages) - idx - 1)
+
+    # Chat open in the previous session, shown until its account's dialogs arrive
+    restored_chat = session.last_chat
+    if restored_chat and not workers.get(restored_chat['account']):
+        restored_chat = None
+    # (chat key, saved scroll position) applied once the chat's history arrives
+    pending_scroll = None
+
     def get_current_chat():
         """Get currently selected chat info"""
-        filtered_chats = ui_state.filter_chats(chats)
+        if restored_chat:
+            return restored_chat
+        filtered_chats = ui_state.filter_chats()
         if filtered_chats and 0 <= ui_state.filtered_chat_idx < len(filtered_chats):
             return filtered_chats[ui_state.filtered_chat_idx]
         return None
 
-    def get_current_chat_id():
-        """Get currently selected chat ID"""
+    def get_current_chat_key():
+        """Get the (account, chat ID) key of the selected chat"""
         current_chat = get_current_chat()
         if current_chat:
-            return current_chat['id']
+            return chat_key(current_chat)
         return None
 
+    def worker_for(chat):
+        """Get the worker of the account a chat belongs to"""
+        return workers.get(chat['account'])
+
+    def fit_composer():
+        """Grow the input box with the composer, shrinking the message pane"""
+        nonlocal composer_rows
+        rows = min(len(composer.lines), MAX_COMPOSER_ROWS)
+        if rows == composer_rows:
+            return
+        extra = rows - 1
+        # Order the calls so no window ever extends past the screen
+        if rows > composer_rows:
+            chat_messages_win.resize(height - 8 - extra, chat_area_width)
+            input_win.mvwin(height - 5 - extra, sidebar_width)
+            input_win.resize(3 + extra, chat_area_width)
+        else:
+            input_win.resize(3 + extra, chat_area_width)
+            input_win.mvwin(height - 5 - extra, sidebar_width)
+            chat_messages_win.resize(height - 8 - extra, chat_area_width)
+        composer_rows = rows
+
+    def leave_chat(chat):
+        """Remember the draft and scroll position of the chat being left"""
+        nonlocal pending_jump_key
+        session.set_draft(chat['account'], chat['id'], composer.text)
+        session.set_scroll_position(chat['account'], chat['id'], scroll_position)
+        # Its thumbnails are no longer worth a download slot
+        thumbnails.cancel_pending()
+        if pending_jump_key == chat_key(chat):
+            pending_jump_key = None
+        # Keep only the newest messages of chats in the background
+        key = chat_key(chat)
+        if key in detached_chats:
+            messages_by_chat.pop(key, None)
+            detached_chats.discard(key)
+        elif len(messages_by_chat.get(key, [])) > BACKGROUND_CHAT_MESSAGES:
+            messages_by_chat[key] = messages_by_chat[key][-BACKGROUND_CHAT_MESSAGES:]
+
+    def enter_chat(chat):
+        """Open a chat with its saved draft and scroll position"""
+        nonlocal scroll_position, pending_scroll, pending_jump_key
+        key = chat_key(chat)
+        composer.set_text(session.draft(*key))
+        saved_scroll = session.scroll_position(*key)
+        cached = messages_by_chat.get(key)
+        unread_count = chat.get('unread_messages_count', 0)
+        if unread_count:
+            # The worker loads a page around the first unread message and
+            # the cursor goes to it; the saved position is out of date
+            scroll_position = 0
+            pending_scroll = None
+            pending_jump_key = key
+        elif cached:
+            scroll_position = min(saved_scroll, len(cached) - 1)
+            pending_scroll = None
+        else:
+            scroll_position = 0
+            pending_scroll = (key, saved_scroll) if saved_scroll else None
+        session.set_last_chat(chat)
+        # Views the previous chat no longer matches drop it now, which can
+        # shift this chat's row
+        ui_state.folders.set_current(key)
+        ui_state.select(key)
+        worker_for(chat).set_current_chat(chat['id'], unread_count)
+
+    def mark_seen(chat, messages, first_idx, last_idx):
+        """Acknowledge the newest message on screen and update unread counters locally"""
+        key = chat_key(chat)
+        if key == pending_jump_key:
+            # What is on screen is about to be replaced by the anchored page
+            return
+        seen = next((m for m in reversed(messages[first_idx:last_idx + 1]) if m.get('id')), None)
+        if not seen or seen['id'] <= read_up_to.get(key, 0):
+            return
+        read_up_to[key] = seen['id']
+        # The worker debounces these into one read request per chat
+        worker_for(chat).mark_read(chat['id'], seen['id'])
+
+        listed = chat_index.get(key)
+        if listed and key not in detached_chats:
+            remaining = sum(1 for m in messages[last_idx + 1:]
+                            if not m.get('is_outgoing') and m.get('id', 0) > seen['id'])
+            listed['unread_messages_count'] = min(listed.get('unread_messages_count', 0), remaining)
+            if not remaining:
+                listed['unread_mentions_count'] = 0
+                listed['unread_mark'] = False
+            ui_state.folders.chat_changed(key)
+
+    def scroll_older(step):
+        """Scroll towards older messages, asking for more in time to never reach the top"""
+        nonlocal scroll_position
+        screen = chat_messages_win.getmaxyx()[0]  # Less the rows a tall composer takes
+        max_scroll = max(0, len(current_messages) - screen)
+        scroll_position = min(scroll_position + step, max_scroll)
+        history_paging.scrolled(step)
+        limit = history_paging.want_older(current_chat_key, max_scroll - scroll_position, screen)
+        oldest_id = next((m['id'] for m in current_messages if 'id' in m), None)
+        if limit and current_chat and oldest_id is not None:
+            worker_for(current_chat).request_history(
+                current_chat['id'], limit=limit, before_message_id=oldest_id)
+
+    def request_newer_messages():
+        """At the bottom of a detached window, load the next newer page"""
+        if current_chat and current_chat_key in detached_chats:
+            newest_id = next((m['id'] for m in reversed(current_messages) if 'id' in m), None)
+            if newest_id is None:
+                return
+            worker_for(current_chat).request_history(current_chat['id'], after_message_id=newest_id)
+
+    if restored_chat:
+        # Ask for the last chat's history now; it loads while the dialog
+        # list is still being fetched
+        enter_chat(restored_chat)
+
+    # Paint the empty UI shell right away instead of waiting for the worker
+    draw_sidebar(sidebar_win, [], 0, ui_state, workers)
+    draw_chat_header(chat_header_win, "No chat selected")
+    draw_messages(chat_messages_win, [])
+    draw_input_box(input_win, composer)
+    draw_status_line(stdscr, ui_state)
+
     # Show initial loading message using the new popup
     loading_popup = draw_loading_popup(stdscr, "Connecting to Telegram...")
+    startup.first_frame()
 
     try:
         while True:
-            try:
-                event = ui_queue.get_nowait()
-                logger.debug(f"Received event: {event['type']}")
-                
+            # Handle everything that has arrived before drawing the next frame
+            for _ in range(MAX_EVENTS_PER_FRAME):
                 try:
-                    if event["type"] == "loading_progress":
-                        # Update existing loading popup
-                        loading_popup = draw_loading_popup(stdscr, event["message"])
-                    elif event["type"] == "new_message":
-                        logger.info(f"New message in chat {event['chat_id']}")
-                        chat_id = event.get("chat_id")
-                        message = event.get("message")
-                        if chat_id is not None and message is not None:
-                            if chat_id not in messages_by_chat:
-                                messages_by_chat[chat_id] = []
-                            # Add the message to our local cache
-                            messages_by_chat[chat_id].append(message)
-                            # Auto-scroll to bottom for new messages in current chat
-                            if chat_id == get_current_chat_id():
-                                scroll_position = 0
-                        else:
-                            logger.error("Invalid message event format")
+                    event = ui_queue.get_nowait()
+                    logger.debug(f"Received event: {event['type']}")
+                    set_tag(f"event:{event['type']}")
+                
+                    try:
+                        if event["type"] == "startup_timing":
+                            startup.add_worker_phase(event["phase"], event["ms"])
+                        elif event["type"] == "download_stats":
+                            ui_state.download_stats = event
+                        elif event["type"] == "upload_progress":
+                            key = (event["account"], event["upload_id"])
+                            if event["state"] in ("done", "failed", "cancelled"):
+                                ui_state.uploads.pop(key, None)
+                            else:
+                                ui_state.uploads[key] = event
+                        elif event["type"] == "thumbnail_loaded":
+                            thumbnails.loaded(event)
+                        elif event["type"] == "dialog_metadata":
+                            for meta in event["chats"]:
+                                key = (event["account"], meta.pop("id"))
+                                dialog_meta[key] = meta
+                                if key in chat_index:
+                                    chat_index[key].update(meta)
+                                    ui_state.folders.chat_changed(key)
+                        elif event["type"] == "chat_folders":
+                            selected = get_current_chat()
+                            ui_state.folders.set_server_folders(event["account"], event["folders"])
+                            ui_state.filter_chats()  # Clamps the folder and selection
+                            if selected:
+                                ui_state.select(chat_key(selected))
+                        elif event["type"] == "users":
+                            for user in event["users"]:
+                                sender_names[user["id"]] = user["name"]
+                        elif event["type"] == "reply_context":
+                            snippets = {snippet["id"]: snippet for snippet in event["messages"]}
+                            for message in messages_by_chat.get((event["account"], event["chat_id"]), []):
+                                if message.get('reply_to_id') in snippets and not message.get('reply_to'):
+                                    # The new reply_to invalidates just this row's cached layout
+                                    message['reply_to'] = snippets[message['reply_to_id']]
+                        elif event["type"] == "messages_edited":
+                            key = (event["account"], event["chat_id"])
+                            index = message_index.lookup(key, messages_by_chat.get(key, []))
+                            for edited in event["messages"]:
+                                message = index.get(edited["id"])
+                                if message is not None:
+                                    # The changed text invalidates just this row's cached layout
+                                    message.update(edited)
+                        elif event["type"] == "messages_deleted":
+                            key = (event["account"], event["chat_id"])
+                            cached = messages_by_chat.get(key)
+                            deleted = set(event["message_ids"])
+                            if cached and any(message_id in message_index.lookup(key, cached) for message_id in deleted):
+                                remaining = [m for m in cached if m.get('id') not in deleted]
+                                if key == get_current_chat_key():
+                                    # Keep the cursor on the same message
+                                    highlighted = len(cached) - scroll_position - 1
+                                    removed_below = sum(1 for m in cached[highlighted + 1:] if m.get('id') in deleted)
+                                    scroll_position = max(0, min(scroll_position - removed_below, len(remaining) - 1))
+                                messages_by_chat[key] = remaining
+                        elif event["type"] == "loading_progress":
+                            # Update existing loading popup
+                            loading_popup = draw_loading_popup(stdscr, event["message"])
+                        elif event["type"] == "new_message":
+                            logger.info(f"New message in chat {event['chat_id']}")
+                            chat_id = event.get("chat_id")
+                            message = event.get("message")
+                            if chat_id is not None and message is not None:
+                                key = (event["account"], chat_id)
+                                # Skip chats showing an older window; the message
+                                # is not contiguous with what is on screen
+                                if key not in detached_chats:
+                                    if key not in messages_by_chat:
+                                        messages_by_chat[key] = []
+                                    # Add the message to our local cache
+                                    messages_by_chat[key].append(message)
+                                    if key != get_current_chat_key() and len(messages_by_chat[key]) > 2 * BACKGROUND_CHAT_MESSAGES:
+                                        # Background chats keep a bounded ring; a new list
+                                        # object keeps the per-list caches valid
+                                        messages_by_chat[key] = messages_by_chat[key][-BACKGROUND_CHAT_MESSAGES:]
+                                    # Auto-scroll to bottom for new messages in current chat
+                                    if key == get_current_chat_key():
+                                        scroll_position = 0
+                                if key != get_current_chat_key() and not message.get('is_outgoing') and key in chat_index:
+                                    chat = chat_index[key]
+                                    chat['unread_messages_count'] = chat.get('unread_messages_count', 0) + 1
+                                    ui_state.folders.chat_changed(key)
+                            else:
+                                logger.error("Invalid message event format")
                     
-                    elif event["type"] == "error":
-                        logger.error(f"Error event received: {event.get('message', 'Unknown error')}")
-                        # Show errors in current chat
-                        chat_id = get_current_chat_id()
-                        if chat_id:
-                            if chat_id not in messages_by_chat:
-                                messages_by_chat[chat_id] = []
-                            messages_by_chat[chat_id].append({
-                                'text': f"Error: {event.get('message', 'Unknown error')}",
-                                'timestamp': datetime.now(),
-                                'from_user': 'System',
-                                'is_outgoing': False
-                            })
+                        elif event["type"] == "error":
+                            logger.error(f"Error event received: {event.get('message', 'Unknown error')}")
+                            # Shown in the status line; chat histories only hold real messages
+                            ui_state.error = (event.get('message', 'Unknown error'), time.monotonic())
                     
-                    elif event["type"] == "chats_loaded":
-                        # Clear loading popup when done
-                        if loading_popup:
-                            loading_popup = None
-                            stdscr.touchwin()  # Force full redraw
-                            stdscr.refresh()
-                        chats = event["chats"]
-                        logger.info(f"Loaded {len(chats)} chats")
-                        if chats:
-                            telegram_worker.set_current_chat(chats[0]['id'])
+                        elif event["type"] == "chats_loaded":
+                            # Clear loading popup when done
+                            if loading_popup:
+                                loading_popup = None
+                                stdscr.touchwin()  # Force full redraw
+                                stdscr.refresh()
+                            selected = get_current_chat()
+                            # Each account reports its own dialogs; merge them
+                            for chat in event["chats"]:
+                                chat.update(dialog_meta.get((event["account"], chat['id']), {}))
+                            chats = merge_account_chats(chats, event["account"], event["chats"])
+                            chat_index = {chat_key(c): c for c in chats}
+                            ui_state.folders.set_chats(chats)
+                            logger.info(f"Loaded {len(event['chats'])} chats for account {event['account']}")
+                            startup.report()
+                            if restored_chat and restored_chat['account'] == event["account"]:
+                                restored_chat = None
+                            if not restored_chat:
+                                # Keep the selection on the same chat as the list changes
+                                filtered_chats = ui_state.filter_chats()
+                                if filtered_chats and not (selected and ui_state.select(chat_key(selected))):
+                                    if selected:
+                                        leave_chat(selected)
+                                    ui_state.filtered_chat_idx = 0
+                                    enter_chat(filtered_chats[0])
                     
-                    elif event["type"] == "chat_history_loaded":
-                        chat_id = event.get("chat_id")
-                        messages = event.get("messages", [])
-                        is_older_messages = event.get("is_older_messages", False)
+                        elif event["type"] == "older_history_dropped":
+                            history_paging.dropped((event["account"], event["chat_id"]))
+                        elif event["type"] == "anchor_dropped":
+                            # No anchored page is coming; acknowledge what is on screen again
+                            if pending_jump_key == (event["account"], event["chat_id"]):
+                                pending_jump_key = None
+                        elif event["type"] == "dialogs_changed":
+                            # Only changed and new dialogs are sent; update them in place
+                            selected = get_current_chat()
+                            changed = []
+                            for chat in event["chats"]:
+                                key = (event["account"], chat['id'])
+                                chat.update(dialog_meta.get(key, {}))
+                                if key in chat_index:
+                                    chat_index[key].update(chat)
+                                else:
+                                    chat_index[key] = chat
+                                changed.append(chat_index[key])
+                            # Moves only these, in the merged list and in every view
+                            ui_state.folders.update_chats(changed)
+                            chats = ui_state.folders.chats
+                            logger.info(f"{len(event['chats'])} dialogs changed for account {event['account']}")
+                            if selected and not restored_chat:
+                                ui_state.select(chat_key(selected))
+                    
+                        elif event["type"] == "chat_history_loaded":
+                            chat_id = event.get("chat_id")
+                            messages = event.get("messages", [])
+                            is_older_messages = event.get("is_older_messages", False)
                         
-                        if chat_id is not None:
-                            logger.info(f"Loaded history for chat {chat_id}: {len(messages)} messages")
-                            messages_by_chat[chat_id] = messages
+                            if chat_id is not None:
+                                logger.info(f"Loaded history for chat {chat_id}: {len(messages)} messages")
+                                key = (event["account"], chat_id)
+                                previous_count = len(messages_by_chat.get(key, []))
+                                history_paging.loaded(key, is_older_messages, len(messages) - previous_count)
+                                if key != get_current_chat_key():
+                                    # E.g. a load that finished after the chat was left
+                                    messages = messages[-BACKGROUND_CHAT_MESSAGES:]
+                                messages_by_chat[key] = messages
+                                if event.get("has_newer"):
+                                    detached_chats.add(key)
+                                else:
+                                    detached_chats.discard(key)
                             
-                            # Adjust scroll position when loading older messages
-                            if is_older_messages:
-                                scroll_position = max(0, scroll_position + len(messages))
-                        else:
-                            logger.error("Invalid chat history event format")
+                                # Keep the same messages on screen when pages are added
+                                if key == get_current_chat_key():
+                                    if is_older_messages:
+                                        scroll_position = max(0, scroll_position + len(messages) - previous_count)
+                                    elif event.get("is_newer_messages"):
+                                        scroll_position = max(0, scroll_position + len(messages) - previous_count)
+                                    elif event.get("anchor_id") is not None and key == pending_jump_key:
+                                        pending_jump_key = None
+                                        anchor_idx = next((i for i, m in enumerate(messages)
+                                                           if m.get('id') == event["anchor_id"]), len(messages) - 1)
+                                        scroll_position = scroll_to_message(messages, anchor_idx)
+                                    elif pending_scroll and pending_scroll[0] == key and messages:
+                                        scroll_position = min(pending_scroll[1], len(messages) - 1)
+                                        pending_scroll = None
+                            else:
+                                logger.error("Invalid chat history event format")
                     
-                except Exception as e:
-                    logger.error(f"Error processing event {event['type']}: {str(e)}", exc_info=True)
+                    except Exception as e:
+                        logger.error(f"Error processing event {event['type']}: {str(e)}", exc_info=True)
                     
-            except queue.Empty:
-                pass
-            except Exception as e:
-                logger.error(f"Error in main event loop: {str(e)}", exc_info=True)
+                except queue.Empty:
+                    break
+                except Exception as e:
+                    logger.error(f"Error in main event loop: {str(e)}", exc_info=True)
 
+            set_tag("draw")
             # Get current chat info
             current_chat = get_current_chat()
+            current_chat_key = None
             current_messages = []
             current_chat_title = "No chat selected"
             
             if current_chat:
                 current_chat_title = current_chat['title']
-                current_messages = messages_by_chat.get(current_chat['id'], [])
+                current_chat_key = chat_key(current_chat)
+                current_messages = messages_by_chat.get(current_chat_key, [])
 
             # Redraw all windows
-            filtered_chats = ui_state.filter_chats(chats)
-            draw_sidebar(sidebar_win, filtered_chats, ui_state.filtered_chat_idx, ui_state, telegram_worker)
+            filtered_chats = ui_state.filter_chats()
+            first_row, last_row = draw_sidebar(sidebar_win, filtered_chats, ui_state.filtered_chat_idx, ui_state, workers)
+
+            # Enrich the rows on screen when they change, and again once cached data expires
+            visible_keys = frozenset(chat_key(c) for c in filtered_chats[first_row:last_row + 1])
+            if visible_keys and (visible_keys != meta_requested_keys
+                                 or time.monotonic() - meta_requested_at > DIALOG_META_TTL):
+                chat_ids_by_account = {}
+                for account, chat_id in visible_keys:
+                    chat_ids_by_account.setdefault(account, []).append(chat_id)
+                for account, chat_ids in chat_ids_by_account.items():
+                    workers.get(account).request_dialog_metadata(chat_ids)
+                meta_requested_keys = visible_keys
+                meta_requested_at = time.monotonic()
             draw_chat_header(chat_header_win, current_chat_title)
-            draw_messages(chat_messages_win, current_messages, scroll_position)
-            draw_input_box(input_win, current_input)
+            first_drawn, last_drawn = draw_messages(chat_messages_win, current_messages, scroll_position, thumbnails)
+            if current_messages:
+                mark_seen(current_chat, current_messages, first_drawn, last_drawn)
+            if current_messages:
+                # Ask for senders this UI cannot name, e.g. after attaching to a daemon
+                unnamed = {m['sender_id'] for m in current_messages[first_drawn:last_drawn + 1]
+                           if m.get('sender_id') and m['sender_id'] not in sender_names} - users_requested
+                if unnamed:
+                    users_requested.update(unnamed)
+                    worker_for(current_chat).request_users(unnamed)
+            if thumbnails.enabled and current_messages:
+                thumbnails.request_around(worker_for(current_chat), current_messages,
+                                          first_drawn, last_drawn, chat_area_width - 3)
+            fit_composer()
+            cursor_y, cursor_x = draw_input_box(input_win, composer)
             draw_status_line(stdscr, ui_state)  # Add status line
+            if ui_state.input_focused:
+                # stdscr is refreshed while waiting for input, which places the cursor
+                stdscr.move(cursor_y, cursor_x)
 
             # Handle user input
+            set_tag("input")
             try:
-                key = stdscr.getch()
+                key = read_key(stdscr)
             except KeyboardInterrupt:
                 break
+            set_tag("key")
 
-            if key == curses.ERR:
-                time.sleep(0.1)
+            if key is None:
                 continue
 
+            if key == '\x1b':
+                # ESC starts a bracketed paste, Alt+Enter, or is a plain ESC
+                key = read_escape(stdscr)
+
             # Handle key presses
-            if key == ord('?'):  # Show help
+            if key == PASTE:
+                if ui_state.input_focused:
+                    # The whole paste lands in the composer in one step and one frame
+                    composer.insert(read_paste(stdscr))
+                else:
+                    read_paste(stdscr)  # Discard it rather than run it as commands
+            elif key == '?' and not ui_state.input_focused:  # Show help
                 show_help_popup(stdscr)
-            elif key == 9:  # Tab key - toggle input mode
+            elif key == 'i' and not ui_state.input_focused:  # Inline thumbnails
+                thumbnails.enabled = not thumbnails.enabled
+                logger.info(f"Inline thumbnails {'on' if thumbnails.enabled else 'off'}")
+            elif key == 'g' and not ui_state.input_focused:  # Jump to date
+                entry = prompt_popup(stdscr, "Jump to date", "DD.MM[.YYYY], today, yesterday, tue, -7")
+                target = parse_jump_date(entry) if entry else None
+                if target and current_chat:
+                    when = datetime.combine(target, datetime.min.time())
+                    idx = find_message_at(current_messages, when)
+                    if idx >= len(current_messages) and current_chat_key not in detached_chats:
+                        # Nothing that recent; the newest messages are the closest
+                        scroll_position = 0
+                    elif current_messages and current_messages[0]['timestamp'] <= when and idx < len(current_messages):
+                        # Already cached
+                        scroll_position = scroll_to_message(current_messages, idx)
+                    else:
+                        # One anchored request instead of paging backwards
+                        pending_jump_key = current_chat_key
+                        worker = worker_for(current_chat)
+                        worker.request_history_at(current_chat['id'], when)
+                elif entry is not None:
+                    logger.info(f"Could not parse jump date: {entry}")
+            elif key == '\x06':  # Ctrl+F - send a file, with the message box as its caption
+                entry = prompt_popup(stdscr, "Send file", "Path of the file to send", max_length=4096)
+                if entry and current_chat:
+                    caption = "" if composer.is_blank() else composer.text
+                    worker_for(current_chat).send_file(os.path.expanduser(entry.strip()), current_chat['id'], caption)
+                    composer.clear()
+            elif key == '\x18':  # Ctrl+X - cancel the upload in the status line
+                if ui_state.uploads:
+                    upload = ui_state.shown_upload()
+                    workers.get(upload['account']).cancel_upload(upload['upload_id'])
+            elif key == '\t':  # Tab key - toggle input mode
                 ui_state.input_focused = not ui_state.input_focused
                 curses.curs_set(1 if ui_state.input_focused else 0)
-            elif key == 27:  # ESC key - only clear input
+            elif key == '\x1b':  # ESC key - only clear input
                 if ui_state.input_focused:
-                    current_input = ""
-            elif key == 10:  # Enter key
+                    composer.clear()
+            elif key == ALT_ENTER:
                 if ui_state.input_focused:
-                    if current_input.strip() and current_chat:
-                        try:
-                            telegram_worker.send_message(current_input)
-                            current_input = ""
-                            scroll_position = 0
-                        except Exception as e:
-                            logger.error(f"Failed to send message: {e}")
-                elif key == 27:  # Alt/Option key sequence starts with ESC
-                    # Wait briefly for next character
-                    stdscr.nodelay(False)  # Temporarily make getch blocking
-                    next_key = stdscr.getch()
-                    stdscr.nodelay(True)  # Restore non-blocking
-                    
-                    if next_key == 10:  # Alt/Option + Enter
-                        if current_messages:
-                            cursor_pos = len(current_messages) - scroll_position - 1
-                            if 0 <= cursor_pos < len(current_messages):
-                                show_message_preview(stdscr, current_messages[cursor_pos], telegram_worker)
-            elif key == ord('§'):  # Section symbol key
+                    composer.insert('\n')
+                elif current_messages:
+                    cursor_pos = len(current_messages) - scroll_position - 1
+                    if 0 <= cursor_pos < len(current_messages):
+                        show_message_preview(stdscr, current_messages[cursor_pos], worker_for(current_chat))
+            elif key == '§' and not ui_state.input_focused:  # Section symbol key
                 if current_messages:
                     cursor_pos = len(current_messages) - scroll_position - 1
                     if 0 <= cursor_pos < len(current_messages):
-                        show_message_preview(stdscr, current_messages[cursor_pos], telegram_worker)
+                        show_message_preview(stdscr, current_messages[cursor_pos], worker_for(current_chat))
             elif ui_state.input_focused:
                 # Handle input mode keys
-                if key == curses.KEY_BACKSPACE or key == 127 or key == 263:
-                    current_input = current_input[:-1]
-                elif key in (10, 13):  # Enter key
-                    if current_input.strip() and current_chat:
+                if key in (curses.KEY_BACKSPACE, '\x7f', '\x08'):
+                    composer.backspace()
+                elif key == curses.KEY_DC:
+                    composer.delete()
+                elif key in ('\n', '\r', curses.KEY_ENTER):  # Enter key
+                    if not composer.is_blank() and current_chat:
                         try:
-                            telegram_worker.send_message(current_input)
-                            current_input = ""
+                            worker_for(current_chat).send_message(composer.text, current_chat['id'])
+                            composer.clear()
                             scroll_position = 0
                         except Exception as e:
                             logger.error(f"Failed to send message: {e}")
-                elif key > 0:
-                    try:
-                        # Handle multi-byte characters
-                        if key <= 127:
-                            char = chr(key)
-                            if char.isprintable():
-                                current_input += char
-                        else:
-                            # Handle multi-byte input
-                            buf = []
-                            buf.append(key)
-                            while True:
-                                try:
-                                    key = stdscr.getch()
-                                    if key == -1:
-                                        break
-                                    buf.append(key)
-                                    # Try to decode the buffer
-                                    char = bytes(buf).decode('utf-8')
-                                    current_input += char
-                                    break
-                                except UnicodeDecodeError:
-                                    continue
-                                except Exception:
-                                    break
-                    except Exception as e:
-                        logger.error(f"Input error: {e}")
+                elif key == curses.KEY_LEFT:
+                    composer.left()
+                elif key == curses.KEY_RIGHT:
+                    composer.right()
+                elif key == curses.KEY_HOME:
+                    composer.home()
+                elif key == curses.KEY_END:
+                    composer.end()
+                elif key == curses.KEY_UP:
+                    composer.up()
+                elif key == curses.KEY_DOWN:
+                    composer.down()
+                elif isinstance(key, str) and key.isprintable():
+                    # Take everything already typed or pasted in one go
+                    composer.insert(key + drain_text(stdscr))
             else:
                 # Handle navigation mode keys
-                if key == ord('{') or key == ord('}'):  # Mode switch
-                    ui_state.display_mode = 3 - ui_state.display_mode
-                    logger.info(f"Switched to {'Favorites' if ui_state.display_mode == 2 else 'All'} mode")
-                elif key == ord('+'):  # Add to favorites
-                    chat_id = get_current_chat_id()
-                    if chat_id and ui_state.add_favorite(chat_id):
-                        logger.info(f"Added chat {chat_id} to favorites")
-                elif key == ord('_'):  # Remove from favorites
-                    chat_id = get_current_chat_id()
-                    if chat_id and ui_state.remove_favorite(chat_id):
-                        logger.info(f"Removed chat {chat_id} from favorites")
+                if key in ('{', '}'):  # Previous / next folder
+                    ui_state.switch_folder(1 if key == '}' else -1)
+                    # Stay on the open chat if the folder shows it, else start at the top
+                    if not (current_chat and ui_state.select(current_chat_key)):
+                        ui_state.filtered_chat_idx = 0
+                    chat = get_current_chat()
+                    if current_chat and chat and chat_key(chat) != current_chat_key:
+                        leave_chat(current_chat)
+                        enter_chat(chat)
+                    logger.info(f"Switched to folder {ui_state.folder_name}")
+                elif key == '+':  # Add to favorites
+                    chat = get_current_chat()
+                    if chat and ui_state.add_favorite(chat):
+                        logger.info(f"Added chat {chat['id']} to favorites")
+                elif key == '_':  # Remove from favorites
+                    chat = get_current_chat()
+                    if chat and ui_state.remove_favorite(chat):
+                        logger.info(f"Removed chat {chat['id']} from favorites")
                 elif key == 337:  # Shift + Up
-                    filtered_chats = ui_state.filter_chats(chats)
+                    filtered_chats = ui_state.filter_chats()
                     if filtered_chats:
                         prev_idx = ui_state.filtered_chat_idx
                         ui_state.filtered_chat_idx = (ui_state.filtered_chat_idx - 1) % len(filtered_chats)
                         if prev_idx != ui_state.filtered_chat_idx:
-                            chat_id = filtered_chats[ui_state.filtered_chat_idx]['id']
-                            telegram_worker.set_current_chat(chat_id)
-                            scroll_position = 0
+                            chat = filtered_chats[ui_state.filtered_chat_idx]
+                            chat_id = chat['id']
+                            leave_chat(filtered_chats[prev_idx])
+                            enter_chat(chat)
                             logger.debug(f"Navigated to chat: {chat_id}")
                 elif key == 336:  # Shift + Down
-                    filtered_chats = ui_state.filter_chats(chats)
+                    filtered_chats = ui_state.filter_chats()
                     if filtered_chats:
                         prev_idx = ui_state.filtered_chat_idx
                         ui_state.filtered_chat_idx = (ui_state.filtered_chat_idx + 1) % len(filtered_chats)
                         if prev_idx != ui_state.filtered_chat_idx:
-                            chat_id = filtered_chats[ui_state.filtered_chat_idx]['id']
-                            telegram_worker.set_current_chat(chat_id)
-                            scroll_position = 0
+                            chat = filtered_chats[ui_state.filtered_chat_idx]
+                            chat_id = chat['id']
+                            leave_chat(filtered_chats[prev_idx])
+                            enter_chat(chat)
                             logger.debug(f"Navigated to chat: {chat_id}")
                 elif key == curses.KEY_UP:  # Up arrow - always scroll messages up to see older messages
                     if len(current_messages) > 0:
-                        # Calculate maximum scroll position
-                        max_scroll = max(0, len(current_messages) - (height - 8))
-                        new_scroll = min(scroll_position + 1, max_scroll)
-                        
-                        # Check if we need to load more messages
-                        if new_scroll >= max_scroll - SCROLL_THRESHOLD:
-                            chat_id = get_current_chat_id()
-                            if chat_id and current_messages:
-                                oldest_message_id = current_messages[0]['id']
-                                asyncio.run_coroutine_threadsafe(
-                                    telegram_worker.load_chat_history(
-                                        chat_id, 
-                                        limit=200,  # Increased from 50 to 200
-                                        before_message_id=oldest_message_id
-                                    ),
-                                    telegram_worker.loop
-                                )
-                        
-                        scroll_position = new_scroll
+                        scroll_older(1)
                 elif key == curses.KEY_DOWN:  # Down arrow - always scroll messages down to see newer messages
                     if len(current_messages) > 0:
                         scroll_position = max(0, scroll_position - 1)
+                        history_paging.scrolled(-1)
+                        if scroll_position <= SCROLL_THRESHOLD:
+                            request_newer_messages()
                 elif key == curses.KEY_MOUSE:  # Mouse scroll - always controls message history
                     try:
                         _, _, _, _, ms_id = curses.getmouse()
                         if ms_id & 0x40000:  # Scroll up - show older messages (wheel up)
                             if len(current_messages) > 0:
-                                # Calculate maximum scroll position
-                                max_scroll = max(0, len(current_messages) - (height - 8))
-                                new_scroll = min(scroll_position + 3, max_scroll)
-                                
-                                # Check if we need to load more messages
-                                if new_scroll >= max_scroll - SCROLL_THRESHOLD:
-                                    chat_id = get_current_chat_id()
-                                    if chat_id and current_messages:
-                                        oldest_message_id = current_messages[0]['id']
-                                        asyncio.run_coroutine_threadsafe(
-                                            telegram_worker.load_chat_history(
-                                                chat_id, 
-                                                limit=200,  # Increased from 50 to 200
-                                                before_message_id=oldest_message_id
-                                            ),
-                                            telegram_worker.loop
-                                        )
-                                
-                                scroll_position = new_scroll
+                                scroll_older(3)
                         elif ms_id & 0x80000:  # Scroll down - show newer messages (wheel down)
                             if len(current_messages) > 0:
                                 scroll_position = max(0, scroll_position - 3)
+                                history_paging.scrolled(-3)
+                                if scroll_position <= SCROLL_THRESHOLD:
+                                    request_newer_messages()
                     except curses.error:
                         pass
 
             # Update cursor visibility based on input focus
             curses.curs_set(1 if ui_state.input_focused else 0)
 
+            # Keep the draft current; the session store debounces the writes
+            chat = get_current_chat()
+            if chat:
+                session.set_draft(chat['account'], chat['id'], composer.text)
+
     except KeyboardInterrupt:
         logger.info("Received keyboard interrupt, shutting down...")
     except Exception as e:
         logger.error(f"Unexpected error: {e}", exc_info=True)
     finally:
         # Clean shutdown
+        sys.stdout.write('\x1b[?2004l')
+        sys.stdout.flush()
+        try:
+            chat = get_current_chat()
+            if chat:
+                leave_chat(chat)
+            session.close()
+        except Exception as e:
+            logger.error(f"Failed to save session state: {e}", exc_info=True)
         try:
-            logger.info("Stopping telegram worker...")
-            if telegram_worker:
-                telegram_worker.stop()
+            logger.info("Stopping telegram workers...")
+            if workers:
+                workers.stop()
+            if profiler:
+                profiler.stop()
             logger.info("Cleanup complete")
         except Exception as e:
             logger.error(f"Error during cleanup: {e}", exc_info=True)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Telegram terminal client")
+    parser.add_argument('--profile', nargs='?', const=PROFILE_PATH, metavar='PATH',
+                        help=f"sample the UI and worker loop threads, writing collapsed stacks to PATH "
+                             f"(default {PROFILE_PATH}) on exit")
+    args = parser.parse_args()
+    profiler = SamplingProfiler(path=args.profile) if args.profile else None
     try:
-        curses.wrapper(main)
+        curses.wrapper(main, profiler)
     except KeyboardInterrupt:
         logger.info("Interrupted by user")
     except Exception as e:
@@ -0,0 +1,90 @@
+import time
+from collections import deque
+
+MESSAGES_PER_REQUEST = 100  # Telegram returns at most this many messages per history request
+MIN_PREFETCH = 10  # Older messages are always requested this close to the top
+INITIAL_RTT = 1.0  # Seconds per request until one has been measured
+RTT_WEIGHT = 0.3  # Weight of a new round trip in the smoothed estimate
+VELOCITY_WINDOW = 2.0  # Seconds of scrolling the speed is measured over
+MIN_VELOCITY_SPAN = 0.5  # So that a single key press does not read as a fast scroll
+LEAD = 2.0  # Start loading when the top is this many fetch times away
+PENDING_TIMEOUT = 30  # Ask again if a page has not arrived by then
+
+class HistoryPaging:
+    """Decides when to load older history and how much, per scroll speed and round trip time
+
+    Loading starts once the messages above the viewport would run out, at
+    the current scroll speed, within LEAD times the time a page takes to
+    arrive; a page holds what will be scrolled past over that lead time,
+    at least a screen and at most one request. A slow reader thus gets small pages near the
+    top, and holding the up arrow gets pages big enough, early enough, that
+    the viewport never reaches the top of what is loaded. Round trips are
+    timed from request to arrival, so they include the worker's queue and
+    the daemon connection.
+    """
+    def __init__(self):
+        self.rtt = INITIAL_RTT
+        self._scrolls = deque()  # (time, messages scrolled towards older ones)
+        self._pending = {}  # chat key -> (requested at, page size)
+        self._exhausted = set()  # Chats whose oldest message is loaded
+
+    def scrolled(self, messages):
+        """Record a scroll by some messages, positive towards older ones"""
+        now = time.monotonic()
+        self._scrolls.append((now, messages))
+        while now - self._scrolls[0][0] > VELOCITY_WINDOW:
+            self._scrolls.popleft()
+
+    def velocity(self):
+        """Messages per second scrolled towards older ones, lately"""
+        now = time.monotonic()
+        while self._scrolls and now - self._scrolls[0][0] > VELOCITY_WINDOW:
+            self._scrolls.popleft()
+        if not self._scrolls:
+            return 0
+        span = max(now - self._scrolls[0][0], MIN_VELOCITY_SPAN)
+        return max(0, sum(messages for _, messages in self._scrolls)) / span
+
+    def fetch_time(self, page):
+        """Seconds a page of this size takes to arrive"""
+        return -(-page // MESSAGES_PER_REQUEST) * self.rtt
+
+    def page_size(self, screen):
+        """What is scrolled past over LEAD round trips, at least a screen
+
+        At most one request's worth: the requests of a bigger page run one
+        after another, so it would arrive no sooner than loading it in turns.
+        """
+        wanted = int(self.velocity() * LEAD * self.rtt) + 1
+        return max(screen, min(wanted, MESSAGES_PER_REQUEST))
+
+    def want_older(self, key, remaining, screen):
+        """Page size to request now for a chat with remaining messages above the viewport, or None"""
+        if key in self._exhausted:
+            return None
+        pending = self._pending.get(key)
+        if pending and time.monotonic() - pending[0] < PENDING_TIMEOUT:
+            return None
+        page = self.page_size(screen)
+        if remaining > max(MIN_PREFETCH, self.velocity() * LEAD * self.fetch_time(page)):
+            return None
+        self._pending[key] = (time.monotonic(), page)
+        return page
+
+    def loaded(self, key, older, added):
+        """Note a history page that arrived; older pages time the round trip"""
+        if not older:
+            # A fresh page, e.g. on reopening: the oldest message is no longer
+            # loaded. An older page still on its way stays pending.
+            self._exhausted.discard(key)
+            return
+        pending = self._pending.pop(key, None)
+        if pending:
+            sample = (time.monotonic() - pending[0]) / -(-pending[1] // MESSAGES_PER_REQUEST)
+            self.rtt += RTT_WEIGHT * (sample - self.rtt)
+        if added <= 0:
+            self._exhausted.add(key)
+
+    def dropped(self, key):
+        """The worker skipped or failed an older page; it may be asked for again"""
+        self._pending.pop(key, None)
@@ -0,0 +1,162 @@
+import logging
+import os
+import sys
+import threading
+import time
+from asyncio import events
+from collections import Counter
+
+from commands import CommandScheduler, running_commands
+
+logger = logging.getLogger('ui')
+
+PROFILE_INTERVAL = 0.005  # Seconds between samples
+SLOW_CALLBACK_THRESHOLD = 0.05  # Loop callbacks running longer are recorded
+PROFILE_PATH = 'profile.folded'
+MAX_STACK_DEPTH = 64
+
+# Code objects the sampler looks for on the loop thread's stack
+_HANDLE_RUN = events.Handle._run.__code__
+_COMMAND_RUN = CommandScheduler._run.__code__
+
+def frame_label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+class SamplingProfiler:
+    """Samples the stacks of the UI and event loop threads from a thread of its own
+
+    Every sample is counted under its thread and tag, and the counts are
+    written in the collapsed-stack format flamegraph.pl and speedscope read.
+    The UI thread tags itself with set_tag (cheap: one dict store); samples
+    of the loop thread are tagged with the scheduler command on the stack.
+    A loop callback seen on the stack for longer than the threshold is
+    recorded together with where it was blocked.
+    """
+    def __init__(self, interval=PROFILE_INTERVAL, slow_callback_threshold=SLOW_CALLBACK_THRESHOLD,
+                 path=PROFILE_PATH, slow_callbacks_path=None):
+        self.interval = interval
+        self.slow_callback_threshold = slow_callback_threshold
+        self.path = path
+        self.slow_callbacks_path = slow_callbacks_path or os.path.splitext(path)[0] + '_slow_callbacks.log'
+        self.counts = Counter()  # Collapsed stack -> samples
+        self.slow_callbacks = []  # (seconds, tag, callback, stack)
+        self.samples = 0
+        self._threads = {}  # Thread ident -> name
+        self._tags = {}  # Thread ident -> current tag
+        self._loop_ident = None
+        self._callback = None  # [Handle._run frame, first seen, last seen, tag, stack, callee]
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def register_thread(self, name, ident=None):
+        """Sample a thread, the calling one by default"""
+        self._threads[ident or threading.get_ident()] = name
+
+    def watch_loop(self, loop, name="loop"):
+        """Sample the thread running an asyncio loop and watch it for slow callbacks"""
+        def register():
+            self._loop_ident = threading.get_ident()
+            self.register_thread(name)
+        loop.call_soon_threadsafe(register)
+
+    def set_tag(self, tag):
+        """Tag the calling thread's samples, e.g. with the event being handled"""
+        self._tags[threading.get_ident()] = tag
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample_until_stopped, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and write the profile"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=1)
+        self._finish_callback()
+        self.write()
+
+    def _sample_until_stopped(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Profiler sample failed: {e}")
+
+    def sample(self):
+        now = time.monotonic()
+        frames = sys._current_frames()
+        self.samples += 1
+        for ident, name in list(self._threads.items()):
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            if ident == self._loop_ident:
+                self._sample_loop(frame, name, now)
+            else:
+                stack = self._stack(frame)
+                self.counts[';'.join([name, self._tags.get(ident, "-")] + stack)] += 1
+
+    def _stack(self, frame):
+        """Function labels from the outermost frame in"""
+        labels = []
+        while frame is not None and len(labels) < MAX_STACK_DEPTH:
+            labels.append(frame_label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        return labels
+
+    def _sample_loop(self, frame, name, now):
+        labels = []
+        tag = "-"
+        run_frame = None
+        callee = "?"
+        # Frames of another thread are only inspected through their code and
+        # identity: reading f_locals of a running frame is not safe
+        while frame is not None and len(labels) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            if code is _COMMAND_RUN and tag == "-":
+                handle = running_commands.get(frame)
+                tag = f"command:{handle.name}" if handle else tag
+            elif code is _HANDLE_RUN:
+                run_frame = frame
+                # What the callback runs is the frame it called
+                callee = labels[-1] if labels else callee
+            labels.append(frame_label(code))
+            frame = frame.f_back
+        labels.reverse()
+        self.counts[';'.join([name, tag] + labels)] += 1
+
+        # The same Handle._run frame on consecutive samples is one callback still running
+        if self._callback and self._callback[0] is run_frame:
+            self._callback[2] = now
+            if self._callback[5] is None and now - self._callback[1] >= self.slow_callback_threshold:
+                # Keep the stack from when it became slow: that is where it blocks
+                self._callback[3:] = [tag, labels, callee]
+            return
+        self._finish_callback()
+        if run_frame is not None:
+            self._callback = [run_frame, now, now, tag, labels, None]
+
+    def _finish_callback(self):
+        callback, self._callback = self._callback, None
+        if not callback or callback[5] is None:
+            return
+        _, first_seen, last_seen, tag, stack, description = callback
+        # Seen for (last - first) plus up to one interval either side
+        seconds = last_seen - first_seen + self.interval
+        self.slow_callbacks.append((seconds, tag, description, stack))
+        logger.warning(f"Loop callback blocked for ~{seconds * 1000:.0f} ms ({tag}): {description}")
+
+    def write(self):
+        try:
+            with open(self.path, 'w') as f:
+                for stack, count in self.counts.most_common():
+                    f.write(f"{stack} {count}\n")
+            with open(self.slow_callbacks_path, 'w') as f:
+                for seconds, tag, description, stack in sorted(self.slow_callbacks, reverse=True):
+                    f.write(f"{seconds * 1000:.0f} ms {tag} {description}\n")
+                    f.write(''.join(f"    {label}\n" for label in stack))
+            logger.info(f"Profile of {self.samples} samples written to {self.path}; "
+                        f"{len(self.slow_callbacks)} slow loop callbacks in {self.slow_callbacks_path}")
+        except Exception as e:
+            logger.error(f"Failed to write profile: {e}")
@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import threading
+
+from config import PHONE
+
+logger = logging.getLogger('telegram')
+
+STATE_PATH = 'session_state.json'
+LEGACY_FAVORITES_PATH = 'favorites.json'
+SAVE_DELAY = 1.0  # Seconds of quiet before changes are written
+
+def state_key(account, chat_id):
+    """JSON object keys must be strings"""
+    return f"{account}:{chat_id}"
+
+def parse_favorite(entry):
+    """A stored favorite as a chat key; bare ids predate multiple accounts"""
+    if isinstance(entry, int):
+        return (PHONE, entry)
+    account, chat_id = entry.rsplit(':', 1)
+    return (account, int(chat_id))
+
+class SessionState:
+    """UI state kept across restarts: favorites, drafts, scroll positions, last chat
+
+    Changes are made on the UI thread and written by a background thread once
+    they stop arriving for SAVE_DELAY seconds, so toggling favorites or typing
+    never waits on the disk. Writes go to a temp file that replaces the state
+    file, so a crash never leaves it half written.
+    """
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        self.favorites = set()  # (account, chat_id)
+        self.drafts = {}
+        self.scroll_positions = {}
+        self.last_chat = None
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._closing = False
+        self._thread = None
+        self.load()
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                self.favorites = {parse_favorite(entry) for entry in data.get('favorites', [])}
+                self.drafts = data.get('drafts', {})
+                self.scroll_positions = data.get('scroll_positions', {})
+                self.last_chat = data.get('last_chat')
+            elif os.path.exists(LEGACY_FAVORITES_PATH):
+                with open(LEGACY_FAVORITES_PATH, 'r') as f:
+                    self.favorites = {parse_favorite(entry) for entry in json.load(f)}
+            logger.info(f"Loaded session state ({len(self.favorites)} favorites, {len(self.drafts)} drafts)")
+        except Exception as e:
+            logger.error(f"Failed to load session state: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._save_when_idle, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the writer and save any pending changes"""
+        self._closing = True
+        self._changed.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=SAVE_DELAY)
+        self.save()
+
+    def _touch(self):
+        self._changed.set()
+
+    def _save_when_idle(self):
+        while not self._closing:
+            self._changed.wait()
+            # Debounce: keep waiting while changes are still coming in
+            while not self._closing:
+                self._changed.clear()
+                if not self._changed.wait(SAVE_DELAY):
+                    break
+            if not self._closing:
+                self.save()
+
+    def save(self):
+        with self._lock:
+            data = json.dumps({
+                'favorites': [state_key(*key) for key in self.favorites],
+                'drafts': dict(self.drafts),
+                'scroll_positions': dict(self.scroll_positions),
+                'last_chat': self.last_chat
+            })
+        try:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Failed to save session state: {e}")
+
+    def add_favorite(self, account, chat_id):
+        key = (account, chat_id)
+        if key in self.favorites:
+            return False
+        with self._lock:
+            self.favorites.add(key)
+        self._touch()
+        return True
+
+    def remove_favorite(self, account, chat_id):
+        key = (account, chat_id)
+        if key not in self.favorites:
+            return False
+        with self._lock:
+            self.favorites.discard(key)
+        self._touch()
+        return True
+
+    def draft(self, account, chat_id):
+        return self.drafts.get(state_key(account, chat_id), "")
+
+    def set_draft(self, account, chat_id, text):
+        key = state_key(account, chat_id)
+        # Blank drafts are not stored, so compare them as empty
+        text = text if text.strip() else ""
+        if self.drafts.get(key, "") == text:
+            return
+        with self._lock:
+            if text:
+                self.drafts[key] = text
+            else:
+                self.drafts.pop(key, None)
+        self._touch()
+
+    def scroll_position(self, account, chat_id):
+        return self.scroll_positions.get(state_key(account, chat_id), 0)
+
+    def set_scroll_position(self, account, chat_id, position):
+        key = state_key(account, chat_id)
+        if self.scroll_positions.get(key, 0) == position:
+            return
+        with self._lock:
+            if position:
+                self.scroll_positions[key] = position
+            else:
+                self.scroll_positions.pop(key, None)
+        self._touch()
+
+    def set_last_chat(self, chat):
+        last_chat = {'account': chat['account'], 'id': chat['id'], 'title': chat['title']}
+        if last_chat == self.last_chat:
+            return
+        with self._lock:
+            self.last_chat = last_chat
+        self._touch()
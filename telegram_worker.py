@@ -1,16 +1,22 @@
 import threading
 import asyncio
 import queue
-from pyrogram import Client, filters
 import logging
 from logging.handlers import RotatingFileHandler
 import time
-from PIL import Image
-import io
-import ascii_magic
 import re
+import mimetypes
+from collections import OrderedDict
 
+import config
 from config import API_ID, API_HASH, PHONE
+from downloads import DownloadManager, MAX_PARALLEL_DOWNLOADS, PRIORITY_PREVIEW
+from commands import CommandScheduler, INTERACTIVE, BACKGROUND, TRANSFER, completed_handle
+from uploads import Upload, upload_ids
+
+# Accounts hosted by this process. Defaults to the single PHONE; set ACCOUNTS
+# in config.py to watch several accounts from one UI.
+ACCOUNTS = getattr(config, 'ACCOUNTS', None) or [PHONE]
 
 # Set up rotating log files (keeps last 5 files, 1MB each)
 def setup_logging():
@@ -35,17 +41,304 @@ logger = setup_logging()
 # Shared queue for sending events to the UI thread
 ui_queue = queue.Queue()
 
-class TelegramWorker:
+# Shutdown deadlines in seconds. Exit time is bounded by their sum no matter
+# how many downloads or history loads are still in flight.
+SHUTDOWN_TASK_GRACE = 0.25  # For cancelled tasks to unwind
+SHUTDOWN_CLIENT_TIMEOUT = 0.5  # For the client to disconnect
+SHUTDOWN_JOIN_TIMEOUT = 1.0  # For the UI thread waiting on the worker thread
+
+# Catch-up after a reconnect or system sleep. A chat whose gap is larger than
+# CATCH_UP_LIMIT is reloaded from the newest page instead.
+CATCH_UP_CONCURRENCY = 2
+CATCH_UP_LIMIT = 1000
+CATCH_UP_DELAY = 2  # Seconds to let the session reconnect first
+CATCH_UP_RETRIES = 3
+# The wall clock running ahead of the monotonic clock by this much between
+# watchdog ticks means the machine was suspended
+SLEEP_WATCHDOG_INTERVAL = 5
+SLEEP_GAP_THRESHOLD = 10
+
+# A jump to an uncached date fetches one page anchored at that date, mostly
+# messages from the date onwards plus a little context before it. Telegram
+# returns at most 100 messages per history request.
+ANCHOR_PAGE_SIZE = 100
+ANCHOR_NEWER = 80
+# A chat with unread messages opens on one page starting past the last read
+# message, with this many read messages above it for context
+UNREAD_CONTEXT = 30
+MAX_HISTORY_CHUNK = 100
+
+# Sidebar metadata that dialogs do not carry (mute state, member counts, last
+# message preview) is fetched only for visible rows, in batched requests once
+# scrolling settles, and kept for DIALOG_META_TTL seconds.
+DIALOG_META_TTL = 300
+DIALOG_META_DELAY = 0.2
+DIALOG_META_BATCH = 50
+DIALOG_PREVIEW_LENGTH = 80
+
+# New chats, titles and activity are picked up by a periodic re-sync that
+# walks dialogs most recent first and stops at a run of unchanged ones, so
+# it usually costs a single page. Chats that disappear are not noticed until
+# the next start.
+DIALOG_SYNC_INTERVAL = 300
+DIALOG_SYNC_UNCHANGED_RUN = 3
+
+# Chats nobody is viewing keep only their newest messages; older history is
+# reloaded when the chat is opened. A ring is trimmed once it has doubled, so
+# trimming costs O(1) per message.
+BACKGROUND_CHAT_MESSAGES = 50
+
+# Replies show a line of the message they answer. Referenced messages that
+# are not in the loaded history are fetched once per page, in one request per
+# chat, and kept as snippets.
+REPLY_PREVIEW_LENGTH = 60
+REPLY_BATCH = 100  # Message ids per GetMessages request
+REFERENCED_MESSAGES_CACHED = 2000
+
+# Senders the UI has no name for are looked up together after this delay
+USER_RESOLVE_DELAY = 0.1
+
+# Read acknowledgements are coalesced to the highest message seen per chat and
+# sent at most once per chat per interval
+READ_ACK_INTERVAL = 2
+
+# Update handler workers per client. Handlers are coroutines on the shared
+# loop, so a few workers per account are plenty.
+CLIENT_WORKERS = 4
+
+class LRUCache:
+    """Small least-recently-used cache shared by every worker in the process"""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+class MessageIndex:
+    """Message id -> message dict for each cached message list
+
+    An index is extended as messages are appended and rebuilt only when the
+    list is replaced by a new object. Code that adds messages anywhere but
+    at the end therefore assigns a new list instead of changing it in place.
+    """
     def __init__(self):
+        self._indexes = {}  # key -> (message list, messages indexed, index)
+
+    def lookup(self, key, messages):
+        cached = self._indexes.get(key)
+        if cached and cached[0] is messages and cached[1] <= len(messages):
+            _, scanned, index = cached
+        else:
+            scanned, index = 0, {}
+        for msg in messages[scanned:]:
+            if 'id' in msg:
+                index[msg['id']] = msg
+        self._indexes[key] = (messages, len(messages), index)
+        return index
+
+    def discard(self, key):
+        self._indexes.pop(key, None)
+
+class UserDirectory:
+    """Profiles of message senders by id; messages store only the sender id
+
+    Each sender's profile is kept once however many messages reference it.
+    Profiles seen in Pyrogram users or chats are recorded by note(), which
+    collects the new and changed ones for the worker to send to the UI in
+    one users event, so a rename shows on every message without touching
+    the messages themselves.
+    """
+    def __init__(self):
+        self.profiles = {}  # sender id -> (name, last name, username)
+        self.changed = {}
+        # Events are also emitted from the UI thread (set_current_chat)
+        self._lock = threading.Lock()
+
+    def note(self, sender):
+        """Record a pyrogram or raw User or Chat and return its id"""
+        if sender is None:
+            return None
+        self.set(sender.id, getattr(sender, 'first_name', None) or getattr(sender, 'title', None),
+                 getattr(sender, 'last_name', None), getattr(sender, 'username', None))
+        return sender.id
+
+    def set(self, sender_id, name, last_name=None, username=None):
+        profile = (name or username or 'Unknown', last_name, username)
+        if self.profiles.get(sender_id) != profile:
+            with self._lock:
+                self.profiles[sender_id] = profile
+                self.changed[sender_id] = profile
+
+    def resend(self, sender_id):
+        with self._lock:
+            self.changed[sender_id] = self.profiles[sender_id]
+
+    def refresh(self, sender):
+        """Like note(), but only for senders already known"""
+        if sender.id in self.profiles:
+            self.note(sender)
+
+    def take_changed(self):
+        if not self.changed:
+            return []
+        with self._lock:
+            changed, self.changed = self.changed, {}
+        return [{'id': sender_id, 'name': name, 'last_name': last_name, 'username': username}
+                for sender_id, (name, last_name, username) in changed.items()]
+
+# Fields of a cached message that an edit replaces
+EDITABLE_FIELDS = ('text', 'caption', 'has_photo', 'photo_info', 'photo_id')
+
+# Media caches are keyed by file_unique_id, which is the same for every
+# account, so a photo seen from several accounts is downloaded once.
+photo_cache = LRUCache(32)  # file_unique_id -> PIL Image of a previewed photo
+# (file_unique_id, width, height, inline) -> str; inline thumbnails are only
+# kept here, not as decoded images
+ascii_art_cache = LRUCache(256)
+
+def report_download_stats(stats):
+    ui_queue.put({"type": "download_stats", **stats})
+
+# Shared by every account on the worker loop; downloads of a file_unique_id
+# seen from several accounts are merged like the caches above
+download_manager = DownloadManager(on_stats=report_download_stats)
+
+# Pyrogram, Pillow and ascii_magic take hundreds of milliseconds to import, so
+# they are loaded lazily: Pyrogram off the worker loop while the UI paints its
+# first frame, the image libraries only when a photo preview is first opened.
+_image_libs = None
+
+def load_image_libs():
+    """Import Pillow and ascii_magic on first use and return them"""
+    global _image_libs
+    if _image_libs is None:
+        started = time.perf_counter()
+        from PIL import Image
+        import ascii_magic
+        _image_libs = (Image, ascii_magic)
+        logger.info(f"Imported image libraries in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return _image_libs
+
+def load_pyrogram():
+    """Import Pyrogram and return Client and filters; run it off the worker loop
+
+    pyrogram.sync binds its sync wrappers to the event loop current during
+    the import. Bound to the running worker loop, every awaited call from
+    the worker thread would be resubmitted to that same loop with
+    run_coroutine_threadsafe; bound to a loop that never runs, the wrappers
+    hand the coroutine straight back to be awaited.
+    """
+    idle_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(idle_loop)
+    try:
+        from pyrogram import Client, filters
+    finally:
+        asyncio.set_event_loop(None)
+        idle_loop.close()
+    return Client, filters
+
+def report_startup_timing(phase, started):
+    """Log a startup phase and forward it to the UI's startup breakdown"""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info(f"Startup: {phase} took {elapsed_ms:.1f} ms")
+    ui_queue.put({
+        "type": "startup_timing",
+        "phase": phase,
+        "ms": elapsed_ms
+    })
+
+class TelegramWorker:
+    def __init__(self, account=PHONE):
+        self.account = account
+        self.account_label = account[-4:]  # Short tag shown in the merged sidebar
         self.app = None
         self.running = False
         self.thread = None
-        self.active_chat_id = None  # Single source of truth for current chat
+        self.active_chat_id = None  # Chat last opened, the default for sending
+        # Client -> chat open there: None for the UI in this process, one entry
+        # per UI attached to the daemon. Replaced rather than mutated, so other
+        # threads can read it while a UI switches chats.
+        self.open_chats = {}
         self.messages_per_chat = {}
         self.loop = None
         self._initialized = False
         self.messages_loading = {}
-        self.MESSAGES_PER_PAGE = 200
+        self._stop_event = None  # Created on the worker loop by run()
+        self._stop_requested = False
+        self._tasks = set()  # Tasks owned by this worker on the (possibly shared) loop
+        self.latest_message_ids = {}  # chat_id -> newest message id known to the cache
+        self._gap_snapshot = None  # latest_message_ids when updates may have been missed
+        self._catch_up_task = None
+        self.synced_dialogs = None  # chat_id -> chat info as last sent, once dialogs are loaded
+        self._dialog_sync = None
+        # Chats whose cache is a window that does not reach the newest message
+        self.detached_chats = set()
+        self._connected = None  # Created on the worker loop by _connected_event()
+        self.dialog_meta = {}  # chat_id -> (fetched at, metadata)
+        self._meta_wanted = set()
+        self._read_pending = {}  # chat_id -> highest message id seen, not yet sent
+        self._read_acked = {}  # chat_id -> highest message id acknowledged
+        self.message_index = MessageIndex()  # Keyed by chat_id
+        self.commands = None  # CommandScheduler, created with the loop by WorkerPool
+        self._read_flush = None
+        self._meta_flush = None
+        # (chat_id, message_id) -> reply snippet of messages outside the loaded history
+        self.referenced_messages = LRUCache(REFERENCED_MESSAGES_CACHED)
+        self._replies_pending = set()  # (chat_id, message_id) being fetched
+        self.users = UserDirectory()
+        self._users_wanted = set()
+        self._users_flush = None
+        self.uploads = {}  # upload id -> CommandHandle, queued or running
+
+    async def _track(self, coro):
+        # Register the task so shutdown cancels this worker's work only,
+        # not that of other accounts sharing the loop
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            return await coro
+        finally:
+            self._tasks.discard(task)
+
+    def _connected_event(self):
+        """Set once the client is connected; requests made earlier wait on it"""
+        if self._connected is None:
+            self._connected = asyncio.Event()
+        return self._connected
+
+    def _emit(self, event, client=None):
+        """Send an event to the UI tagged with this worker's account
+
+        An event answering a daemon client's command names that client, and
+        the daemon sends it to that UI only.
+        """
+        # Profiles go first so the UI can name the senders of what follows
+        self._send_users()
+        event["account"] = self.account
+        if client is not None:
+            event["client"] = client
+        ui_queue.put(event)
+
+    def _send_users(self):
+        users = self.users.take_changed()
+        if users:
+            ui_queue.put({"type": "users", "users": users, "account": self.account})
 
     def _add_message_to_chat(self, chat_id, new_message):
         """Helper to add message to chat with deduplication"""
@@ -53,13 +346,17 @@ class TelegramWorker:
             self.messages_per_chat[chat_id] = []
         
         # Check if message already exists
-        message_exists = any(msg['id'] == new_message['id'] 
-                            for msg in self.messages_per_chat[chat_id])
+        message_exists = new_message['id'] in self.message_index.lookup(chat_id, self.messages_per_chat[chat_id])
         
         if not message_exists:
-            # Add message and notify UI
-            self.messages_per_chat[chat_id].append(new_message)
-            ui_queue.put({
+            # Add message and notify UI. A detached window would get a gap, so
+            # the message is only recorded as the newest known one.
+            if chat_id not in self.detached_chats:
+                self.messages_per_chat[chat_id].append(new_message)
+                if not self.is_open(chat_id):
+                    self._trim_chat(chat_id)
+            self._note_latest(chat_id, new_message['id'])
+            self._emit({
                 "type": "new_message",
                 "chat_id": chat_id,
                 "message": new_message
@@ -67,11 +364,396 @@ class TelegramWorker:
             return True
         return False
 
+    def _apply_edit(self, chat_id, edited):
+        """Patch a cached message in place and send the changed fields to the UI"""
+        message = self.message_index.lookup(chat_id, self.messages_per_chat.get(chat_id, [])).get(edited['id'])
+        if message is None:
+            return  # Not cached; it is loaded fresh when the chat is opened
+        changes = {field: edited[field] for field in EDITABLE_FIELDS}
+        message.update(changes)
+        self._emit({
+            "type": "messages_edited",
+            "chat_id": chat_id,
+            "messages": [dict(changes, id=edited['id'])]
+        })
+
+    def _apply_deletes(self, chat_id, message_ids):
+        """Drop deleted messages from a chat's cache and tell the UI"""
+        cached = self.messages_per_chat.get(chat_id)
+        if cached:
+            index = self.message_index.lookup(chat_id, cached)
+            if any(message_id in index for message_id in message_ids):
+                # One pass however many ids were deleted
+                self.messages_per_chat[chat_id] = [msg for msg in cached if msg['id'] not in message_ids]
+        self._emit({
+            "type": "messages_deleted",
+            "chat_id": chat_id,
+            "message_ids": list(message_ids)
+        })
+
+    def _chats_with_messages(self, message_ids):
+        """Find the cached chats holding messages whose chat Telegram did not name"""
+        from pyrogram import utils
+
+        found = {}
+        for chat_id, cached in self.messages_per_chat.items():
+            # Only private chats and basic groups share the account-wide id sequence
+            if utils.get_peer_type(chat_id) == "channel":
+                continue
+            index = self.message_index.lookup(chat_id, cached)
+            hits = {message_id for message_id in message_ids if message_id in index}
+            if hits:
+                found[chat_id] = hits
+        return found
+
+    def _trim_chat(self, chat_id, slack=2):
+        """Cut a background chat back to its newest messages once it outgrows slack rings"""
+        messages = self.messages_per_chat.get(chat_id)
+        if messages and len(messages) > BACKGROUND_CHAT_MESSAGES * slack:
+            self.messages_per_chat[chat_id] = messages[-BACKGROUND_CHAT_MESSAGES:]
+
+    def is_open(self, chat_id):
+        """Whether any attached UI has the chat open, so its cache must stay whole"""
+        return chat_id in self.open_chats.values()
+
+    def _release_chat(self, chat_id):
+        """Shrink the cache of a chat that was just left"""
+        if self.is_open(chat_id):
+            return
+        if chat_id in self.detached_chats:
+            # An old window is of no use once left; the newest page loads on return
+            self.messages_per_chat.pop(chat_id, None)
+            self.message_index.discard(chat_id)
+            self.detached_chats.discard(chat_id)
+        else:
+            self._trim_chat(chat_id, slack=1)
+
+    def _note_latest(self, chat_id, message_id):
+        if message_id > self.latest_message_ids.get(chat_id, 0):
+            self.latest_message_ids[chat_id] = message_id
+
+    def _message_data(self, message, chat_id):
+        """Convert a Pyrogram message into the dict cached and sent to the UI"""
+        msg_data = {
+            'id': message.id,
+            'chat_id': chat_id,
+            'text': message.text or '',
+            'timestamp': message.date,
+            'sender_id': self.users.note(message.from_user or message.sender_chat),
+            'is_outgoing': message.outgoing,
+            'has_photo': bool(message.photo),  # Just store if message has photo
+            'photo_info': message.photo if message.photo else None,  # Store photo metadata
+            'photo_id': message.photo.file_unique_id if message.photo else None,  # Unlike photo_info, survives IPC
+            'caption': message.caption,
+            'reply_to_id': message.reply_to_message_id
+        }
+        if getattr(message, 'reply_to_message', None):
+            # Updates arrive with the replied-to message already parsed
+            msg_data['reply_to'] = self._reply_snippet(self._message_data(message.reply_to_message, chat_id))
+
+        # Set text for photo messages
+        if msg_data['has_photo']:
+            if not msg_data['text']:
+                msg_data['text'] = '📷 Photo'
+                if message.caption:
+                    msg_data['text'] += f": {message.caption}"
+        elif getattr(message, 'document', None) and not msg_data['text']:
+            msg_data['text'] = f"📎 {message.document.file_name or 'File'}"
+            if message.caption:
+                msg_data['text'] += f": {message.caption}"
+        return msg_data
+
+    def _history_event(self, chat_id, is_older_messages=False, is_newer_messages=False):
+        # The UI gets its own copy so it can append to it independently
+        return {
+            "type": "chat_history_loaded",
+            "chat_id": chat_id,
+            "messages": list(self.messages_per_chat[chat_id]),
+            "is_older_messages": is_older_messages,
+            "is_newer_messages": is_newer_messages,
+            "has_newer": chat_id in self.detached_chats
+        }
+
+    async def _history_chunk(self, chat_id, limit, offset_id=0, offset_date=None, add_offset=0):
+        """Make exactly one history request (newest first, at most 100 messages)"""
+        # get_chat_history keeps add_offset for every follow-up request, so
+        # anchored pages go through its single-request helper instead
+        from pyrogram.methods.messages.get_chat_history import get_chunk
+        kwargs = {'from_date': offset_date} if offset_date else {}
+        return await get_chunk(
+            client=self.app,
+            chat_id=chat_id,
+            limit=min(limit, MAX_HISTORY_CHUNK),
+            offset=add_offset,
+            from_message_id=offset_id,
+            **kwargs
+        )
+
+    async def load_history_at_date(self, chat_id, when, client=None):
+        """Replace a chat's cache with one page anchored at the given datetime"""
+        if chat_id in self.messages_loading:
+            self._emit({"type": "anchor_dropped", "chat_id": chat_id})
+            return
+
+        logger.info(f"Loading history for chat {chat_id} at {when}")
+        try:
+            self.messages_loading[chat_id] = True
+            await self._connected_event().wait()
+            # Negative add_offset shifts the page towards newer messages
+            page = await self._history_chunk(chat_id, ANCHOR_PAGE_SIZE, offset_date=when,
+                                             add_offset=-ANCHOR_NEWER)
+            messages = [self._message_data(message, chat_id) for message in reversed(page)]
+            if not messages:
+                self._emit({"type": "anchor_dropped", "chat_id": chat_id})
+                return
+
+            newer_count = sum(1 for msg in messages if msg['timestamp'] >= when)
+            if newer_count >= ANCHOR_NEWER or messages[-1]['id'] < self.latest_message_ids.get(chat_id, 0):
+                self.detached_chats.add(chat_id)
+            else:
+                self.detached_chats.discard(chat_id)
+                self._note_latest(chat_id, messages[-1]['id'])
+            self.messages_per_chat[chat_id] = messages
+            self._attach_replies(chat_id, messages)
+
+            anchor = next((msg for msg in messages if msg['timestamp'] >= when), messages[-1])
+            event = self._history_event(chat_id)
+            event["anchor_id"] = anchor['id']
+            self._emit(event)
+        except Exception as e:
+            logger.error(f"Error loading chat history for {chat_id} at {when}: {e}", exc_info=True)
+            self._emit({
+                "type": "error",
+                "message": f"Failed to load chat history: {str(e)}"
+            }, client)
+            self._emit({"type": "anchor_dropped", "chat_id": chat_id})
+        finally:
+            self.messages_loading.pop(chat_id, None)
+
+    async def load_unread_history(self, chat_id, unread_count, client=None):
+        """Replace a chat's cache with one page around its first unread message
+
+        The page is anchored just past the chat's read_inbox_max_id, with
+        UNREAD_CONTEXT read messages above it. A single request replaces
+        paging back through every unread message; the window then grows
+        older and newer as it is scrolled. Unless the page arrives, an
+        anchor_dropped event tells the UI to stop waiting for it.
+        """
+        if chat_id in self.messages_loading:
+            self._emit({"type": "anchor_dropped", "chat_id": chat_id})
+            return
+
+        logger.info(f"Loading history for chat {chat_id} around {unread_count} unread messages")
+        try:
+            self.messages_loading[chat_id] = True
+            await self._connected_event().wait()
+            read_max_id = await self._read_inbox_max_id(chat_id)
+            newer = ANCHOR_PAGE_SIZE - UNREAD_CONTEXT
+            # Negative add_offset shifts the page towards newer messages
+            page = await self._history_chunk(chat_id, ANCHOR_PAGE_SIZE, offset_id=read_max_id + 1,
+                                             add_offset=-newer)
+            messages = [self._message_data(message, chat_id) for message in reversed(page)]
+            if not messages:
+                self._emit({"type": "anchor_dropped", "chat_id": chat_id})
+                return
+
+            unread = [msg for msg in messages if msg['id'] > read_max_id]
+            if len(unread) >= newer or messages[-1]['id'] < self.latest_message_ids.get(chat_id, 0):
+                self.detached_chats.add(chat_id)
+            else:
+                self.detached_chats.discard(chat_id)
+                self._note_latest(chat_id, messages[-1]['id'])
+            self.messages_per_chat[chat_id] = messages
+            self._attach_replies(chat_id, messages)
+
+            # The first unread incoming message; outgoing ones past it were never unread
+            anchor = next((msg for msg in unread if not msg.get('is_outgoing')),
+                          unread[0] if unread else messages[-1])
+            event = self._history_event(chat_id)
+            event["anchor_id"] = anchor['id']
+            self._emit(event)
+        except Exception as e:
+            logger.error(f"Error loading unread history for {chat_id}: {e}", exc_info=True)
+            self._emit({
+                "type": "error",
+                "message": f"Failed to load chat history: {str(e)}"
+            }, client)
+            self._emit({"type": "anchor_dropped", "chat_id": chat_id})
+        finally:
+            self.messages_loading.pop(chat_id, None)
+
+    async def _read_inbox_max_id(self, chat_id):
+        """Id of the newest incoming message read in a chat, 0 if none"""
+        from pyrogram import raw
+
+        result = await self.app.invoke(raw.functions.messages.GetPeerDialogs(
+            peers=[raw.types.InputDialogPeer(peer=await self.app.resolve_peer(chat_id))]
+        ))
+        dialog = next((d for d in result.dialogs if isinstance(d, raw.types.Dialog)), None)
+        if dialog is None:
+            raise ValueError(f"No dialog for chat {chat_id}")
+        return dialog.read_inbox_max_id
+
+    def _mark_gap(self, reason):
+        """Remember what the cache knew when updates may have started being missed"""
+        if not self.running:
+            return
+        logger.info(f"Possible update gap ({reason}), scheduling catch-up")
+        if self._gap_snapshot is None:
+            self._gap_snapshot = dict(self.latest_message_ids)
+        else:
+            # Keep the oldest known point across repeated drops
+            for chat_id, message_id in self.latest_message_ids.items():
+                self._gap_snapshot.setdefault(chat_id, message_id)
+        if self._catch_up_task is None or self._catch_up_task.done():
+            # Runs for as long as the gap takes to close, so no deadline
+            self._catch_up_task = self.commands.submit("catch-up", self._catch_up, kind=BACKGROUND, timeout=0)
+        # Chats created while updates were missed only show up in the dialogs
+        self.loop.call_later(CATCH_UP_DELAY, self._request_dialog_sync)
+
+    async def _catch_up(self):
+        """Fetch only the messages missed by cached chats since the gap began"""
+        limit = asyncio.Semaphore(CATCH_UP_CONCURRENCY)
+
+        async def catch_up_chat(chat_id, known_id):
+            async with limit:
+                for attempt in range(CATCH_UP_RETRIES):
+                    try:
+                        await self._catch_up_chat(chat_id, known_id)
+                        return
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        logger.warning(f"Catch-up for chat {chat_id} failed (attempt {attempt + 1}): {e}")
+                        await asyncio.sleep(CATCH_UP_DELAY * 2 ** attempt)
+
+        # Gaps marked while a pass runs are handled by another pass
+        while self._gap_snapshot is not None:
+            await asyncio.sleep(CATCH_UP_DELAY)
+            snapshot, self._gap_snapshot = self._gap_snapshot, None
+            # The open chat first, then the rest by most recent activity
+            # Detached windows catch up when they are scrolled back to the present
+            chat_ids = sorted(
+                (chat_id for chat_id in snapshot
+                 if chat_id in self.messages_per_chat and chat_id not in self.detached_chats),
+                key=lambda chat_id: (not self.is_open(chat_id), -snapshot[chat_id])
+            )
+            await asyncio.gather(*(catch_up_chat(chat_id, snapshot[chat_id]) for chat_id in chat_ids))
+            logger.info(f"Caught up {len(chat_ids)} chats")
+
+    async def _catch_up_chat(self, chat_id, known_id):
+        # A background chat keeps only its newest messages, so fetch no more
+        limit = CATCH_UP_LIMIT if self.is_open(chat_id) else BACKGROUND_CHAT_MESSAGES
+        missing = []
+        async for message in self.app.get_chat_history(chat_id, limit=limit + 1):
+            if message.id <= known_id:
+                break
+            missing.append(self._message_data(message, chat_id))
+        else:
+            if len(missing) > limit and not self.is_open(chat_id):
+                self.messages_per_chat[chat_id] = list(reversed(missing[:limit]))
+                self._attach_replies(chat_id, missing)
+                self._note_latest(chat_id, missing[0]['id'])
+                self._emit(self._history_event(chat_id))
+                return
+            if len(missing) > limit:
+                # Too far behind to patch in; start over from the newest page
+                logger.info(f"Gap in chat {chat_id} exceeds {CATCH_UP_LIMIT} messages, reloading")
+                await self.load_chat_history(chat_id)
+                return
+
+        if self._merge_messages(chat_id, missing):
+            logger.info(f"Caught up {len(missing)} missed messages in chat {chat_id}")
+            self._emit(self._history_event(chat_id))
+
+    def _merge_messages(self, chat_id, new_messages):
+        """Merge messages into a cached chat in id order, skipping known ones"""
+        cached = self.messages_per_chat.setdefault(chat_id, [])
+        known = self.message_index.lookup(chat_id, cached)
+        fresh = [msg for msg in new_messages if msg['id'] not in known]
+        if not fresh:
+            return False
+        # Nearly sorted already, so this is close to linear. A new list keeps
+        # the message index valid.
+        cached = self.messages_per_chat[chat_id] = sorted(cached + fresh, key=lambda msg: msg['id'])
+        self._note_latest(chat_id, cached[-1]['id'])
+        if not self.is_open(chat_id):
+            self._trim_chat(chat_id)
+        self._attach_replies(chat_id, fresh)
+        return True
+
+    def _reply_snippet(self, msg_data):
+        return {
+            'id': msg_data['id'],
+            'sender_id': msg_data.get('sender_id'),
+            'text': ' '.join((msg_data['text'] or '').split())[:REPLY_PREVIEW_LENGTH]
+        }
+
+    def _attach_replies(self, chat_id, messages):
+        """Give replies the snippet of the message they answer
+
+        Referenced messages are looked up in the loaded history, then in the
+        referenced message cache; whatever is left is fetched in one batch.
+        """
+        history = self.message_index.lookup(chat_id, self.messages_per_chat.get(chat_id, []))
+        missing = []
+        for msg in messages:
+            reply_to_id = msg.get('reply_to_id')
+            if not reply_to_id or msg.get('reply_to'):
+                continue
+            referenced = history.get(reply_to_id)
+            if referenced is not None:
+                msg['reply_to'] = self._reply_snippet(referenced)
+                continue
+            snippet = self.referenced_messages.get((chat_id, reply_to_id))
+            if snippet is not None:
+                msg['reply_to'] = snippet
+            elif (chat_id, reply_to_id) not in self._replies_pending:
+                self._replies_pending.add((chat_id, reply_to_id))
+                missing.append(reply_to_id)
+        if missing:
+            self.commands.submit("reply context", self._resolve_replies, chat_id, missing, kind=BACKGROUND)
+
+    async def _resolve_replies(self, chat_id, message_ids):
+        try:
+            await self._connected_event().wait()
+            snippets = {}
+            for start in range(0, len(message_ids), REPLY_BATCH):
+                batch = message_ids[start:start + REPLY_BATCH]
+                for message in await self.app.get_messages(chat_id, batch, replies=0):
+                    if message.empty:
+                        snippets[message.id] = {'id': message.id, 'sender_id': None, 'text': '[deleted message]'}
+                    else:
+                        snippets[message.id] = self._reply_snippet(self._message_data(message, chat_id))
+            for message_id, snippet in snippets.items():
+                self.referenced_messages.put((chat_id, message_id), snippet)
+            for msg in self.messages_per_chat.get(chat_id, []):
+                if msg.get('reply_to_id') in snippets and not msg.get('reply_to'):
+                    msg['reply_to'] = snippets[msg['reply_to_id']]
+            logger.info(f"Resolved {len(snippets)} replied-to messages in chat {chat_id}")
+            self._emit({"type": "reply_context", "chat_id": chat_id, "messages": list(snippets.values())})
+        except Exception as e:
+            logger.error(f"Error resolving replies in chat {chat_id}: {e}")
+        finally:
+            self._replies_pending.difference_update((chat_id, message_id) for message_id in message_ids)
+
+    async def _watch_for_sleep(self):
+        """Detect system suspend, during which the connection silently drops updates"""
+        while True:
+            wall, monotonic = time.time(), time.monotonic()
+            await asyncio.sleep(SLEEP_WATCHDOG_INTERVAL)
+            drift = (time.time() - wall) - (time.monotonic() - monotonic)
+            if drift > SLEEP_GAP_THRESHOLD:
+                self._mark_gap(f"system slept for about {drift:.0f} s")
+
     async def _process_dialog(self, dialog):
         try:
             chat = dialog.chat
+            top_message = dialog.top_message
             chat_info = {
                 'id': chat.id,
+                'account': self.account,
+                'account_label': self.account_label,
                 'title': chat.title or chat.first_name or 'Unknown',
                 'messages': [],
                 'is_pinned': dialog.is_pinned,
@@ -84,54 +766,358 @@ class TelegramWorker:
                 'is_restricted': getattr(chat, 'is_restricted', False),
                 'is_scam': getattr(chat, 'is_scam', False),
                 'is_fake': getattr(chat, 'is_fake', False),
-                'member_count': getattr(chat, 'members_count', None)
+                'member_count': getattr(chat, 'members_count', None),
+                # Used to order dialogs merged from several accounts
+                'last_message_date': top_message.date if top_message and top_message.date else None
             }
             return chat_info
         except Exception as e:
             logger.error(f"Error processing dialog: {e}", exc_info=True)
             return None
 
+    async def _sync_dialogs_periodically(self):
+        while True:
+            await asyncio.sleep(DIALOG_SYNC_INTERVAL)
+            self._request_dialog_sync()
+
+    def _request_dialog_sync(self):
+        if self.synced_dialogs is None:
+            return  # Still loading them all
+        if self._dialog_sync is None or self._dialog_sync.done():
+            self._dialog_sync = self.commands.submit("dialog sync", self._sync_dialogs, kind=BACKGROUND)
+
+    async def _sync_dialogs(self):
+        """Send the dialogs changed since the last sync, newest activity first
+
+        Dialogs come most recently active first, after the pinned ones, so
+        once a few in a row are unchanged the rest are too and the walk stops
+        without fetching further pages.
+        """
+        await self._connected_event().wait()
+        changed = []
+        walked = unchanged_run = 0
+        try:
+            async for dialog in self.app.get_dialogs():
+                walked += 1
+                chat_info = await self._process_dialog(dialog)
+                if chat_info is None:
+                    continue
+                if self.synced_dialogs.get(chat_info['id']) == chat_info:
+                    if not chat_info['is_pinned']:
+                        unchanged_run += 1
+                        if unchanged_run >= DIALOG_SYNC_UNCHANGED_RUN:
+                            break
+                    continue
+                unchanged_run = 0
+                changed.append(chat_info)
+        except Exception as e:
+            # Recording part of a walk would make the next one stop short of the rest
+            logger.error(f"Error syncing dialogs: {e}")
+            return
+        logger.info(f"Dialog sync walked {walked} dialogs, {len(changed)} changed")
+        for chat_info in changed:
+            # A copy: in-process the UI updates the dicts it is sent
+            self.synced_dialogs[chat_info['id']] = dict(chat_info)
+        if changed:
+            self._emit({"type": "dialogs_changed", "chats": changed})
+
+    def mark_read(self, chat_id, max_id):
+        """Record that messages up to max_id were seen; callable from any thread"""
+        self.loop.call_soon_threadsafe(self._want_read_ack, chat_id, max_id)
+
+    def _want_read_ack(self, chat_id, max_id):
+        if max_id <= max(self._read_acked.get(chat_id, 0), self._read_pending.get(chat_id, 0)):
+            return
+        self._read_pending[chat_id] = max_id
+        if self._read_flush is None:
+            # Everything seen during the interval goes out as one call per chat
+            self._read_flush = self.loop.call_later(READ_ACK_INTERVAL, self._flush_read_acks)
+
+    def _flush_read_acks(self):
+        self._read_flush = None
+        pending, self._read_pending = self._read_pending, {}
+        self.commands.submit("read acknowledgements", self._send_read_acks, pending, kind=BACKGROUND)
+
+    async def _send_read_acks(self, pending):
+        await self._connected_event().wait()
+        for chat_id, max_id in pending.items():
+            try:
+                await self.app.read_chat_history(chat_id, max_id)
+                self._read_acked[chat_id] = max(self._read_acked.get(chat_id, 0), max_id)
+            except Exception as e:
+                logger.error(f"Error marking chat {chat_id} read up to {max_id}: {e}")
+
+    def request_users(self, user_ids):
+        """Ask for the profiles of senders the UI cannot name; callable from any thread"""
+        self.loop.call_soon_threadsafe(self._want_users, list(user_ids))
+
+    def _want_users(self, user_ids):
+        self._users_wanted.update(user_ids)
+        if self._users_flush is None:
+            self._users_flush = self.loop.call_later(USER_RESOLVE_DELAY, self._flush_users)
+
+    def _flush_users(self):
+        self._users_flush = None
+        wanted, self._users_wanted = self._users_wanted, set()
+        self.commands.submit("resolve users", self._resolve_users, wanted, kind=BACKGROUND)
+
+    async def _resolve_users(self, user_ids):
+        await self._connected_event().wait()
+        known = [user_id for user_id in user_ids if user_id in self.users.profiles]
+        # A UI attached late lacks profiles the worker has; send those again
+        for user_id in known:
+            self.users.resend(user_id)
+        unknown = [user_id for user_id in user_ids if user_id not in self.users.profiles and user_id > 0]
+        if unknown:
+            try:
+                # One request for the whole batch
+                for user in await self.app.get_users(unknown):
+                    self.users.note(user)
+            except Exception as e:
+                logger.error(f"Error resolving {len(unknown)} users: {e}")
+        self._send_users()
+
+    def request_dialog_metadata(self, chat_ids):
+        """Ask for the extra metadata of sidebar rows; callable from any thread"""
+        self.loop.call_soon_threadsafe(self._want_dialog_metadata, list(chat_ids))
+
+    def _want_dialog_metadata(self, chat_ids):
+        self._meta_wanted.update(chat_ids)
+        if self._meta_flush is None:
+            # Let a burst of scrolling settle into one batch
+            self._meta_flush = self.loop.call_later(DIALOG_META_DELAY, self._flush_dialog_metadata)
+
+    def _flush_dialog_metadata(self):
+        self._meta_flush = None
+        wanted, self._meta_wanted = self._meta_wanted, set()
+        self.commands.submit("dialog metadata", self._enrich_dialogs, wanted, kind=BACKGROUND)
+
+    async def _enrich_dialogs(self, wanted):
+        await self._connected_event().wait()
+        now = time.monotonic()
+        stale = [chat_id for chat_id in wanted
+                 if chat_id not in self.dialog_meta or now - self.dialog_meta[chat_id][0] > DIALOG_META_TTL]
+        for start in range(0, len(stale), DIALOG_META_BATCH):
+            try:
+                fetched = await self._fetch_dialog_metadata(stale[start:start + DIALOG_META_BATCH])
+            except Exception as e:
+                logger.error(f"Error fetching dialog metadata: {e}", exc_info=True)
+                continue
+            for chat_id, metadata in fetched.items():
+                self.dialog_meta[chat_id] = (now, metadata)
+        # Cached entries are sent too, e.g. for a UI that just attached
+        self._emit({
+            "type": "dialog_metadata",
+            "chats": [dict(self.dialog_meta[chat_id][1], id=chat_id)
+                      for chat_id in wanted if chat_id in self.dialog_meta]
+        })
+
+    async def _fetch_dialog_metadata(self, chat_ids):
+        """Mute state, last message and member count of chats in at most three requests"""
+        from pyrogram import raw, utils
+
+        peers = {}
+        for chat_id in chat_ids:
+            try:
+                peers[chat_id] = await self.app.resolve_peer(chat_id)
+            except Exception as e:
+                logger.debug(f"Cannot resolve chat {chat_id}: {e}")
+        if not peers:
+            return {}
+
+        metadata = {chat_id: {} for chat_id in peers}
+        result = await self.app.invoke(raw.functions.messages.GetPeerDialogs(
+            peers=[raw.types.InputDialogPeer(peer=peer) for peer in peers.values()]
+        ))
+        top_messages = {(utils.get_peer_id(m.peer_id), m.id): m
+                        for m in result.messages if getattr(m, 'peer_id', None)}
+        now = time.time()
+        for dialog in result.dialogs:
+            if not isinstance(dialog, raw.types.Dialog):
+                continue
+            chat_id = utils.get_peer_id(dialog.peer)
+            mute_until = dialog.notify_settings.mute_until or 0
+            metadata.setdefault(chat_id, {}).update({
+                'is_muted': mute_until > now,
+                'last_message_preview': self._preview_text(top_messages.get((chat_id, dialog.top_message)))
+            })
+
+        # Dialogs often lack member counts; these return them for many chats at once
+        channels = [raw.types.InputChannel(channel_id=peer.channel_id, access_hash=peer.access_hash)
+                    for peer in peers.values() if isinstance(peer, raw.types.InputPeerChannel)]
+        groups = [peer.chat_id for peer in peers.values() if isinstance(peer, raw.types.InputPeerChat)]
+        chats = []
+        if channels:
+            chats += (await self.app.invoke(raw.functions.channels.GetChannels(id=channels))).chats
+        if groups:
+            chats += (await self.app.invoke(raw.functions.messages.GetChats(id=groups))).chats
+        for chat in chats:
+            count = getattr(chat, 'participants_count', None)
+            if count is None:
+                continue
+            if isinstance(chat, raw.types.Channel):
+                chat_id = utils.get_peer_id(raw.types.PeerChannel(channel_id=chat.id))
+            else:
+                chat_id = utils.get_peer_id(raw.types.PeerChat(chat_id=chat.id))
+            metadata.setdefault(chat_id, {})['member_count'] = count
+        return metadata
+
+    async def _load_chat_folders(self):
+        """Send the account's chat folders, translated to folder specs (see folders.py)"""
+        from pyrogram import raw
+
+        try:
+            result = await self.app.invoke(raw.functions.messages.GetDialogFilters())
+        except Exception as e:
+            logger.error(f"Error loading chat folders: {e}")
+            return
+        specs = []
+        # Newer layers wrap the list in messages.DialogFilters
+        for folder in getattr(result, 'filters', result):
+            if not hasattr(folder, 'include_peers'):
+                continue  # The built-in "All chats" entry
+            title = getattr(folder.title, 'text', folder.title)
+            types = []
+            if getattr(folder, 'contacts', False) or getattr(folder, 'non_contacts', False):
+                # Contact status is not tracked here, so both mean private chats
+                types.append('private')
+            if getattr(folder, 'groups', False):
+                types += ['group', 'supergroup']
+            if getattr(folder, 'broadcasts', False):
+                types.append('channel')
+            if getattr(folder, 'bots', False):
+                types.append('bot')
+            spec = {
+                'name': title,
+                'include': self._input_peer_ids(folder.pinned_peers + folder.include_peers),
+                'exclude': self._input_peer_ids(getattr(folder, 'exclude_peers', []))
+            }
+            if types:
+                spec['types'] = types
+            if getattr(folder, 'exclude_muted', False):
+                spec['muted'] = False
+            if getattr(folder, 'exclude_read', False):
+                spec['unread'] = True
+            specs.append(spec)
+        logger.info(f"Loaded {len(specs)} chat folders")
+        self._emit({"type": "chat_folders", "folders": specs})
+
+    def _input_peer_ids(self, peers):
+        """Chat ids of the InputPeer* objects dialog filters list; other peer types are skipped"""
+        from pyrogram import raw
+
+        chat_ids = []
+        for peer in peers:
+            if isinstance(peer, (raw.types.InputPeerUser, raw.types.InputPeerUserFromMessage)):
+                chat_ids.append(peer.user_id)
+            elif isinstance(peer, raw.types.InputPeerChat):
+                chat_ids.append(-peer.chat_id)
+            elif isinstance(peer, (raw.types.InputPeerChannel, raw.types.InputPeerChannelFromMessage)):
+                chat_ids.append(-1000000000000 - peer.channel_id)
+            elif isinstance(peer, raw.types.InputPeerSelf):
+                chat_ids.append(self.app.me.id)
+            else:
+                logger.debug(f"Skipping folder peer of type {type(peer).__name__}")
+        return chat_ids
+
+    def _preview_text(self, message):
+        if message is None:
+            return None
+        text = getattr(message, 'message', None)
+        if text:
+            return ' '.join(text.split())[:DIALOG_PREVIEW_LENGTH]
+        return '[media]' if getattr(message, 'media', None) else None
+
     async def start_telegram_client(self):
-        logger.info("Starting Telegram client...")
+        logger.info(f"Starting Telegram client for account {self.account_label}...")
         try:
+            started = time.perf_counter()
+            Client, filters = await asyncio.get_running_loop().run_in_executor(None, load_pyrogram)
+            report_startup_timing("pyrogram import", started)
+
             self.app = Client(
-                name=PHONE,
-                phone_number=PHONE,
+                name=self.account,
+                phone_number=self.account,
                 api_id=API_ID,
-                api_hash=API_HASH
+                api_hash=API_HASH,
+                workers=CLIENT_WORKERS,
+                # Pyrogram allows one transfer at a time unless told otherwise
+                max_concurrent_transmissions=MAX_PARALLEL_DOWNLOADS
             )
 
+            # Coroutine handlers run on the worker loop, so the message cache
+            # is only ever touched from one thread
             @self.app.on_message(filters.incoming)
-            def handle_new_message(client, message):
+            async def handle_new_message(client, message):
                 logger.info(f"New message received from chat {message.chat.id}")
                 chat_id = message.chat.id
-                
-                new_message = {
-                    'id': message.id,
-                    'text': message.text or '[media message]',
-                    'timestamp': message.date,
-                    'from_user': message.from_user.first_name if message.from_user else 'Unknown',
-                    'is_outgoing': message.outgoing
-                }
+                # The same fields as history, so photos, captions and documents show alike
+                new_message = self._message_data(message, chat_id)
+                if not new_message['text']:
+                    new_message['text'] = '[media message]'
+                if 'reply_to' not in new_message:
+                    # Only resolved here when the update did not carry the replied-to message
+                    self._attach_replies(chat_id, [new_message])
                 
                 self._add_message_to_chat(chat_id, new_message)
 
+            # Group 1, so it runs alongside the handlers above rather than
+            # competing with them for updates
+            @self.app.on_raw_update(group=1)
+            async def handle_profile_updates(client, update, users, chats):
+                from pyrogram import raw
+                for user in users.values():
+                    self.users.refresh(user)
+                if isinstance(update, raw.types.UpdateUserName) and update.user_id in self.users.profiles:
+                    usernames = getattr(update, 'usernames', None)
+                    username = usernames[0].username if usernames else getattr(update, 'username', None)
+                    self.users.set(update.user_id, update.first_name, update.last_name, username)
+                self._send_users()
+
+            @self.app.on_edited_message()
+            async def handle_edited_message(client, message):
+                self._apply_edit(message.chat.id, self._message_data(message, message.chat.id))
+
+            @self.app.on_deleted_messages()
+            async def handle_deleted_messages(client, messages):
+                by_chat = {}
+                unplaced = set()
+                for message in messages:
+                    if message.chat:
+                        by_chat.setdefault(message.chat.id, set()).add(message.id)
+                    else:
+                        unplaced.add(message.id)
+                if unplaced:
+                    for chat_id, message_ids in self._chats_with_messages(unplaced).items():
+                        by_chat.setdefault(chat_id, set()).update(message_ids)
+                for chat_id, message_ids in by_chat.items():
+                    self._apply_deletes(chat_id, message_ids)
+
+            @self.app.on_disconnect()
+            async def handle_disconnect(client):
+                self._mark_gap("disconnected")
+
             try:
                 logger.info("Starting app...")
+                started = time.perf_counter()
                 await self.app.start()
+                report_startup_timing(f"connect {self.account_label}", started)
                 logger.info("App started successfully")
                 self._initialized = True
+                self._connected_event().set()
+                asyncio.create_task(self._track(self._watch_for_sleep()))
 
                 # Load all chats at once
                 logger.info("Loading chats...")
                 all_chats = []
                 total_loaded = 0
                 
-                ui_queue.put({
+                self._emit({
                     "type": "loading_progress",
                     "message": "Loading chats..."
                 })
                 
+                started = time.perf_counter()
                 async for dialog in self.app.get_dialogs():
                     try:
                         chat_info = await self._process_dialog(dialog)
@@ -140,7 +1126,7 @@ class TelegramWorker:
                             total_loaded += 1
                             # Send more frequent updates
                             if total_loaded % 5 == 0:  # Update every 5 chats
-                                ui_queue.put({
+                                self._emit({
                                     "type": "loading_progress",
                                     "message": f"Loading chats... ({total_loaded} loaded)"
                                 })
@@ -151,21 +1137,20 @@ class TelegramWorker:
                 # Sort chats: pinned first, then rest
                 all_chats.sort(key=lambda x: (not x['is_pinned']))
                 logger.info(f"Successfully loaded {len(all_chats)} chats")
+                self.synced_dialogs = {chat['id']: dict(chat) for chat in all_chats}
+                report_startup_timing(f"dialogs {self.account_label}", started)
                 
-                ui_queue.put({
+                self._emit({
                     "type": "chats_loaded",
                     "chats": all_chats,
                     "is_initial": True
                 })
-
-                # Keep the client running
-                self.running = True
-                while self.running:
-                    await asyncio.sleep(1)
+                self.commands.submit("chat folders", self._load_chat_folders, kind=BACKGROUND)
+                asyncio.create_task(self._track(self._sync_dialogs_periodically()))
 
             except asyncio.TimeoutError:
                 logger.error("Timeout while initializing Telegram client")
-                ui_queue.put({
+                self._emit({
                     "type": "error",
                     "message": "Timeout while connecting to Telegram"
                 })
@@ -173,34 +1158,31 @@ class TelegramWorker:
 
         except Exception as e:
             logger.error(f"Error in start_telegram_client: {e}", exc_info=True)
-            ui_queue.put({
+            self._emit({
                 "type": "error",
                 "message": f"Failed to start Telegram client: {str(e)}"
             })
             raise
 
-    async def download_photo(self, message):
-        """Download photo and convert to PIL Image"""
+    async def download_photo(self, photo, priority=PRIORITY_PREVIEW):
+        """Download a photo through the download manager and open it with PIL"""
         try:
-            if message.photo:
-                logger.info(f"Downloading photo from message {message.id}")
-                # Get photo dimensions
-                photo = message.photo
-                logger.info(f"Photo size: {photo.width}x{photo.height}")
-                
-                # Download the photo directly
-                photo_bytes = await message.download(in_memory=True)
-                logger.info(f"Downloaded photo bytes: {len(photo_bytes.getvalue())}")
-                
-                # Convert to PIL Image
-                image = Image.open(io.BytesIO(photo_bytes.getvalue()))
-                logger.info(f"Converted to PIL Image: {image.size}")
-                return image
-                
+            logger.info(f"Downloading photo {photo.file_unique_id} ({photo.width}x{photo.height})")
+            path = await download_manager.fetch(self.app, photo.file_id, photo.file_unique_id, priority)
+            # Decoding is CPU bound; keep it off the loop shared by all accounts
+            return await asyncio.get_running_loop().run_in_executor(None, self._open_image, path)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"Error downloading photo: {e}", exc_info=True)
             return None
-        return None
+
+    def _open_image(self, path):
+        Image, _ = load_image_libs()
+        image = Image.open(path)
+        image.load()
+        logger.info(f"Opened image {path}: {image.size}")
+        return image
 
     def _create_ascii_art(self, image, max_width, max_height=None):
         """Create ASCII art version of image"""
@@ -223,6 +1205,7 @@ class TelegramWorker:
             logger.info(f"Adjusted width to {new_w} for aspect ratio {aspect_ratio}")
             
             # Create ASCII art with basic settings
+            _, ascii_magic = load_image_libs()
             ascii_img_obj = ascii_magic.from_pillow_image(image)
             logger.info("Created ASCII art object")
             
@@ -243,10 +1226,18 @@ class TelegramWorker:
             logger.error(f"Error creating ASCII art: {e}", exc_info=True)
             return "[image conversion failed]"
 
-    async def load_chat_history(self, chat_id, limit=200, before_message_id=None):
+    async def load_chat_history(self, chat_id, limit=200, before_message_id=None, after_message_id=None,
+                                client=None):
         """Load chat history with pagination support"""
-        # Only load history for active chat
-        if not self.app or chat_id != self.active_chat_id or chat_id in self.messages_loading:
+        if after_message_id:
+            await self._load_newer_messages(chat_id, limit, after_message_id, client)
+            return
+
+        # Any chat a UI asks for is loaded and cached, since several UIs
+        # attached to a daemon may each have a different chat open
+        if chat_id in self.messages_loading:
+            if before_message_id:
+                self._emit({"type": "older_history_dropped", "chat_id": chat_id})
             return
 
         logger.info(f"Loading history for chat {chat_id}" + 
@@ -254,43 +1245,29 @@ class TelegramWorker:
         
         try:
             self.messages_loading[chat_id] = True
+            # The chat restored at startup is requested before the client is up;
+            # its history then loads alongside the dialog list
+            await self._connected_event().wait()
             messages = []
             
-            # Use offset parameter for pagination
+            # Page backwards from the oldest cached message; this also works when
+            # the cache is a window that does not reach the newest message
             kwargs = {
                 'chat_id': chat_id,
                 'limit': limit,
-                'offset': 0 if before_message_id is None else len(self.messages_per_chat.get(chat_id, []))
+                'offset_id': before_message_id or 0
             }
             
             async for message in self.app.get_chat_history(**kwargs):
                 try:
-                    msg_data = {
-                        'id': message.id,
-                        'text': message.text or '',
-                        'timestamp': message.date,
-                        'from_user': message.from_user.first_name if message.from_user else 'Unknown',
-                        'is_outgoing': message.outgoing,
-                        'has_photo': bool(message.photo),  # Just store if message has photo
-                        'photo_info': message.photo if message.photo else None,  # Store photo metadata
-                        'caption': message.caption
-                    }
-
-                    # Set text for photo messages
-                    if msg_data['has_photo']:
-                        if not msg_data['text']:
-                            msg_data['text'] = '📷 Photo'
-                            if message.caption:
-                                msg_data['text'] += f": {message.caption}"
-                            logger.info(f"Set message text to: {msg_data['text']}")
-
+                    msg_data = self._message_data(message, chat_id)
                     messages.append(msg_data)
                     
                 except Exception as e:
                     logger.error(f"Error processing message {message.id}: {str(e)}", exc_info=True)
                     continue
             
-            if messages and chat_id == self.active_chat_id:
+            if messages:
                 if chat_id not in self.messages_per_chat:
                     self.messages_per_chat[chat_id] = []
                 
@@ -305,190 +1282,415 @@ class TelegramWorker:
                 else:
                     # For initial load
                     self.messages_per_chat[chat_id] = messages
+                    self.latest_message_ids[chat_id] = messages[-1]['id']
+                    self.detached_chats.discard(chat_id)
+                self._attach_replies(chat_id, messages)
                 
                 logger.info(f"Loaded {len(messages)} messages for chat {chat_id}")
-                ui_queue.put({
-                    "type": "chat_history_loaded",
-                    "chat_id": chat_id,
-                    "messages": self.messages_per_chat[chat_id],
-                    "is_older_messages": bool(before_message_id)
-                })
+                self._emit(self._history_event(chat_id, bool(before_message_id)))
+            elif before_message_id and chat_id in self.messages_per_chat:
+                # Tells the UI the oldest message is loaded, so it stops asking
+                self._emit(self._history_event(chat_id, is_older_messages=True))
             
         except Exception as e:
             logger.error(f"Error loading chat history for {chat_id}: {str(e)}", exc_info=True)
-            ui_queue.put({
+            self._emit({
                 "type": "error",
                 "message": f"Failed to load chat history: {str(e)}"
-            })
+            }, client)
+            if before_message_id:
+                # Lets the UI ask for the page again
+                self._emit({"type": "older_history_dropped", "chat_id": chat_id})
         finally:
             self.messages_loading.pop(chat_id, None)
 
-    def send_message(self, text):
-        if self.active_chat_id and self.app:  # Use active_chat_id instead of current_chat_id
-            # Schedule the async send_message in the event loop
-            asyncio.run_coroutine_threadsafe(
-                self.async_send_message(text),
-                self.loop
-            )
+    async def _load_newer_messages(self, chat_id, limit, after_message_id, client=None):
+        """Extend a detached window towards the present by one request"""
+        if not self.app or chat_id in self.messages_loading:
+            return
+        try:
+            self.messages_loading[chat_id] = True
+            limit = min(limit, MAX_HISTORY_CHUNK)
+            page = await self._history_chunk(chat_id, limit, offset_id=after_message_id, add_offset=-limit)
+            messages = [self._message_data(message, chat_id) for message in reversed(page)
+                        if message.id > after_message_id]
+            if len(messages) < limit - 1:
+                # Reached the newest message; live updates apply again
+                self.detached_chats.discard(chat_id)
+            if self._merge_messages(chat_id, messages) or chat_id not in self.detached_chats:
+                logger.info(f"Loaded {len(messages)} newer messages for chat {chat_id}")
+                self._emit(self._history_event(chat_id, is_newer_messages=True))
+        except Exception as e:
+            logger.error(f"Error loading newer messages for {chat_id}: {e}", exc_info=True)
+            self._emit({
+                "type": "error",
+                "message": f"Failed to load chat history: {str(e)}"
+            }, client)
+        finally:
+            self.messages_loading.pop(chat_id, None)
 
-    async def async_send_message(self, text):
+    def send_message(self, text, chat_id=None, client=None):
+        chat_id = chat_id or self.active_chat_id
+        return self.commands.submit("send message", self.async_send_message, text, chat_id, client)
+
+    async def async_send_message(self, text, chat_id=None, client=None):
+        chat_id = chat_id or self.active_chat_id
+        await self._connected_event().wait()
         try:
-            sent_message = await self.app.send_message(self.active_chat_id, text)
-            
-            new_message = {
-                'id': sent_message.id,
-                'text': sent_message.text,
-                'timestamp': sent_message.date,
-                'from_user': 'You',
-                'is_outgoing': True
-            }
-            
-            self._add_message_to_chat(self.active_chat_id, new_message)
+            sent_message = await self.app.send_message(chat_id, text)
+            # The same fields as history, so the sent message needs no reload
+            self._add_message_to_chat(chat_id, self._message_data(sent_message, chat_id))
+            if chat_id in self.detached_chats:
+                # Sending from an old window returns the chat to the present
+                await self.load_chat_history(chat_id, client=client)
         except Exception as e:
             logger.error(f"Error sending message: {e}")
-            ui_queue.put({
+            self._emit({
                 "type": "error",
                 "message": f"Failed to send message: {e}"
-            })
+            }, client)
+
+    def send_file(self, path, chat_id=None, caption="", client=None):
+        """Upload a file from disk and send it as a document, behind other commands
+
+        Progress is reported with upload_progress events carrying the
+        upload_id that cancel_upload takes.
+        """
+        chat_id = chat_id or self.active_chat_id
+        try:
+            upload = Upload(next(upload_ids), path, lambda stats: self._report_upload(stats, client=client))
+        except (OSError, ValueError) as e:
+            self._emit({"type": "error", "message": f"Cannot send {path}: {e}"}, client)
+            return completed_handle("upload file", TRANSFER)
+        self._report_upload(upload.stats(), "queued", client)
+        handle = self.commands.submit("upload file", self.async_send_file, upload, chat_id, caption, client,
+                                      kind=TRANSFER)
+        self.uploads[upload.upload_id] = handle
+
+        def finished(future):
+            self.uploads.pop(upload.upload_id, None)
+            if future.cancelled():
+                # Cancelled while queued, so the command never reported it
+                self._report_upload(upload.stats(), "cancelled", client)
+        handle.add_done_callback(finished)
+        return handle
 
-    def set_current_chat(self, chat_id):
-        """Switch to a different chat and load its history"""
+    def cancel_upload(self, upload_id):
+        handle = self.uploads.get(upload_id)
+        if handle:
+            handle.cancel()
+
+    def _report_upload(self, stats, state="uploading", client=None):
+        self._emit({"type": "upload_progress", **stats, "state": state}, client)
+
+    async def async_send_file(self, upload, chat_id, caption="", client=None):
+        await self._connected_event().wait()
+        started = time.monotonic()
+        self._report_upload(upload.stats(), client=client)
+        try:
+            input_file = await upload.run(self.app)
+            self._report_upload(upload.stats(), "sending", client)
+            sent_message = await self._send_document(chat_id, upload, input_file, caption)
+        except asyncio.CancelledError:
+            logger.info(f"Upload of {upload.name} cancelled after {upload.sent} bytes")
+            self._report_upload(upload.stats(), "cancelled", client)
+            raise
+        except Exception as e:
+            logger.error(f"Error sending file {upload.path}: {e}", exc_info=True)
+            self._report_upload(upload.stats(), "failed", client)
+            self._emit({
+                "type": "error",
+                "message": f"Failed to send {upload.name}: {e}"
+            }, client)
+            return
+        elapsed = time.monotonic() - started
+        logger.info(f"Sent {upload.name}: {upload.size / 1048576:.1f} MiB in {elapsed:.1f}s "
+                    f"({upload.size / 1048576 / max(elapsed, 0.001):.1f} MiB/s)")
+        self._report_upload(upload.stats(), "done", client)
+        if sent_message:
+            self._add_message_to_chat(chat_id, self._message_data(sent_message, chat_id))
+            if chat_id in self.detached_chats:
+                await self.load_chat_history(chat_id, client=client)
+
+    async def _send_document(self, chat_id, upload, input_file, caption):
+        """Send an uploaded file as a document and return the sent message"""
+        from pyrogram import raw, types
+
+        mime_type = mimetypes.guess_type(upload.name)[0] or 'application/octet-stream'
+        result = await self.app.invoke(raw.functions.messages.SendMedia(
+            peer=await self.app.resolve_peer(chat_id),
+            media=raw.types.InputMediaUploadedDocument(
+                file=input_file,
+                mime_type=mime_type,
+                attributes=[raw.types.DocumentAttributeFilename(file_name=upload.name)]
+            ),
+            message=caption or "",
+            random_id=self.app.rnd_id()
+        ))
+        users = {user.id: user for user in result.users}
+        chats = {chat.id: chat for chat in result.chats}
+        for update in result.updates:
+            if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+                return await types.Message._parse(self.app, update.message, users, chats, replies=0)
+        return None
+
+    def set_current_chat(self, chat_id, unread_count=0, client=None):
+        """Switch a client to a different chat and load its history, around the first unread message if any"""
         logger.info(f"Setting current chat to {chat_id}")
         
-        # Clear previous chat's messages if switching to a different chat
-        if self.active_chat_id != chat_id:
-            self.messages_per_chat = {}  # Clear message cache
-            self.active_chat_id = chat_id
+        previous_chat_id = self.open_chats.get(client)
+        self.active_chat_id = chat_id
+        self.open_chats = {**self.open_chats, client: chat_id}
+        if previous_chat_id is not None and previous_chat_id != chat_id:
+            self.loop.call_soon_threadsafe(self._release_chat, previous_chat_id)
+
+        # Serve a warm cache right away; the load below refreshes it
+        if chat_id in self.messages_per_chat:
+            self._emit(self._history_event(chat_id))
         
         # Schedule chat history loading in the event loop
-        asyncio.run_coroutine_threadsafe(
-            self.load_chat_history(chat_id),
-            self.loop
-        )
+        if unread_count:
+            return self.commands.submit("load unread history", self.load_unread_history, chat_id, unread_count,
+                                        client, timeout=self._load_timeout())
+        return self.request_history(chat_id, client=client)
 
-    def stop(self):
-        """Properly stop the worker and cleanup resources"""
-        logger.info("Stopping worker...")
+    def close_client(self, client):
+        """Forget a detached client's open chat"""
+        open_chats = dict(self.open_chats)
+        chat_id = open_chats.pop(client, None)
+        self.open_chats = open_chats
+        if chat_id is not None:
+            self.loop.call_soon_threadsafe(self._release_chat, chat_id)
+
+    # Commands for the UI. Each returns a CommandHandle that can be waited on
+    # with a deadline or cancelled; interactive ones run ahead of background work.
+
+    def request_history(self, chat_id, limit=200, before_message_id=None, after_message_id=None, client=None):
+        """Load the newest page, an older page, or a newer page of a detached window"""
+        return self.commands.submit("load history", self.load_chat_history, chat_id, limit,
+                                    before_message_id, after_message_id, client, timeout=self._load_timeout())
+
+    def request_history_at(self, chat_id, when, client=None):
+        return self.commands.submit("jump to date", self.load_history_at_date, chat_id, when, client,
+                                    timeout=self._load_timeout())
+
+    def _load_timeout(self):
+        """No deadline for loads asked for before the client is up, e.g. the chat restored at startup
+
+        They wait for the connection first, which on a slow network can take
+        longer than the interactive deadline, and are not asked for again.
+        """
+        connected = self._connected is not None and self._connected.is_set()
+        return None if connected else 0
+
+    def request_photo(self, message_data, max_width, max_height=None, priority=PRIORITY_PREVIEW):
+        """Render a photo as ASCII art; only previews are interactive"""
+        kind = INTERACTIVE if priority == PRIORITY_PREVIEW else BACKGROUND
+        return self.commands.submit("render photo", self.render_photo, message_data, max_width,
+                                    max_height, priority, kind=kind)
+
+    async def run(self):
+        """Run the client until stop() is called, then shut down on this loop"""
+        self._stop_event = asyncio.Event()
+        if self._stop_requested:
+            # stop() ran before the event existed
+            self._stop_event.set()
+        self.running = True
+        client_task = asyncio.create_task(self._track(self.start_telegram_client()))
+        client_task.add_done_callback(self._log_client_task_result)
+        await self._stop_event.wait()
+        await self._shutdown()
+
+    def _log_client_task_result(self, task):
+        # start_telegram_client already reports failures to the UI
+        if not task.cancelled() and task.exception():
+            logger.debug(f"Client startup task ended with: {task.exception()}")
+
+    def request_stop(self):
+        """Ask the worker to shut down without waiting for it"""
+        logger.info(f"Stopping worker for account {self.account_label}...")
         self.running = False
-        
-        if self.loop and self.loop.is_running():
-            try:
-                # Schedule app stop in the event loop
-                if self.app:
-                    future = asyncio.run_coroutine_threadsafe(self.app.stop(), self.loop)
-                    try:
-                        # Wait with timeout for app to stop
-                        future.result(timeout=3)
-                    except Exception as e:
-                        logger.error(f"Error stopping app: {e}")
-                
-                # Cancel all pending tasks
-                for task in asyncio.all_tasks(self.loop):
-                    task.cancel()
-                
-                # Run loop one last time to process cancellations
-                self.loop.call_soon_threadsafe(lambda: asyncio.create_task(self._shutdown()))
-                
-                # Wait for thread to finish
-                if self.thread and self.thread.is_alive():
-                    self.thread.join(timeout=5)
-                    
-            except Exception as e:
-                logger.error(f"Error during shutdown: {e}", exc_info=True)
-            finally:
-                # Ensure loop is closed
-                if not self.loop.is_closed():
-                    self.loop.stop()
-                    self.loop.close()
-        
+        self._stop_requested = True
+
+        try:
+            if self.loop and not self.loop.is_closed() and self._stop_event:
+                # All cancellation happens on the loop's own thread in _shutdown
+                self.loop.call_soon_threadsafe(self._stop_event.set)
+        except RuntimeError:
+            # Loop closed between the check and the call
+            pass
+
+    def stop(self):
+        """Stop the worker within a fixed time bound"""
+        self.request_stop()
+
+        if self.thread and self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=SHUTDOWN_JOIN_TIMEOUT)
+            if self.thread.is_alive():
+                # The thread is a daemon, so it will not keep the process alive
+                logger.warning("Worker thread did not finish in time, abandoning it")
+
         logger.info("Worker stopped")
 
     async def _shutdown(self):
-        """Clean async shutdown sequence"""
+        """Cancel in-flight work, flush persistent state and disconnect"""
         try:
-            # Cancel all tasks
-            tasks = [t for t in asyncio.all_tasks(self.loop) if t is not asyncio.current_task()]
+            self.commands.close()
+            tasks = [t for t in self._tasks if t is not asyncio.current_task()]
             for task in tasks:
                 task.cancel()
-            
-            # Wait for all tasks to complete
             if tasks:
-                await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # Stop the loop
-            self.loop.stop()
+                _, pending = await asyncio.wait(tasks, timeout=SHUTDOWN_TASK_GRACE)
+                if pending:
+                    logger.warning(f"{len(pending)} tasks did not finish cancelling in time")
+
+            # Downloads other accounts also wait on carry on over them
+            download_manager.release(self.app)
+            await self._flush_persistence()
+
+            if self.app and self._initialized:
+                try:
+                    await asyncio.wait_for(self.app.stop(), timeout=SHUTDOWN_CLIENT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.warning("Client did not disconnect in time")
+                except Exception as e:
+                    logger.error(f"Error stopping app: {e}")
         except Exception as e:
             logger.error(f"Error in shutdown sequence: {e}", exc_info=True)
 
-    async def get_message_photo(self, message_data):
+    async def _flush_persistence(self):
+        """Write state that must survive a restart before disconnecting"""
+        if self.app and self._initialized:
+            try:
+                # Session storage holds auth keys and the peer cache
+                await self.app.storage.save()
+            except Exception as e:
+                logger.error(f"Error saving session storage: {e}")
+
+    async def get_message_photo(self, message_data, priority=PRIORITY_PREVIEW):
         """Fetch photo data for a message on demand"""
         try:
             if message_data.get('has_photo') and message_data.get('photo_info'):
-                logger.info(f"Fetching photo for message {message_data['id']}")
-                
-                # Create a dummy message object that has the photo data
-                class DummyMessage:
-                    def __init__(self, photo, msg_id, app):
-                        self.photo = photo
-                        self.id = msg_id
-                        self._client = app  # Add reference to Pyrogram client
-                    async def download(self, in_memory=True):
-                        # Use Pyrogram's file_id to download
-                        return await self._client.download_media(
-                            self.photo.file_id,
-                            in_memory=in_memory
-                        )
-                
-                dummy_msg = DummyMessage(
-                    message_data['photo_info'],
-                    message_data['id'],
-                    self.app  # Pass the Pyrogram client
-                )
-                image = await self.download_photo(dummy_msg)
-                
-                if image:
-                    logger.info(f"Successfully fetched photo for message {message_data['id']}")
-                    return {
-                        'type': 'photo',
-                        'data': image,
-                        'caption': message_data.get('caption', '')
-                    }
+                file_unique_id = message_data['photo_info'].file_unique_id
+                image = photo_cache.get(file_unique_id)
+                if image is None:
+                    logger.info(f"Fetching photo for message {message_data['id']}")
+                    image = await self.download_photo(message_data['photo_info'], priority)
+                    if image is None:
+                        return None
+                    photo_cache.put(file_unique_id, image)
+                return {
+                    'type': 'photo',
+                    'data': image,
+                    'caption': message_data.get('caption', '')
+                }
         except Exception as e:
             logger.error(f"Error fetching photo: {e}", exc_info=True)
         return None
 
-def run_telegram_worker():
-    worker = TelegramWorker()
-    
-    def run_worker():
-        try:
-            worker.loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(worker.loop)
-            worker.running = True
-            
-            try:
-                worker.loop.run_until_complete(worker.start_telegram_client())
-            except RuntimeError as e:
-                if "Event loop stopped before Future completed" in str(e):
-                    # This is expected during shutdown
-                    logger.debug("Event loop stopped during shutdown")
-                else:
-                    raise
-            except Exception as e:
-                logger.error(f"Error in telegram client: {e}", exc_info=True)
-                ui_queue.put({
-                    "type": "error",
-                    "message": f"Telegram client error: {e}"
-                })
-        finally:
+    def _thumbnail_for(self, photo, max_width):
+        """The smallest thumbnail at least max_width pixels wide, else the largest one"""
+        thumbs = sorted(photo.thumbs or [], key=lambda thumb: thumb.width)
+        return next((thumb for thumb in thumbs if thumb.width >= max_width), thumbs[-1] if thumbs else None)
+
+    async def render_photo(self, message_data, max_width, max_height=None, priority=PRIORITY_PREVIEW):
+        """Return a message's photo as ASCII art, using the shared media caches
+
+        Previews render the full-size photo. Inline thumbnails (any other
+        priority) render the smallest of its thumbnails that is wide enough,
+        and the decoded thumbnail is dropped once rendered.
+        """
+        photo = message_data.get('photo_info')
+        if not message_data.get('has_photo') or not photo:
+            return None
+
+        inline = priority != PRIORITY_PREVIEW
+        key = (photo.file_unique_id, max_width, max_height, inline)
+        ascii_art = ascii_art_cache.get(key)
+        if ascii_art is None:
+            if inline:
+                thumb = self._thumbnail_for(photo, max_width)
+                image = await self.download_photo(thumb, priority) if thumb else None
+            else:
+                photo_data = await self.get_message_photo(message_data, priority)
+                image = photo_data['data'] if photo_data else None
+            if image is None:
+                return None
+            # Conversion is CPU bound; keep it off the loop shared by all accounts
+            ascii_art = await asyncio.get_running_loop().run_in_executor(
+                None, self._create_ascii_art, image, max_width, max_height
+            )
+            if ascii_art != "[image conversion failed]":
+                ascii_art_cache.put(key, ascii_art)
+        return ascii_art
+
+class WorkerPool:
+    """Several TelegramWorker sessions sharing one thread and event loop"""
+    def __init__(self, accounts):
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+        self.workers = {}
+        for account in accounts:
+            worker = TelegramWorker(account)
+            worker.loop = self.loop
+            worker.commands = CommandScheduler(self.loop, track=worker._track)
+            self.workers[account] = worker
+
+    def get(self, account):
+        return self.workers.get(account)
+
+    def __iter__(self):
+        return iter(self.workers.values())
+
+    @property
+    def is_multi_account(self):
+        return len(self.workers) > 1
+
+    def start(self):
+        def run_workers():
             try:
-                # Ensure all resources are cleaned up
-                if not worker.loop.is_closed():
-                    worker.loop.run_until_complete(worker.loop.shutdown_asyncgens())
-                    worker.loop.close()
-            except Exception as e:
-                logger.error(f"Error during final cleanup: {e}", exc_info=True)
+                asyncio.set_event_loop(self.loop)
+                try:
+                    self.loop.run_until_complete(
+                        asyncio.gather(*(worker.run() for worker in self))
+                    )
+                except Exception as e:
+                    logger.error(f"Error in telegram client: {e}", exc_info=True)
+                    ui_queue.put({
+                        "type": "error",
+                        "message": f"Telegram client error: {e}"
+                    })
+            finally:
+                try:
+                    # Ensure all resources are cleaned up
+                    if not self.loop.is_closed():
+                        self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+                        self.loop.close()
+                except Exception as e:
+                    logger.error(f"Error during final cleanup: {e}", exc_info=True)
+
+        self.thread = threading.Thread(target=run_workers, daemon=True)
+        for worker in self:
+            worker.thread = self.thread
+        self.thread.start()
+
+    def stop(self):
+        """Stop every worker, waiting for the shared thread only once"""
+        for worker in self:
+            worker.request_stop()
+
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=SHUTDOWN_JOIN_TIMEOUT)
+            if self.thread.is_alive():
+                logger.warning("Worker thread did not finish in time, abandoning it")
+
+        logger.info("Workers stopped")
+
+def run_telegram_workers(accounts=None):
+    """Start workers for the given accounts (config ACCOUNTS by default)"""
+    pool = WorkerPool(accounts or ACCOUNTS)
+    pool.start()
+    return pool
 
-    worker.thread = threading.Thread(target=run_worker, daemon=True)
-    worker.thread.start()
-    return worker
+def run_telegram_worker(account=PHONE):
+    return run_telegram_workers([account]).get(account)
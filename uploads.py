@@ -0,0 +1,124 @@
+import asyncio
+import itertools
+import os
+import time
+from collections import deque
+
+PART_SIZE = 512 * 1024  # The largest part Telegram accepts
+BIG_FILE_SIZE = 10 * 1024 * 1024  # Larger files are uploaded as "big" files
+# Upload connections and parts in flight on each, for big and small files.
+# Several connections matter: one connection's window caps throughput well
+# below what the official clients reach on large files.
+UPLOAD_SESSIONS = {True: 4, False: 1}
+PARTS_IN_FLIGHT = 2
+THROUGHPUT_WINDOW = 5.0  # Seconds averaged for the reported throughput
+STATS_INTERVAL = 0.5  # Minimum seconds between progress reports
+
+upload_ids = itertools.count(1)  # Unique across the accounts of a process
+
+class Upload:
+    """One file streamed to Telegram in parts, several at a time
+
+    Parts are read with positional reads in the default executor, so no more
+    than the parts in flight are ever in memory and the loop never waits on
+    the disk. They go out over upload connections of their own, so sending
+    text on the main connection is never queued behind them. Cancelling
+    run() stops every part and closes the connections.
+    """
+    def __init__(self, upload_id, path, on_progress=None):
+        self.upload_id = upload_id
+        self.path = path
+        self.name = os.path.basename(path)
+        if not os.path.isfile(path):
+            raise ValueError(f"{path} is not a file")
+        self.size = os.path.getsize(path)
+        if self.size == 0:
+            raise ValueError(f"{self.name} is empty")
+        self.sent = 0
+        self.on_progress = on_progress
+        self._samples = deque()  # (time, bytes) acknowledged within the window
+        self._last_report = 0
+
+    @property
+    def is_big(self):
+        return self.size > BIG_FILE_SIZE
+
+    @property
+    def parts(self):
+        return max(1, -(-self.size // PART_SIZE))
+
+    async def run(self, client):
+        """Upload every part and return the InputFile to send"""
+        from pyrogram import raw
+        from pyrogram.session import Session
+
+        file_id = client.rnd_id()
+        sessions = [
+            Session(client, await client.storage.dc_id(), await client.storage.auth_key(),
+                    await client.storage.test_mode(), is_media=True)
+            for _ in range(UPLOAD_SESSIONS[self.is_big])
+        ]
+        fd = os.open(self.path, os.O_RDONLY)
+        loop = asyncio.get_running_loop()
+        parts = iter(range(self.parts))  # Shared, so each part is taken once
+
+        async def send_parts(session):
+            for part in parts:
+                data = await loop.run_in_executor(None, os.pread, fd, PART_SIZE, part * PART_SIZE)
+                if self.is_big:
+                    rpc = raw.functions.upload.SaveBigFilePart(
+                        file_id=file_id, file_part=part, file_total_parts=self.parts, bytes=data)
+                else:
+                    rpc = raw.functions.upload.SaveFilePart(file_id=file_id, file_part=part, bytes=data)
+                # The session retries a part itself across reconnects and short flood waits
+                await session.invoke(rpc)
+                self._sent(len(data))
+
+        try:
+            await asyncio.gather(*(session.start() for session in sessions))
+            workers = [asyncio.ensure_future(send_parts(session))
+                       for session in sessions for _ in range(PARTS_IN_FLIGHT)]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                # One failed part fails the upload; stop the others with it
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            os.close(fd)
+            await asyncio.gather(*(session.stop() for session in sessions), return_exceptions=True)
+
+        self._report(force=True)
+        if self.is_big:
+            return raw.types.InputFileBig(id=file_id, parts=self.parts, name=self.name)
+        # The checksum is optional; leaving it out saves a second pass over the file
+        return raw.types.InputFile(id=file_id, parts=self.parts, name=self.name, md5_checksum='')
+
+    def _sent(self, size):
+        self.sent += size
+        self._samples.append((time.monotonic(), size))
+        self._report()
+
+    def stats(self):
+        now = time.monotonic()
+        while self._samples and now - self._samples[0][0] > THROUGHPUT_WINDOW:
+            self._samples.popleft()
+        elapsed = min(THROUGHPUT_WINDOW, now - self._samples[0][0]) if self._samples else 0
+        return {
+            'upload_id': self.upload_id,
+            'name': self.name,
+            'sent': self.sent,
+            'size': self.size,
+            'bytes_per_second': sum(size for _, size in self._samples) / max(elapsed, STATS_INTERVAL)
+        }
+
+    def _report(self, force=False):
+        """Pass stats to on_progress, at most every STATS_INTERVAL while parts arrive"""
+        if self.on_progress is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_report < STATS_INTERVAL:
+            return
+        self._last_report = now
+        self.on_progress(self.stats())